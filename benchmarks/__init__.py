@@ -0,0 +1,7 @@
+# Benchmarks for the treasure hunt.
+# generate - synthetic room and robot files
+# sensor_load - Sensor load time and memory
+# spawn - robot start-up time with each launcher
+# fleet - round-trip latency, mv all and shutdown time of a running fleet
+# Run them all and get one JSON report with:
+# python -m benchmarks [-o results.json]
@@ -0,0 +1,42 @@
+# Run every benchmark and write one JSON report, to stdout or to -o.
+# python -m benchmarks [-o results.json] [-robots 50] [-size 100] [-samples 200]
+#     [-sensor-sizes 10 100 1000]
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from benchmarks import fleet, sensor_load, spawn
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('-robots', '--robots', type=int, default=50)
+    parser.add_argument('-size', '--size', type=int, default=100)
+    parser.add_argument('-samples', '--samples', type=int, default=200)
+    parser.add_argument('-sensor-sizes', '--sensor-sizes', nargs='+', type=int,
+                        default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sensor_load': sensor_load.run(args.sensor_sizes),
+        'spawn': spawn.run(args.robots, args.size),
+        'fleet': [fleet.run(args.robots, args.size, args.samples, launcher)
+                  for launcher in ('exec', 'zygote')],
+    }
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# Benchmark for a running fleet.
+# Starts robots on a generated room and reports the round-trip latency of
+# single commands through master.send_command, the wall time of master.move_all
+# and the time master.shutdown_robots needs to stop the fleet.
+# The program should be executed from the command line as follows:
+# python -m benchmarks.fleet [-robots 50] [-size 100] [-samples 200]
+#     [-launcher zygote]
+
+import argparse
+import os
+import tempfile
+import time
+
+import master
+from benchmarks.generate import generate_room, generate_robots
+from benchmarks.spawn import silenced
+from render import Renderer
+from roommap import RoomMap
+from sensor import Sensor, ensure_compiled
+
+COMMANDS = ('mv', 'tr', 'bat', 'pos')
+BATTERY = 10 ** 9  # Enough that no robot runs out during the benchmark
+
+
+# Return p50, p99 and max of the samples, in ms
+def percentiles(samples):
+    samples = sorted(samples)
+    return {'p50_ms': samples[len(samples) // 2] * 1000,
+            'p99_ms': samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1000,
+            'max_ms': samples[-1] * 1000}
+
+
+# Set up the master globals the way master.py does before starting robots.
+# Every robot then answers one pos that is not timed: its first command
+# pays for the start of the robot (imports, the room mapped, the pipe set
+# up), which is not the latency of a command.
+def start_fleet(launcher, filename, robot_positions):
+    sensor = Sensor(filename)
+    master.room_dimensions = sensor.dimensions()
+    master.num_treasures = sensor.n_treasures()
+    master.room_grid = RoomMap(*master.room_dimensions)
+    master.treasures_found = set()
+    master.renderer = Renderer('off')
+    master.launcher = 'exec'
+    if launcher == 'zygote':
+        master.start_zygote(filename)
+    for robot_id, position in enumerate(robot_positions, start=1):
+        master.start_robot(robot_id, position, BATTERY, filename)
+    for robot_id in sorted(master.channels):
+        master.send_command(robot_id, 'pos')
+
+
+# Time samples round trips of one command, spread over the robots.
+# mv goes back and forth so the robots stay where they started.
+def time_command(command, samples):
+    robot_ids = sorted(master.channels)
+    latencies = []
+    for sample in range(samples):
+        robot_id = robot_ids[sample % len(robot_ids)]
+        if command == 'mv':
+            command_line = 'mv left' if sample // len(robot_ids) % 2 == 0 else 'mv right'
+        else:
+            command_line = command
+        start = time.perf_counter()
+        master.send_command(robot_id, command_line)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+# The mv samples may have left a robot off its start cell, read where it is
+def sync_positions():
+    for robot_id, (response,) in master.exchange({robot_id: ['pos'] for robot_id in master.channels}).items():
+        _, row, col = response.split()
+        master.positions[robot_id] = (int(row), int(col))
+
+
+# Return the wall time of master.move_all for each direction
+def time_move_all():
+    results = {}
+    for direction in ('right', 'down', 'left', 'up'):
+        start = time.perf_counter()
+        master.move_all(direction)
+        results[direction] = time.perf_counter() - start
+    return results
+
+
+# Return the wall time of master.shutdown_robots, which ends with sys.exit
+def time_shutdown():
+    start = time.perf_counter()
+    try:
+        master.shutdown_robots()
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    for channel in master.channels.values():
+        os.close(channel.write_fd)
+        os.close(channel.read_fd)
+    master.channels.clear()
+    master.positions.clear()
+    master.robots.clear()
+    return elapsed
+
+
+def run(num_robots=50, size=100, samples=200, launcher='zygote', obstacle_density=0.05):
+    with tempfile.TemporaryDirectory() as tmp:
+        room_filename = os.path.join(tmp, 'room.txt')
+        # No treasures, a treasure found by move_all could end the hunt
+        generate_room(room_filename, size, size, obstacle_density, 0)
+        robot_positions = generate_robots(os.path.join(tmp, 'robots.txt'), room_filename, num_robots)
+        filename = ensure_compiled(room_filename)
+        with silenced():
+            start_fleet(launcher, filename, robot_positions)
+            latencies = {command: time_command(command, samples) for command in COMMANDS}
+            sync_positions()
+            move_all = time_move_all()
+            shutdown = time_shutdown()
+    return {'launcher': launcher, 'robots': num_robots, 'size': size, 'samples': samples,
+            'round_trip': {command: percentiles(latencies[command]) for command in COMMANDS},
+            'move_all_s': move_all,
+            'shutdown_s': shutdown}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-robots', '--robots', type=int, default=50)
+    parser.add_argument('-size', '--size', type=int, default=100)
+    parser.add_argument('-samples', '--samples', type=int, default=200)
+    parser.add_argument('-launcher', '--launcher', choices=['exec', 'zygote'], default='zygote')
+    args = parser.parse_args()
+
+    result = run(args.robots, args.size, args.samples, args.launcher)
+    print(f'{"command":>8} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for command, latency in result['round_trip'].items():
+        print(f'{command:>8} {latency["p50_ms"]:>8.3f} {latency["p99_ms"]:>8.3f} {latency["max_ms"]:>8.3f}')
+    for direction, elapsed in result['move_all_s'].items():
+        print(f'mv all {direction}: {elapsed * 1000:.2f} ms')
+    print(f'shutdown: {result["shutdown_s"] * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Generators for synthetic room and robot files.
+# The program should be executed from the command line as follows:
+# python -m benchmarks.generate room.txt robots.txt [-rows 100] [-columns 100]
+#     [-obstacles 0.05] [-treasures 10] [-robots 10] [-seed 0]
+
+import argparse
+import random
+
+from sensor import Sensor
+
+
+# Write a room file in the format documented in sensor.py
+def generate_room(filename, rows, columns, obstacle_density=0.05, num_treasures=10, seed=0):
+    rng = random.Random(seed)
+    num_cells = rows * columns
+    num_obstacles = int(num_cells * obstacle_density)
+    num_treasures = min(num_treasures, num_cells - num_obstacles)
+    cells = rng.sample(range(num_cells), num_obstacles + num_treasures)
+    with open(filename, 'w') as file:
+        file.write(f'{rows} {columns}\n')
+        for count, chosen in ((num_obstacles, cells[:num_obstacles]),
+                              (num_treasures, cells[num_obstacles:])):
+            file.write(str(count))
+            for cell in chosen:
+                file.write(f' ({cell // columns},{cell % columns})')
+            file.write('\n')
+
+
+# Write a robots file with num_robots distinct start cells that are free of
+# obstacles in the given room, and return the positions. The cells are drawn
+# from a stream of their own: with the room's, for the same seed, they would
+# be the room's obstacles and treasures again, and every robot would start
+# on a treasure.
+def generate_robots(filename, room_filename, num_robots, seed=0):
+    sensor = Sensor(room_filename)
+    rows, columns = sensor.dimensions()
+    rng = random.Random(f'{seed}-robots')
+    positions = []
+    taken = set()
+    # Rejection sampling is fast while the fleet is small next to the room
+    while len(positions) < num_robots:
+        if len(taken) >= rows * columns:
+            raise ValueError(f"No room for {num_robots} robots")
+        cell = rng.randrange(rows * columns)
+        if cell in taken:
+            continue
+        taken.add(cell)
+        if sensor.with_obstacle(cell // columns, cell % columns):
+            positions.append((cell // columns, cell % columns))
+    with open(filename, 'w') as file:
+        for row, column in positions:
+            file.write(f'({row},{column})\n')
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('room_filename')
+    parser.add_argument('robots_filename')
+    parser.add_argument('-rows', '--rows', type=int, default=100)
+    parser.add_argument('-columns', '--columns', type=int, default=100)
+    parser.add_argument('-obstacles', '--obstacles', type=float, default=0.05)
+    parser.add_argument('-treasures', '--treasures', type=int, default=10)
+    parser.add_argument('-robots', '--robots', type=int, default=10)
+    parser.add_argument('-seed', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_room(args.room_filename, args.rows, args.columns, args.obstacles,
+                  args.treasures, args.seed)
+    generate_robots(args.robots_filename, args.room_filename, args.robots, args.seed)
+
+
+if __name__ == '__main__':
+    main()
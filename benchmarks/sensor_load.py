@@ -0,0 +1,82 @@
+# Benchmark for the Sensor room loader.
+# Generates square rooms of increasing size, then loads each one in a fresh
+# interpreter and reports the load time and the memory used by the loader.
+# The program should be executed from the command line as follows:
+# python -m benchmarks.sensor_load [-sizes 10 100 1000 10000] [-obstacles 0.05] [-treasures 10]
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate_room
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Resident set size of this process in KB
+def current_rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:  # No procfs, fall back to the peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Load a room in this process and print the measurements as JSON
+def measure_load(filename):
+    from sensor import Sensor
+    rss_before = current_rss_kb()
+    start = time.perf_counter()
+    sensor = Sensor(filename)
+    elapsed = time.perf_counter() - start
+    rss_after = current_rss_kb()
+    print(json.dumps({'load_s': elapsed, 'rss_kb': rss_after - rss_before,
+                      'grid_bytes': sys.getsizeof(sensor._cells)}))
+
+
+# Return one result per room size
+def run(sizes, obstacle_density=0.05, num_treasures=10):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            filename = os.path.join(tmp, f'room_{size}.txt')
+            generate_room(filename, size, size, obstacle_density, num_treasures)
+            # A fresh interpreter per room so the RSS belongs to this load only
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.sensor_load', '--load', filename],
+                                    check=True, capture_output=True, text=True, cwd=ROOT).stdout
+            result = json.loads(output)
+            result['size'] = size
+            result['file_bytes'] = os.path.getsize(filename)
+            results.append(result)
+            os.remove(filename)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-sizes', '--sizes', nargs='+', type=int,
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('-obstacles', '--obstacles', type=float, default=0.05)
+    parser.add_argument('-treasures', '--treasures', type=int, default=10)
+    parser.add_argument('--load', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        measure_load(args.load)
+        return
+
+    print(f'{"room":>13} {"file MB":>9} {"load s":>9} {"RSS MB":>9} {"grid MB":>9} {"B/cell":>7}')
+    for result in run(args.sizes, args.obstacles, args.treasures):
+        size = result['size']
+        print(f'{size:>6}x{size:<6} {result["file_bytes"] / 2**20:>9.2f} {result["load_s"]:>9.3f} '
+              f'{result["rss_kb"] / 1024:>9.1f} {result["grid_bytes"] / 2**20:>9.1f} '
+              f'{result["grid_bytes"] / (size * size):>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Benchmark for robot start-up in master.start_robot.
+# Starts a fleet with each launcher and reports the time per robot until
+# every robot has answered its first command.
+# The program should be executed from the command line as follows:
+# python -m benchmarks.spawn [-robots 200] [-size 100]
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import master
+from benchmarks.generate import generate_room
+from sensor import ensure_compiled
+
+
+# The master and the robots report every start and every move, keep that
+# out of the benchmark output. Robots inherit the redirected descriptors.
+@contextlib.contextmanager
+def silenced():
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    stderr = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        for fd in (stdout, stderr, devnull):
+            os.close(fd)
+
+
+# Stop the robots without the reports of master.shutdown_robots
+def stop_fleet():
+    master.exchange({robot_id: ["exit"] for robot_id in master.channels})
+    for robot_id, channel in master.channels.items():
+        os.waitpid(master.robots[robot_id], 0)
+        os.close(channel.write_fd)
+        os.close(channel.read_fd)
+    master.channels.clear()
+    master.positions.clear()
+    master.robots.clear()
+
+
+# Return the seconds needed to start the fleet and get one reply per robot
+def time_fleet(launcher, filename, num_robots, columns):
+    master.launcher = 'exec'
+    if launcher == 'zygote':
+        master.start_zygote(filename)
+    start = time.perf_counter()
+    for robot_id in range(1, num_robots + 1):
+        position = divmod(robot_id - 1, columns)
+        master.start_robot(robot_id, position, 100, filename)
+    for robot_id in master.channels:
+        master.send_command(robot_id, "pos")
+    elapsed = time.perf_counter() - start
+    stop_fleet()
+    return elapsed
+
+
+# Return one result per launcher
+def run(num_robots=200, size=100):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        room_filename = os.path.join(tmp, 'room.txt')
+        generate_room(room_filename, size, size, 0, 0)
+        filename = ensure_compiled(room_filename)
+        for launcher in ('exec', 'zygote'):
+            with silenced():
+                elapsed = time_fleet(launcher, filename, num_robots, size)
+            results.append({'launcher': launcher, 'robots': num_robots, 'total_s': elapsed,
+                            'ms_per_robot': elapsed * 1000 / num_robots})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-robots', '--robots', type=int, default=200)
+    parser.add_argument('-size', '--size', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f'{"launcher":>8} {"robots":>7} {"total s":>9} {"ms/robot":>9}')
+    for result in run(args.robots, args.size):
+        print(f'{result["launcher"]:>8} {result["robots"]:>7} {result["total_s"]:>9.3f} '
+              f'{result["ms_per_robot"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
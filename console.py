@@ -0,0 +1,89 @@
+# Console helpers for the master's asyncio front end (master.py -loop asyncio).
+#
+# ConsoleLines reads the operator's commands from stdin inside the event
+# loop, so waiting for a command never blocks the loop. ThreadOutput stands
+# in for sys.stdout and lets a command running on a worker thread collect
+# its output, so commands run at the same time can still be printed in the
+# order they were typed.
+
+import asyncio
+import io
+import os
+import threading
+from collections import deque
+
+
+class ConsoleLines:
+    def __init__(self, loop, fd=0):
+        self._loop = loop
+        self._fd = fd
+        self._lines = deque()
+        self._partial = b""
+        self._eof = False
+        self._changed = asyncio.Event()
+        self._polled = True
+        try:
+            loop.add_reader(fd, self._read)
+        except PermissionError:
+            # Regular files cannot be polled, reading them never blocks
+            self._polled = False
+            loop.call_soon(self._read)
+
+    def _read(self):
+        data = os.read(self._fd, 65536)
+        if not data:
+            if self._polled:
+                self._loop.remove_reader(self._fd)
+            if self._partial:
+                self._lines.append(self._partial.decode())
+            self._eof = True
+        else:
+            *lines, self._partial = (self._partial + data).split(b"\n")
+            self._lines.extend(line.decode() for line in lines)
+            if not self._polled:
+                self._loop.call_soon(self._read)
+        self._changed.set()
+
+    # Next line, or None at the end of the input
+    async def get(self):
+        while not self._lines and not self._eof:
+            self._changed.clear()
+            await self._changed.wait()
+        return self._lines.popleft() if self._lines else None
+
+    # The line get would return now without waiting, if there is one
+    def peek(self):
+        return self._lines[0] if self._lines else None
+
+
+class ThreadOutput:
+    def __init__(self, out):
+        self._out = out
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (self._out if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._out.flush()
+
+    def fileno(self):
+        return self._out.fileno()
+
+    def __getattr__(self, name):
+        return getattr(self._out, name)
+
+    # Call function on this thread and return what it printed instead of
+    # printing it. When it raises, what it printed is printed after all.
+    def capture(self, function, *args):
+        self._local.buffer = io.StringIO()
+        try:
+            function(*args)
+            return self._local.buffer.getvalue()
+        except BaseException:
+            self._out.write(self._local.buffer.getvalue())
+            raise
+        finally:
+            self._local.buffer = None
@@ -0,0 +1,119 @@
+# Control socket of the master (master.py -control PATH): many clients
+# driving the fleet at once, along with the operator at the console.
+#
+# A client connects to the Unix socket and writes requests, one per line:
+#     <id> <command>
+# with the commands of the console and any word without spaces as id. The
+# master answers every request when it has run, with the id and the length
+# in bytes of the output, followed by the output:
+#     <id> <length>\n<output>
+# Requests are answered as they complete, not necessarily in the order
+# they were sent. A request that is not a valid command gets
+# "Invalid command".
+#
+# Every command, from the console or from a client, goes through one
+# CommandQueue. The commands that change something (moves, signals, explore)
+# run one at a time in the order they arrived, which keeps the commands of
+# every robot in order. The read-only commands between two of them run at
+# the same time, and identical ones are coalesced: however many clients ask
+# for "bat all" while a batch is being gathered, it runs once and they all
+# get its output. A batch is gathered for COALESCE_WINDOW seconds, and
+# while the batch before it runs.
+
+import asyncio
+import os
+from collections import deque
+
+COALESCE_WINDOW = 0.005  # Seconds read-only commands wait for identical ones
+
+
+class CommandQueue:
+    # run(action, capture) is a coroutine function running a command, split
+    # into words, and returning its output when capture is set. read_only
+    # tells the commands that can run together.
+    def __init__(self, run, read_only, window=COALESCE_WINDOW):
+        self._run = run
+        self._read_only = read_only
+        self._window = window
+        self._pending = deque()  # (action, capture, future) in arrival order
+        self._arrived = asyncio.Event()
+        self._task = None
+
+    # Run action once the commands submitted before it that change
+    # something have run, and return its output. Read-only commands are
+    # always captured, the others only when capture is set.
+    async def submit(self, action, capture=True):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((action, capture, future))
+        self._arrived.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._serve())
+        return await future
+
+    async def _serve(self):
+        while True:
+            while not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+            action, capture, future = self._pending[0]
+            if not self._read_only(action):
+                self._pending.popleft()
+                await self._settle([future], action, capture)
+                continue
+            if self._window:
+                await asyncio.sleep(self._window)
+            # The read-only commands up to the next one that changes something
+            batch = {}  # K = the command's words, V = futures waiting for it
+            while self._pending and self._read_only(self._pending[0][0]):
+                action, _, future = self._pending.popleft()
+                batch.setdefault(tuple(action), []).append(future)
+            await asyncio.gather(*(self._settle(futures, list(words), True)
+                                   for words, futures in batch.items()))
+
+    async def _settle(self, futures, action, capture):
+        try:
+            output = await self._run(action, capture)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in futures:
+            if not future.done():
+                future.set_result(output)
+
+
+# Serve the clients of the Unix socket at path, handing their commands to
+# queue. Returns the asyncio server.
+async def serve_control(path, queue):
+    if os.path.exists(path):
+        os.unlink(path)  # Left by a master that did not end cleanly
+
+    async def on_client(reader, writer):
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                request_id, _, command = line.decode().strip().partition(' ')
+                if request_id:
+                    task = asyncio.get_running_loop().create_task(
+                        _answer(writer, request_id, command.split(), queue))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            # The client is done sending, not necessarily reading
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(on_client, path)
+
+
+async def _answer(writer, request_id, action, queue):
+    try:
+        output = await queue.submit(action)
+    except (ValueError, IndexError):
+        output = "Invalid command\n"
+    data = output.encode()
+    if not writer.is_closing():
+        writer.write(f"{request_id} {len(data)}\n".encode() + data)
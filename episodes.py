@@ -0,0 +1,151 @@
+# Headless runner for treasure-hunt episodes.
+# Runs complete hunts on many rooms in parallel, one episode at a time per
+# worker process of a ProcessPoolExecutor, and writes a CSV or JSON report
+# with one row per episode. An episode runs the master with in-process
+# robots (see master.py -inproc) on the commands of a script, by default a
+# single explore, until the script ends or every treasure is found.
+# Rooms are given as room and robots files, or generated from seeds.
+# The program should be executed from the command line as follows:
+# python episodes.py [-episode room.txt robots.txt ...] [-seeds 10] [-size 30]
+#     [-obstacles 0.1] [-treasures 5] [-robots 5] [-script commands.txt]
+#     [-jobs 4] [-o report.csv|report.json]
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import master
+from benchmarks.generate import generate_robots, generate_room
+from render import Renderer
+from roommap import RoomMap
+from sensor import Sensor
+
+FIELDS = ('episode', 'room', 'robots_file', 'seed', 'robots', 'treasures', 'found',
+          'complete', 'moves', 'round_trips', 'elapsed_s', 'error')
+
+
+# Read a robots file, one (row,col) per line as master.py does
+def read_robots(filename):
+    with open(filename) as robot_file:
+        return [tuple(map(int, line.strip().strip("()").split(',')))
+                for line in robot_file if line.strip()]
+
+
+# Put the master in the state its __main__ leaves it in, with in-process
+# robots at the given positions
+def setup_master(sensor, robot_positions):
+    for table in (master.robots, master.positions, master.channels, master.robot_stats, master.remote):
+        table.clear()
+    master.treasures_found = set()
+    master.round_trips = 0
+    master.moves = 0
+    master.exploration = None
+    master.renderer = Renderer('off')
+    master.status_table = None
+    master.room_dimensions = sensor.dimensions()
+    master.num_treasures = sensor.n_treasures()
+    master.room_grid = RoomMap(*master.room_dimensions)
+    master.start_inproc(sensor)
+    for position, valid in zip(robot_positions, sensor.with_obstacle_at(robot_positions)):
+        if not valid:
+            raise ValueError(f"Invalid initial position for robot at {position}")
+    for robot_id, position in enumerate(robot_positions, start=1):
+        master.start_robot(robot_id, position, 100, None)
+
+
+# Run one episode in this process and return its row of the report
+def run_episode(episode):
+    result = dict.fromkeys(FIELDS, '')
+    result.update(episode=episode['name'], seed=episode['seed'] if episode['seed'] is not None else '')
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            if episode['seed'] is None:
+                room_filename, robots_filename = episode['room'], episode['robots']
+                result.update(room=room_filename, robots_file=robots_filename)
+            else:
+                room_filename = os.path.join(tmp, 'room.txt')
+                robots_filename = os.path.join(tmp, 'robots.txt')
+                size = episode['size']
+                generate_room(room_filename, size, size, episode['obstacles'],
+                              episode['treasures'], episode['seed'])
+                generate_robots(robots_filename, room_filename, episode['num_robots'], episode['seed'])
+            sensor = Sensor(room_filename)
+            robot_positions = read_robots(robots_filename)
+            result.update(robots=len(robot_positions), treasures=sensor.n_treasures())
+            start = time.perf_counter()
+            # The master reports every step, only the counters matter here
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                setup_master(sensor, robot_positions)
+                try:
+                    master.check_start_squares()
+                    for command in episode['commands']:
+                        master.run_command(command.split())
+                except SystemExit:  # The hunt is over
+                    pass
+            result.update(found=len(master.treasures_found),
+                          complete=len(master.treasures_found) == master.num_treasures,
+                          moves=master.moves, round_trips=master.round_trips,
+                          elapsed_s=round(time.perf_counter() - start, 6))
+        except (OSError, ValueError) as e:
+            result['error'] = str(e)
+    return result
+
+
+def write_report(results, filename):
+    if filename and filename.endswith('.json'):
+        with open(filename, 'w') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+        return
+    with open(filename, 'w', newline='') if filename else contextlib.nullcontext(sys.stdout) as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-episode', '--episode', nargs=2, action='append', default=[],
+                        metavar=('ROOM', 'ROBOTS'), help='room and robots files of an episode')
+    parser.add_argument('-seeds', '--seeds', type=int, default=0,
+                        help='number of generated episodes, with seeds 0 to SEEDS - 1')
+    parser.add_argument('-size', '--size', type=int, default=30)
+    parser.add_argument('-obstacles', '--obstacles', type=float, default=0.1)
+    parser.add_argument('-treasures', '--treasures', type=int, default=5)
+    parser.add_argument('-robots', '--robots', type=int, default=5)
+    parser.add_argument('-script', '--script', help='master commands of every episode, default explore')
+    parser.add_argument('-jobs', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('-o', '--output', help='report file, JSON if it ends in .json, CSV otherwise')
+    args = parser.parse_args()
+
+    commands = ['explore']
+    if args.script:
+        with open(args.script) as script_file:
+            commands = [line.strip() for line in script_file
+                        if line.strip() and not line.startswith('#')]
+    episodes = [{'name': os.path.splitext(os.path.basename(room))[0], 'room': room, 'robots': robots,
+                 'seed': None, 'commands': commands}
+                for room, robots in args.episode]
+    episodes += [{'name': f'seed-{seed}', 'seed': seed, 'size': args.size, 'obstacles': args.obstacles,
+                  'treasures': args.treasures, 'num_robots': args.robots, 'commands': commands}
+                 for seed in range(args.seeds)]
+    if not episodes:
+        parser.error('give at least one -episode or -seeds')
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.jobs) as executor:
+        results = list(executor.map(run_episode, episodes))
+    write_report(results, args.output)
+    complete = sum(1 for result in results if result['complete'] is True)
+    print(f"{len(results)} episodes, {complete} complete, {time.perf_counter() - start:.2f} s "
+          f"on {args.jobs} workers", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
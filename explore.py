@@ -0,0 +1,68 @@
+# Frontier planner for the master's explore command.
+#
+# The master only knows the room through room_grid, a RoomMap (see
+# roommap.py): '?' unknown, '-' free, 'X' obstacle and 'T' treasure. Every
+# wave each robot gets a path through known free cells to the closest
+# unknown cell, followed by a straight run further into unknown cells. Paths
+# of one wave never share a cell and never cross a cell where another robot
+# stands, so the robots of a wave can walk them at the same time without
+# colliding.
+
+from collections import deque
+
+DIRECTIONS = (('up', -1, 0), ('down', 1, 0), ('left', 0, -1), ('right', 0, 1))
+MOVE_COST = 5  # Battery used by one move, see robot.Robot.move
+
+
+# Return the path from start to the closest reachable unknown cell as a
+# list of (direction, cell), or None when no unknown cell can be reached.
+# The path avoids obstacles and the cells in blocked, and has at most
+# max_steps steps. After the first unknown cell it keeps going in the same
+# direction for up to run more unknown cells.
+def plan_path(room_grid, start, blocked, max_steps, run=8):
+    rows, columns = room_grid.rows, room_grid.columns
+    parents = {start: None}  # K = cell, V = (previous cell, direction)
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        for direction, row_step, col_step in DIRECTIONS:
+            row, col = cell[0] + row_step, cell[1] + col_step
+            if row < 0 or row >= rows or col < 0 or col >= columns:
+                continue
+            next_cell = (row, col)
+            if next_cell in parents or next_cell in blocked or room_grid[row, col] == 'X':
+                continue
+            parents[next_cell] = (cell, direction)
+            if room_grid[row, col] == '?':
+                path = []
+                while parents[next_cell] is not None:
+                    previous, step = parents[next_cell]
+                    path.append((step, next_cell))
+                    next_cell = previous
+                path.reverse()
+                for _ in range(run):
+                    row, col = row + row_step, col + col_step
+                    if (row < 0 or row >= rows or col < 0 or col >= columns
+                            or room_grid[row, col] != '?' or (row, col) in blocked):
+                        break
+                    path.append((direction, (row, col)))
+                return path[:max_steps]
+            queue.append(next_cell)
+    return None
+
+
+# Plan one wave. Robots are served in id order; each one claims the cells
+# of its path so the next robots go elsewhere.
+# Returns K = robot_id, V = path, only for the robots that can move.
+def plan_wave(room_grid, positions, batteries):
+    blocked = {tuple(position) for position in positions.values()}
+    plans = {}
+    for robot_id in sorted(positions):
+        max_steps = batteries.get(robot_id, 0) // MOVE_COST
+        if max_steps == 0:
+            continue
+        path = plan_path(room_grid, tuple(positions[robot_id]), blocked, max_steps)
+        if path:
+            plans[robot_id] = path
+            blocked.update(cell for _, cell in path)
+    return plans
@@ -0,0 +1,79 @@
+# In-process robots for the master's -inproc mode.
+#
+# Instead of a process per robot the master creates robot.Robot objects that
+# share the master's Sensor. A LocalChannel stands in for the pipes of
+# protocol.Channel: sending commands runs them on the robot at once and
+# stores the replies, so the master's exchange works unchanged. Signals are
+# turned into the calls the robot's handlers would make.
+#
+# The battery drain of every robot follows a VirtualClock, which only moves
+# when the master advances it, so a run gives the same results however
+# fast the machine is.
+
+import signal
+
+from protocol import NOTICE_ID
+
+
+class VirtualClock:
+    __slots__ = ('time',)
+
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def __call__(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+
+class LocalChannel:
+    __slots__ = ('robot', 'replies', 'closed', 'bytes_sent', 'bytes_received', '_next_id')
+    notices = ()  # Robots in the master's process never send notices
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.replies = {}  # K = request id, V = reply text
+        self.closed = False  # The robot ran exit
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._next_id = NOTICE_ID + 1
+
+    # Run commands on the robot and return their request ids
+    def send(self, commands):
+        request_ids = []
+        for command in commands:
+            request_id = self._next_id
+            self._next_id += 1
+            request_ids.append(request_id)
+            if self.closed:
+                reply = ""
+            else:
+                reply = self.robot.execute(command)
+                self.closed = command.split(' ')[0] == 'exit'
+            self.replies[request_id] = reply
+            self.bytes_sent += len(command) + 1
+            self.bytes_received += len(reply) + 1
+        return request_ids
+
+    # Replies are stored by send, there is never anything to read
+    def receive(self):
+        pass
+
+    def has_replies(self, request_ids):
+        return all(request_id in self.replies for request_id in request_ids)
+
+    # What the robot's signal handlers do on the given signal
+    def signal(self, sig):
+        if sig == signal.SIGINT:
+            self.robot.suspend()
+        elif sig == signal.SIGQUIT:
+            self.robot.resume()
+        elif sig == signal.SIGUSR1:
+            self.robot.battery = 100
+
+    # (id, position, battery, suspended) as in a status.StatusTable slot
+    def state(self):
+        robot = self.robot
+        return int(robot.id), tuple(robot.position), robot.battery, robot.is_suspended
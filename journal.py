@@ -0,0 +1,188 @@
+# Append-only journal of the master's state, for master.py -journal/-resume.
+#
+# The master appends a record for every change of what it knows: a cell of
+# the room learnt, a robot moved, a robot suspended, resumed or refilled.
+# From time to time it appends a snapshot of its whole state instead, and
+# the header at the start of the file points at the last complete one.
+# Loading reads that snapshot and replays the records after it, so it takes
+# time in the size of the snapshot, not in the length of the run.
+#
+# The master snapshots once the records after the last snapshot take as
+# many bytes as the snapshot itself (at least MIN_TAIL), which keeps the
+# replay no longer than the snapshot.
+#
+# File layout:
+#   header    magic, version, offset of the last snapshot (0 for none)
+#   records   type, then three ints whose meaning depends on the type:
+#             CELL row, col, value | MOVE robot_id, row, col |
+#             SUSPEND, RESUME, REFILL robot_id
+#             SNAPSHOT is followed by that many bytes of zlib-compressed
+#             rows, columns, number of robots, the room (one character per
+#             cell, row by row) and the robots (id, row, col, battery,
+#             suspended)
+#
+# A crash may cut the last record short. Opening the journal to append to it
+# drops that record first, so the records that follow can be read back.
+#
+# Batteries are not journaled as they drain. A snapshot has the batteries
+# of that moment, then every move of the replay costs MOVE_COST and every
+# refill sets 100.
+
+import os
+import struct
+import zlib
+
+from explore import MOVE_COST
+from roommap import RoomMap
+
+_MAGIC = b'JRNL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+_RECORD = struct.Struct('<Biii')
+_STATE = struct.Struct('<III')  # rows, columns, number of robots
+_ROBOT = struct.Struct('<iiiiB')  # id, row, col, battery, suspended
+
+CELL = 1
+MOVE = 2
+SUSPEND = 3
+RESUME = 4
+REFILL = 5
+SNAPSHOT = 6
+
+MIN_TAIL = 1 << 20  # Bytes of records after which a snapshot is always due
+
+
+class Journal:
+    # Open filename to append to it after its last complete record, creating
+    # it when it does not exist or truncate is set
+    def __init__(self, filename, truncate=False):
+        self.filename = filename
+        if truncate or not os.path.exists(filename):
+            with open(filename, 'wb') as file:
+                file.write(_HEADER.pack(_MAGIC, _VERSION, 0))
+        self._file = open(filename, 'r+b')
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{filename} is not a journal")
+        magic, version, offset = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{filename} is not a journal")
+        # Only the records after the last snapshot may be cut short
+        end = offset or _HEADER.size
+        self._file.seek(end)
+        for _ in _records(self._file):
+            end = self._file.tell()
+        self._file.truncate(end)
+        self._file.seek(end)
+        self._tail = 0  # Bytes of records since the last snapshot
+        self._snapshot_size = 0
+        self.suspended = set()  # Ids of the robots suspended, as journaled
+
+    def cell(self, position, value):
+        self._file.write(_RECORD.pack(CELL, position[0], position[1], ord(value)))
+        self._tail += _RECORD.size
+
+    def move(self, robot_id, position):
+        self._file.write(_RECORD.pack(MOVE, robot_id, position[0], position[1]))
+        self._tail += _RECORD.size
+
+    # kind is SUSPEND, RESUME or REFILL
+    def control(self, robot_id, kind):
+        if kind == SUSPEND:
+            self.suspended.add(robot_id)
+        elif kind == RESUME:
+            self.suspended.discard(robot_id)
+        self._file.write(_RECORD.pack(kind, robot_id, 0, 0))
+        self._tail += _RECORD.size
+
+    def snapshot_due(self):
+        return self._tail >= max(MIN_TAIL, self._snapshot_size)
+
+    # Append a snapshot of room_grid, a RoomMap, and of robot_states,
+    # K = robot_id, V = (position, battery, suspended), and make it the one
+    # to load
+    def snapshot(self, room_grid, robot_states):
+        data = bytearray(_STATE.pack(room_grid.rows, room_grid.columns, len(robot_states)))
+        data += room_grid.tobytes()
+        for robot_id, (position, battery, suspended) in sorted(robot_states.items()):
+            data += _ROBOT.pack(robot_id, position[0], position[1], battery, suspended)
+        payload = zlib.compress(data, 1)
+        offset = self._file.tell()
+        self._file.write(_RECORD.pack(SNAPSHOT, len(payload), 0, 0))
+        self._file.write(payload)
+        self.flush(sync=True)
+        # Only point at the snapshot once all of it is on disk
+        os.pwrite(self._file.fileno(), _HEADER.pack(_MAGIC, _VERSION, offset), 0)
+        os.fsync(self._file.fileno())
+        self._tail = 0
+        self._snapshot_size = len(data)
+
+    def flush(self, sync=False):
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+
+# Rebuild the state saved in a journal, as a dict with the room (a
+# RoomMap), positions and batteries (K = robot_id) and the ids of the
+# suspended robots. A record cut short by a crash ends the replay.
+def load(filename):
+    with open(filename, 'rb') as file:
+        header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{filename} is not a journal")
+        magic, version, offset = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{filename} is not a journal")
+        if offset == 0:
+            raise ValueError(f"{filename} has no snapshot to resume from")
+        file.seek(offset)
+        state = None
+        for kind, a, b, c, payload in _records(file):
+            if kind == SNAPSHOT:
+                state = _read_snapshot(zlib.decompress(payload))
+            elif kind == CELL:
+                state['room'][a, b] = chr(c)
+            elif kind == MOVE:
+                state['positions'][a] = (b, c)
+                state['batteries'][a] = max(0, state['batteries'][a] - MOVE_COST)
+            elif kind == SUSPEND:
+                state['suspended'].add(a)
+            elif kind == RESUME:
+                state['suspended'].discard(a)
+            elif kind == REFILL:
+                state['batteries'][a] = 100
+            else:
+                raise ValueError(f"Unknown record {kind} in {filename}")
+    return state
+
+
+# The complete records of file from where it stands, as (type, the three
+# ints, the payload of a snapshot or None). While a record is being handled
+# the file stands right after it.
+def _records(file):
+    while True:
+        record = file.read(_RECORD.size)
+        if len(record) < _RECORD.size:
+            return
+        kind, a, b, c = _RECORD.unpack(record)
+        payload = None
+        if kind == SNAPSHOT:
+            payload = file.read(a)
+            if len(payload) < a:
+                return
+        yield kind, a, b, c, payload
+
+
+def _read_snapshot(data):
+    rows, columns, num_robots = _STATE.unpack_from(data)
+    start = _STATE.size
+    state = {'room': RoomMap(rows, columns, data[start:start + rows * columns]),
+             'positions': {}, 'batteries': {}, 'suspended': set()}
+    start += rows * columns
+    for robot_id, row, col, battery, suspended in _ROBOT.iter_unpack(data[start:start + num_robots * _ROBOT.size]):
+        state['positions'][robot_id] = (row, col)
+        state['batteries'][robot_id] = battery
+        if suspended:
+            state['suspended'].add(robot_id)
+    return state
@@ -1,17 +1,100 @@
 import argparse
+import asyncio
+import itertools
 import os
+import selectors
 import sys
 import signal
+import threading
 import time
-from sensor import Sensor
+from concurrent.futures import ThreadPoolExecutor
+from console import ConsoleLines, ThreadOutput
+from control import CommandQueue, serve_control
+from explore import MOVE_COST, plan_wave
+from inproc import LocalChannel, VirtualClock
+from journal import REFILL, RESUME, SUSPEND, Journal, load as load_journal
+import profiling
+from protocol import Channel
+from render import MODES, Renderer
+from roommap import FREE, OBSTACLE, TREASURE, UNKNOWN, RoomMap
+from sensor import Sensor, ensure_compiled
+from shards import ShardedFleet
+from stats import RobotStats, fleet_report, robot_report
+from status import StatusTable
+from transport import CONTROL_COMMANDS, ConnectionPool, parse_address
+
+# Descriptors the robots read commands from and write replies to. Fixed
+# numbers, since sys.stdout may be redirected to a log in script mode.
+STDIN_FILENO = 0
+STDOUT_FILENO = 1
 
 # Global variables
 robots = {}  # K = robot_id, V = PID
 positions = {}  # K = robot_id, V = (row, col)
-pipes = {}  # K = robot_id, V = (parent_to_child pipe, parent_from_child pipe)
+channels = {}  # K = robot_id, V = Channel over the pipes to and from the robot
 treasures_found = set()
-room_grid = None
+room_grid = None  # RoomMap of what is known of the room, see roommap.py
 num_treasures = None
+renderer = Renderer()  # Draws room_grid, see render.py
+round_trips = 0  # Requests answered by the robots, one per robot per exchange
+moves = 0  # Cells entered by the robots
+robot_stats = {}  # K = robot_id, V = RobotStats, see stats.py
+status_table = None  # StatusTable the robots publish their state in, see status.py
+exploration = None  # Counters of the explore command while it runs
+journal = None  # Journal of the changes of this state (-journal/-resume), see journal.py
+# How start_robot launches robots: 'exec' runs robot.py in a new interpreter,
+# 'zygote' forks this process, which has robot imported and the room loaded
+launcher = 'exec'
+# Talk to the robots with the framed protocol (see protocol.py) or, when
+# False, with the human-readable text commands
+framed = True
+# Run the robots as objects in this process (-inproc) instead of processes.
+# Their battery drains on clock, which the tick command advances, and with
+# executor the commands of an exchange are run on a thread pool.
+inproc = False
+clock = None
+executor = None
+threads = 0
+# Robots run by worker processes owning bands of the room (-shards), see
+# shards.py
+fleet = None
+# Directory every process writes its profile to (-profile), and the
+# profiler of -profiler, see profiling.py
+profile_dir = None
+profiler = 'cprofile'
+# Robots running as servers (-hosts), reached over TCP, see transport.py
+remote = {}  # K = robot_id, V = (host, port)
+connection_pool = ConnectionPool()
+# With -loop asyncio the console, the signals and every read from the robots
+# are served by event_loop, in the main thread, while the commands run on
+# worker threads. Their exchanges are handed to the loop, which reads the
+# replies as they arrive, so a slow robot never freezes the console.
+event_loop = None
+loop_thread = None  # threading.get_ident() of the thread running event_loop
+reply_waiters = {}  # K = robot_id, V = list of (request ids, pending, start, future)
+notices_arrived = None  # asyncio.Event set when a robot sends a notice
+# Consecutive commands of these kinds only read, they run at the same time
+READ_ONLY_COMMANDS = ('pos', 'bat', 'stats', 'coverage')
+READERS = 8  # Threads running read-only commands together
+control_path = None  # Unix socket taking commands from other programs (-control), see control.py
+shutdown_lock = threading.Lock()  # Held by the thread shutting the robots down
+# Blocking exchanges in progress, and whether a SIGTSTP came during one. The
+# statuses it asks for are printed once the exchange has ended, since reading
+# them sooner would take the replies the exchange is waiting for.
+exchanging = 0
+status_requested = False
+
+# What each signal the robots are sent does, as recorded in the journal
+JOURNAL_CONTROLS = {signal.SIGINT: SUSPEND, signal.SIGQUIT: RESUME, signal.SIGUSR1: REFILL}
+
+# Seconds an exchange waits for a robot before reporting it as slow
+REPLY_TIMEOUT = 5.0
+# Seconds the robots have to answer exit and end at shutdown, and the
+# seconds between SIGTERM and SIGKILL for those that do not
+SHUTDOWN_TIMEOUT = 5.0
+KILL_GRACE = 1.0
+# Seconds signal_robots waits for the signalled robots to publish their state
+SIGNAL_TIMEOUT = 1.0
 
 # Signal handlers for master
 
@@ -24,33 +107,62 @@ def sigint_handler(sig, frame):
 def sigquit_handler(sig, frame):
     print("Replenishing batteries")
     # Send SIGUSR1 to each robot to signal battery replenishment
-    for pid in robots.values():
-        os.kill(pid, signal.SIGUSR1)
+    signal_robots(list(robots), signal.SIGUSR1)
+    print_stats("all")
 
 
 def sigtstp_handler(sig, frame):
+    global status_requested
+    if inproc or status_table is not None or fleet is not None:
+        # The robots keep the table up to date, no need to hear from them
+        for robot_id, status in read_statuses(list(robots)).items():
+            if status is not None:
+                _, position, battery, _ = status
+                print(f"id: {robot_id} P: {list(position)} Bat: {battery}")
+        return
+    if exchanging:
+        # Answered by exchange once the replies it waits for are in
+        status_requested = True
+        return
+    status_requested = False
+    if remote:
+        # Remote robots do not get the terminal's signals, ask them
+        for robot_id, (response,) in exchange({robot_id: ["status"] for robot_id in remote}).items():
+            print(response)
     for robot_id, pid in robots.items():
+        if robot_id in remote:
+            continue
         # Sending this signal is commented out because robots already receive the sigtstp. They don't need to receive it twice
         # os.kill(pid, signal.SIGTSTP)  # Send SIGTSTP to each robot
         # time.sleep(.1)
-        _, parent_from_child_r = pipes[robot_id]
-        response = os.read(parent_from_child_r, 1024).decode().strip()
+        response = channels[robot_id].wait_notice()
         print(response)
 
 
+# Ask every robot to exit at once, collect the final statuses concurrently
+# and reap the processes. Robots that do not answer within SHUTDOWN_TIMEOUT
+# or do not exit by then are sent SIGTERM, then SIGKILL.
 def shutdown_robots():
-    final_status = {}  # K = robot_id, V = final position and battery
-
-    # Send 'exit' command to each robot to request last status and initiate shutdown
-    for robot_id, (parent_to_child_w, child_to_parent_r) in pipes.items():
-        os.write(parent_to_child_w, b"exit\n")
+    if event_loop is not None:
+        # SIGINT may come during exit, the first shutdown ends the master
+        shutdown_lock.acquire()
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    if journal is not None:
+        journal.flush(sync=True)
 
-        # Read and store the final position and battery from each robot
-        response = os.read(child_to_parent_r, 1024).decode().strip()
-        final_status[robot_id] = response
-        # Wait for each child process to exit
-        _, status = os.waitpid(robots[robot_id], 0)
-        print(f"Robot {robots[robot_id]} finished with status {status}")
+    if fleet is not None:
+        final_status = fleet.shutdown()
+        exit_statuses = {robot_id: 0 for robot_id in robots}
+    else:
+        # Send 'exit' command to each robot to request last status and initiate shutdown
+        final_status = {robot_id: response  # K = robot_id, V = final position and battery
+                        for robot_id, (response,) in exchange({robot_id: ["exit"] for robot_id in channels},
+                                                              SHUTDOWN_TIMEOUT).items()}
+        # Robots that just answered get a moment to end even if a slow one used
+        # up the deadline
+        exit_statuses = reap_robots(max(KILL_GRACE, deadline - time.monotonic()))
+    for robot_id in robots:
+        print(f"Robot {robots[robot_id]} finished with status {exit_statuses[robot_id]}")
 
     for robot_id, response in final_status.items():
         pid = robots[robot_id]
@@ -58,15 +170,219 @@ def shutdown_robots():
         print(response)
         print()
 
-    print_room()
+    print_stats("all")
+    print_room(force=True)  # The final map, whatever the render mode
+    renderer.close()
+    remove_status_table()
+    connection_pool.close_all()
+    if control_path is not None and os.path.exists(control_path):
+        os.unlink(control_path)
+    if profile_dir is not None:
+        # The robots wrote theirs as they exited
+        profiling.stop()
+        print(f"Profile report: {profiling.merge(profile_dir)}")
     sys.exit(0)
 
 
-def start_robot(robot_id, position, battery, filename):
+# Wait for every robot process to exit. The ones still running after
+# timeout seconds are sent SIGTERM, and SIGKILL KILL_GRACE seconds later.
+# Returns K = robot_id, V = wait status
+def reap_robots(timeout):
+    if inproc:  # Nothing to wait for, exit already stopped them
+        return {robot_id: 0 for robot_id in robots}
+    # Remote robots end on their own node once they answered exit
+    exit_statuses = {robot_id: 0 for robot_id in remote}
+    running = {robot_id: pid for robot_id, pid in robots.items() if robot_id not in remote}
+    for sig, wait in ((None, timeout), (signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+        if not running:
+            break
+        if sig is not None:
+            for robot_id, pid in running.items():
+                print(f"Robot {robot_id} did not exit, sending {sig.name}", file=sys.stderr)
+                os.kill(pid, sig)
+        exit_statuses.update(wait_for_exit(running, wait))
+        running = {robot_id: pid for robot_id, pid in running.items() if robot_id not in exit_statuses}
+    return exit_statuses
+
+
+# Reap the processes (K = robot_id, V = pid) that exit within timeout
+# seconds, or all of them when timeout is None. Each process is watched
+# through a pidfd, so the wait ends as soon as the last one exits.
+# Returns K = robot_id, V = wait status
+def wait_for_exit(pids, timeout):
+    if not hasattr(os, 'pidfd_open'):
+        return poll_for_exit(pids, timeout)
+    exit_statuses = {}
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        for robot_id, pid in pids.items():
+            selector.register(os.pidfd_open(pid), selectors.EVENT_READ, robot_id)
+        while selector.get_map():
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            events = selector.select(wait)
+            if not events:
+                break
+            for key, _ in events:
+                _, exit_statuses[key.data] = os.waitpid(pids[key.data], 0)
+                selector.unregister(key.fd)
+                os.close(key.fd)
+        for key in list(selector.get_map().values()):
+            os.close(key.fd)
+    return exit_statuses
+
+
+# wait_for_exit where pidfds are not available
+def poll_for_exit(pids, timeout):
+    exit_statuses = {}
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        for robot_id, pid in pids.items():
+            if robot_id not in exit_statuses:
+                reaped_pid, status = os.waitpid(pid, os.WNOHANG)
+                if reaped_pid:
+                    exit_statuses[robot_id] = status
+        if len(exit_statuses) == len(pids) or (deadline is not None and time.monotonic() >= deadline):
+            return exit_statuses
+        time.sleep(0.01)
+
+
+# Import robot and load the room in the master so that robots started with
+# the zygote launcher are forked already initialized
+def start_zygote(filename):
+    global launcher
+    import robot
+    robot.preload(filename)
+    launcher = 'zygote'
+
+
+# The last treasure was found, end the hunt
+def hunt_complete():
+    print("All treasures found!")
+    if exploration is not None:
+        print_exploration()
+    shutdown_robots()
+
+
+# Slot of a robot in the status table, None when it has none
+def status_slot(robot_id):
+    if status_table is None or not 0 < robot_id <= status_table.slots:
+        return None
+    return robot_id - 1
+
+
+# State of a robot read from the status table, or from the robot itself when
+# it runs in this process, as (id, position, battery, suspended). None if the
+# robot does not publish it.
+def read_status(robot_id):
+    if inproc:
+        return channels[robot_id].state()
+    slot = status_slot(robot_id)
+    return None if slot is None else status_table.read(slot)
+
+
+# read_status for many robots, K = robot_id. The shards are asked once.
+def read_statuses(robot_ids):
+    if fleet is not None:
+        return fleet.states(robot_ids)
+    return {robot_id: read_status(robot_id) for robot_id in robot_ids}
+
+
+def remove_status_table():
+    global status_table
+    if status_table is not None:
+        status_table.close()
+        os.remove(status_table.filename)
+        status_table = None
+
+
+# Replies to pos or bat for each robot in robot_ids. Robots that publish
+# their state are answered from the status table, even when suspended, the
+# others are asked through their pipe.
+# Returns K = robot_id, V = reply
+def query_status(command, robot_ids):
+    replies = {}
+    for robot_id, status in read_statuses(robot_ids).items():
+        if status is None:
+            continue
+        _, position, battery, suspended = status
+        if command == "pos":
+            replies[robot_id] = f"Position: {position[0]} {position[1]}"
+        else:
+            replies[robot_id] = f"Battery: {battery}"
+        if suspended:
+            replies[robot_id] += " (stopped)"
+    asked = exchange({robot_id: [command] for robot_id in robot_ids if robot_id not in replies})
+    for robot_id, (response,) in asked.items():
+        replies[robot_id] = response
+    return {robot_id: replies[robot_id] for robot_id in robot_ids}
+
+
+# Deliver a signal to robots. In-process robots get the effect of the
+# robot's handler directly and robots reached over TCP the matching in-band
+# command, all in one exchange. The handlers of the robots that publish their
+# state write it again, and their slots are waited for, so that a pos or bat
+# right after reads the state the signal made.
+def signal_robots(robot_ids, sig):
+    if fleet is not None:
+        if journal is not None:
+            for robot_id in robot_ids:
+                journal.control(robot_id, JOURNAL_CONTROLS[sig])
+        fleet.control(robot_ids, sig)
+        return
+    in_band = {}
+    written = {}  # K = slot, V = its sequence number before the signal
+    for robot_id in robot_ids:
+        if journal is not None:
+            journal.control(robot_id, JOURNAL_CONTROLS[sig])
+        if inproc:
+            channels[robot_id].signal(sig)
+        elif robot_id in remote:
+            in_band[robot_id] = [CONTROL_COMMANDS[sig]]
+        else:
+            slot = status_slot(robot_id)
+            if slot is not None:
+                written[slot] = status_table.sequence(slot)
+            os.kill(robots[robot_id], sig)
+    if in_band:
+        exchange(in_band)
+    deadline = time.monotonic() + SIGNAL_TIMEOUT
+    for slot, sequence in written.items():
+        status_table.wait_write(slot, sequence, deadline)
+
+
+# Switch to in-process robots sharing sensor. With threads > 0 the commands
+# of an exchange are run on that many threads.
+def start_inproc(sensor, threads_count=0):
+    global inproc, clock, executor, threads
+    import robot
+    robot.SENSOR = sensor
+    clock = VirtualClock()
+    robot.CLOCK = clock
+    inproc = True
+    threads = threads_count
+    if threads > 0:
+        executor = ThreadPoolExecutor(threads)
+
+
+# Start a robot. With an address, the robot is the server listening there
+# and only gets its id, position and battery.
+def start_robot(robot_id, position, battery, filename, address=None):
+    if inproc:
+        start_local_robot(robot_id, position, battery)
+        return
+    if fleet is not None:
+        start_sharded_robot(robot_id, position, battery)
+        return
+    if address is not None:
+        start_remote_robot(robot_id, position, battery, address)
+        return
+
     # Create two pipes for bidirectional communication
     child_from_parent, parent_to_child = os.pipe()  # Parent-to-Child pipe
     parent_from_child, child_to_parent = os.pipe()  # Child-to-Parent pipe
 
+    # Anything still buffered would otherwise be written again by the child
+    sys.stdout.flush()
     pid = os.fork()
 
     if pid == 0:  # Child process
@@ -75,17 +391,24 @@ def start_robot(robot_id, position, battery, filename):
         os.close(parent_from_child)
 
         # Redirect child's stdin to read end of pipe
-        os.dup2(child_from_parent, sys.stdin.fileno())
+        os.dup2(child_from_parent, STDIN_FILENO)
 
         # Redirect child's stdout to write end of other pipe
-        os.dup2(child_to_parent, sys.stdout.fileno())
+        os.dup2(child_to_parent, STDOUT_FILENO)
 
         os.close(child_from_parent)
         os.close(child_to_parent)
 
+        if launcher == 'zygote':
+            run_forked_robot(robot_id, position, battery, filename)
+
         # Execute robot.py as the child process
+        slot = status_slot(robot_id)
         os.execvp("python3", ["python3", "robot.py", str(
-            robot_id), "-f", filename, "-pos", str(position[0]), str(position[1]), "-b", str(battery)])
+            robot_id), "-f", filename, "-pos", str(position[0]), str(position[1]), "-b", str(battery)]
+            + (["-framed"] if framed else [])
+            + (["-status", status_table.filename, "-slot", str(slot)] if slot is not None else [])
+            + (["-profile", profile_dir, "-profiler", profiler] if profile_dir is not None else []))
         sys.exit(0)
 
     else:  # Parent process
@@ -95,53 +418,578 @@ def start_robot(robot_id, position, battery, filename):
 
         print(f'Robot {robot_id} PID: {pid} Position: {position}')
 
-        # Store pipes, positions, and pids in dictionaries
-        pipes[robot_id] = (parent_to_child, parent_from_child)
+        # Store channels, positions, and pids in dictionaries
+        channels[robot_id] = Channel(parent_to_child, parent_from_child, framed)
         positions[robot_id] = position
         robots[robot_id] = pid
+        robot_stats[robot_id] = RobotStats()
+
+
+# Check if there is treasure at the starting squares of the robots
+def check_start_squares():
+    if fleet is not None:
+        for robot_id, treasure in fleet.check_start().items():
+            if treasure and positions[robot_id] not in treasures_found:
+                treasures_found.add(positions[robot_id])
+                if len(treasures_found) == num_treasures:
+                    hunt_complete()
+        print_room()
+        return
+    treasure_replies = exchange({robot_id: ["tr"] for robot_id in positions})
+    for robot_id, (response,) in treasure_replies.items():
+        if "Treasure" in response:
+            treasures_found.add(positions[robot_id])
+            # Treasure was not yet discovered
+            if room_grid[positions[robot_id]] != 'T':
+                set_cell(positions[robot_id], 'T')
+                if len(treasures_found) == num_treasures:
+                    hunt_complete()
+        else:
+            set_cell(positions[robot_id], '-')
+    print_room()
+
+
+# Create an in-process robot. The robots all live in this process, which is
+# the PID reported for them.
+def start_local_robot(robot_id, position, battery):
+    import robot
+    print(f'Robot {robot_id} PID: {os.getpid()} Position: {position}')
+    channels[robot_id] = LocalChannel(robot.Robot(str(robot_id), list(position), battery))
+    positions[robot_id] = position
+    robots[robot_id] = os.getpid()
+    robot_stats[robot_id] = RobotStats()
+
+
+# Hand a robot to the worker of the band it starts in, which is the PID
+# reported for it
+def start_sharded_robot(robot_id, position, battery):
+    robots[robot_id] = fleet.add_robot(robot_id, position, battery)
+    print(f'Robot {robot_id} PID: {robots[robot_id]} Position: {position}')
+    positions[robot_id] = position
+    robot_stats[robot_id] = RobotStats()
+
+
+# Connect to a robot server and initialize its robot. The PID reported is
+# that of the server, on its own node.
+def start_remote_robot(robot_id, position, battery, address):
+    fd = connection_pool.get(address).fileno()
+    channels[robot_id] = Channel(fd, fd, framed=True)
+    positions[robot_id] = position
+    remote[robot_id] = address
+    robot_stats[robot_id] = RobotStats()
+    response = send_command(robot_id, f"init {robot_id} {position[0]} {position[1]} {battery}")
+    if not response.startswith("Ready "):
+        print(f"Robot {robot_id} at {address[0]}:{address[1]} did not start: {response}")
+        sys.exit(1)
+    robots[robot_id] = int(response.split()[1])
+    print(f'Robot {robot_id} PID: {robots[robot_id]} Position: {position}')
+
+
+# Run a robot in a child forked by the zygote launcher. Never returns.
+def run_forked_robot(robot_id, position, battery, filename):
+    import robot
+    # Pipes of the other robots were inherited by the fork, unlike with exec
+    for channel in channels.values():
+        os.close(channel.write_fd)
+        os.close(channel.read_fd)
+    # Fresh stdio objects on the redirected descriptors
+    sys.stdin = open(STDIN_FILENO, 'r', closefd=False)
+    sys.stdout = open(STDOUT_FILENO, 'w', closefd=False)
+    if profile_dir is not None:
+        profiling.start(profile_dir, f"robot-{robot_id}", profiler)
+    status = 1
+    try:
+        robot.run_forked(robot_id, position, battery, filename, framed,
+                         status_table, status_slot(robot_id))
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    finally:
+        sys.stdout.flush()
+        profiling.stop()
+        # Skip the master's cleanup, this process only ran the robot
+        os._exit(status)
+
+
+# Send a list of commands to each robot (K = robot_id, V = commands), one
+# write per robot and all of them before reading any reply, then collect the
+# replies concurrently as they arrive. The latency of every reply is recorded
+# in the robot's stats, and robots that keep the master waiting longer than
+# REPLY_TIMEOUT are reported. Without a timeout the master keeps waiting for
+# them, otherwise it gives up after timeout seconds and the missing replies
+# are empty.
+# Returns K = robot_id, V = list of replies, in the same order as commands.
+def exchange(commands, timeout=None):
+    global exchanging
+    if event_loop is not None and not inproc and threading.get_ident() != loop_thread:
+        return asyncio.run_coroutine_threadsafe(exchange_async(commands, timeout), event_loop).result()
+    exchanging += 1
+    try:
+        replies = exchange_blocking(commands, timeout)
+    finally:
+        exchanging -= 1
+    if status_requested and not exchanging:
+        # A SIGTSTP came during the exchange
+        sigtstp_handler(signal.SIGTSTP, None)
+    return replies
+
+
+# exchange as run in the thread that calls it, waiting on a selector
+def exchange_blocking(commands, timeout=None):
+    global round_trips
+    round_trips += len(commands)
+    request_ids = {}
+    pending = {}  # K = robot_id, V = (request id, command) not answered yet
+    start = time.perf_counter()
+    for robot_id, ids in zip(commands, send_all(commands)):
+        request_ids[robot_id] = ids
+        pending[robot_id] = list(zip(ids, commands[robot_id]))
+
+    with selectors.DefaultSelector() as selector:
+        for robot_id, ids in request_ids.items():
+            if channels[robot_id].has_replies(ids):
+                record_replies(robot_id, pending, start)
+            else:
+                selector.register(channels[robot_id].read_fd, selectors.EVENT_READ, robot_id)
+        deadline = None if timeout is None else start + timeout
+        while selector.get_map():
+            wait = REPLY_TIMEOUT
+            if deadline is not None:
+                wait = min(wait, deadline - time.perf_counter())
+                if wait <= 0:
+                    break
+            events = selector.select(wait)
+            if not events:
+                for key in list(selector.get_map().values()):
+                    # A signal handler's exchange may have read the replies
+                    if channels[key.data].has_replies(request_ids[key.data]):
+                        record_replies(key.data, pending, start)
+                        selector.unregister(key.fd)
+                        continue
+                    report_slow_robot(key.data, pending, start)
+            for key, _ in events:
+                channel = channels[key.data]
+                channel.receive()
+                record_replies(key.data, pending, start)
+                if channel.closed or channel.has_replies(request_ids[key.data]):
+                    selector.unregister(key.fd)
+    return {robot_id: [channels[robot_id].replies.pop(request_id, "").strip() for request_id in ids]
+            for robot_id, ids in request_ids.items()}
+
+
+# exchange as run by event_loop for the commands of -loop asyncio: the
+# replies are read by on_robot_readable, which wakes the exchange up once a
+# robot has answered everything.
+async def exchange_async(commands, timeout=None):
+    global round_trips
+    round_trips += len(commands)
+    request_ids = {}
+    pending = {}  # K = robot_id, V = (request id, command) not answered yet
+    start = time.perf_counter()
+    for robot_id, ids in zip(commands, send_all(commands)):
+        request_ids[robot_id] = ids
+        pending[robot_id] = list(zip(ids, commands[robot_id]))
+
+    waiting = {}  # K = future, V = robot_id
+    for robot_id, ids in request_ids.items():
+        record_replies(robot_id, pending, start)
+        if not channels[robot_id].closed and not channels[robot_id].has_replies(ids):
+            future = event_loop.create_future()
+            reply_waiters.setdefault(robot_id, []).append((ids, pending, start, future))
+            waiting[future] = robot_id
+    deadline = None if timeout is None else start + timeout
+    while waiting:
+        wait = REPLY_TIMEOUT
+        if deadline is not None:
+            wait = min(wait, deadline - time.perf_counter())
+            if wait <= 0:
+                break
+        done, _ = await asyncio.wait(waiting, timeout=wait)
+        if not done:
+            for robot_id in waiting.values():
+                report_slow_robot(robot_id, pending, start)
+        for future in done:
+            del waiting[future]
+    # Stop waiting for the robots that never answered
+    for future, robot_id in waiting.items():
+        reply_waiters[robot_id] = [waiter for waiter in reply_waiters[robot_id] if waiter[3] is not future]
+    return {robot_id: [channels[robot_id].replies.pop(request_id, "").strip() for request_id in ids]
+            for robot_id, ids in request_ids.items()}
+
+
+# Called by event_loop when a robot's pipe or connection can be read
+def on_robot_readable(robot_id):
+    channel = channels[robot_id]
+    channel.receive()
+    if channel.closed:
+        event_loop.remove_reader(channel.read_fd)
+    waiters = reply_waiters.get(robot_id, [])
+    for waiter in list(waiters):
+        ids, pending, start, future = waiter
+        record_replies(robot_id, pending, start)
+        if channel.closed or channel.has_replies(ids):
+            waiters.remove(waiter)
+            if not future.done():
+                future.set_result(None)
+    if channel.notices or channel.closed:
+        notices_arrived.set()
+
+
+# Count and report a robot that has kept an exchange waiting
+def report_slow_robot(robot_id, pending, start):
+    robot_stats[robot_id].timeouts += 1
+    waiting_for = ", ".join(command for _, command in pending[robot_id])
+    print(f"Robot {robot_id} has not answered {waiting_for} after "
+          f"{time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+
+# Send the commands of an exchange and return the request ids of each robot,
+# in the order of commands. In-process robots run the commands as they are
+# sent, split over the threads of executor when there is one.
+def send_all(commands):
+    if executor is None or len(commands) < 2:
+        return [channels[robot_id].send(robot_commands) for robot_id, robot_commands in commands.items()]
+    items = list(commands.items())
+    size = -(-len(items) // threads)
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    return list(itertools.chain.from_iterable(executor.map(send_chunk, chunks)))
+
+
+def send_chunk(items):
+    return [channels[robot_id].send(robot_commands) for robot_id, robot_commands in items]
+
+
+# Record the latency of the replies of a robot that arrived since the last call
+def record_replies(robot_id, pending, start):
+    replies = channels[robot_id].replies
+    elapsed = time.perf_counter() - start
+    waiting = []
+    for request_id, command in pending[robot_id]:
+        if request_id in replies:
+            robot_stats[robot_id].record(command, elapsed)
+        else:
+            waiting.append((request_id, command))
+    pending[robot_id] = waiting
+
+
+# Send a command to a single robot and wait for its reply
+def send_command(robot_id, command):
+    return exchange({robot_id: [command]})[robot_id][0]
+
+
+# Return the id of the robot standing at new_position, other than robot_id
+def find_collision(robot_id, new_position):
+    for other_robot_id, position in positions.items():
+        if new_position == position and robot_id != other_robot_id:
+            return other_robot_id
+    return None
 
 
 # Function to send move command and handle responses for mv <robot_id/all> <direction>
 def move_robot(robot_id, direction):
+    if fleet is not None:
+        move_sharded([robot_id], direction)
+        return
     new_position = calculate_new_position(positions[robot_id], direction)
 
     # Check for potential collisions first
-    for other_robot_id, position in positions.items():
-        if new_position == position and robot_id != other_robot_id:
-            print(f"Collision between robot {robot_id} and {other_robot_id}")
-            return
+    other_robot_id = find_collision(robot_id, new_position)
+    if other_robot_id is not None:
+        report_collision(robot_id, other_robot_id)
+        return
+
+    # Write the move command to the child, followed by the check for treasure
+    # in the new position so both are answered in one round trip
+    response, treasure_response = exchange({robot_id: [f"mv {direction}", "tr"]})[robot_id]
+    apply_move(robot_id, direction, new_position, response, treasure_response)
+
+
+# Move every robot one cell. The result is the same as moving them one after
+# the other in id order, but all the robots whose collision check does not
+# depend on a move still in flight are sent their command at once and the
+# replies are collected concurrently. Results are printed in id order.
+def move_all(direction):
+    if fleet is not None:
+        for robot_ids in sharded_batches(direction):
+            move_sharded(robot_ids, direction)
+        return
+    robot_ids = sorted(robots)
+    order = {robot_id: index for index, robot_id in enumerate(robot_ids)}
+    targets = {robot_id: calculate_new_position(positions[robot_id], direction)
+               for robot_id in robot_ids}
+    final_positions = {}  # K = robot_id, V = position once its move is known
+    collisions = {}  # K = robot_id, V = id of the robot in the way
+    replies = {}  # K = robot_id, V = (move reply, treasure reply)
+    treasures_left = num_treasures - len(treasures_found)
+    can_end = treasures_left > 0
+    # Robots by the cell they stand on and by the cell they move to, so only
+    # the robots around a target are looked at
+    nearby = {}
+    for robot_id in robot_ids:
+        nearby.setdefault(positions[robot_id], []).append(robot_id)
+        nearby.setdefault(targets[robot_id], []).append(robot_id)
+
+    while len(final_positions) < len(robot_ids):
+        if can_end and treasures_left == 0:
+            break
+        # The hunt ends as soon as the last treasure is found. When few are
+        # left, only the robots up to the one that could find it are moved,
+        # and no robot may overtake one that is still waiting.
+        limited = can_end and treasures_left < len(robot_ids) - len(final_positions)
+        batch = {}
+        for robot_id in robot_ids:
+            if robot_id in final_positions:
+                continue
+            if limited and len(batch) == treasures_left:
+                break
+            target = targets[robot_id]
+            others = sorted(set(nearby[target]), key=order.get)
+            # An earlier robot whose move is still unknown may end up on
+            # the target, so this robot has to wait for the next round
+            if any(order[other_robot_id] < order[robot_id] and other_robot_id not in final_positions
+                   for other_robot_id in others):
+                if limited:
+                    break
+                continue
+            # Earlier robots are seen where their move left them
+            for other_robot_id in others:
+                position = positions[other_robot_id]
+                if order[other_robot_id] < order[robot_id]:
+                    position = final_positions.get(other_robot_id, position)
+                if target == position and robot_id != other_robot_id:
+                    collisions[robot_id] = other_robot_id
+                    final_positions[robot_id] = positions[robot_id]
+                    break
+            else:
+                # The treasure check is answered in the same round trip
+                batch[robot_id] = [f"mv {direction}", "tr"]
+
+        for robot_id, (response, treasure_response) in exchange(batch).items():
+            replies[robot_id] = (response, treasure_response)
+            if "OK" in response:
+                final_positions[robot_id] = targets[robot_id]
+                row, col = targets[robot_id]
+                if "Treasure" in treasure_response and room_grid[row, col] != 'T':
+                    treasures_left -= 1
+            else:
+                final_positions[robot_id] = positions[robot_id]
+
+    for robot_id in robot_ids:
+        if robot_id in collisions:
+            report_collision(robot_id, collisions[robot_id])
+        elif robot_id in replies:
+            apply_move(robot_id, direction, targets[robot_id], *replies[robot_id])
+
+
+# The robots of move_all on the shards, in batches moved one after the other
+# in id order, None for all of them at once. The hunt ends as soon as the
+# last treasure is found, so a batch ends with the robot that may find it,
+# the last of those moving to a treasure not found yet.
+def sharded_batches(direction):
+    robot_ids = sorted(robots)
+    if len(treasures_found) == num_treasures:
+        yield None
+        return
+    targets = [calculate_new_position(positions[robot_id], direction) for robot_id in robot_ids]
+    on_treasure = SENSOR.with_treasure_at(targets)
+    start = 0
+    while start < len(robot_ids):
+        treasures_left = num_treasures - len(treasures_found)
+        end = start
+        finders = 0
+        while end < len(robot_ids) and finders < treasures_left:
+            if on_treasure[end] and targets[end] not in treasures_found:
+                finders += 1
+            end += 1
+        yield None if start == 0 and end == len(robot_ids) else robot_ids[start:end]
+        start = end
 
-    # Write the move command to the child and wait for response
-    child_from_parent, child_to_parent = pipes[robot_id]
-    os.write(child_from_parent, f"mv {direction}\n".encode())
-    response = os.read(child_to_parent, 1024).decode().strip()
 
+# Move robot_ids, or all the robots when None, on the shards and report the
+# results in id order as apply_move does. The shards keep the map.
+def move_sharded(robot_ids, direction):
+    global moves
+    for robot_id, outcome, detail in fleet.move(robot_ids, direction):
+        if outcome == 'collision':
+            report_collision(robot_id, detail)
+        elif outcome == 'ok':
+            moves += 1
+            place_robot(robot_id, calculate_new_position(positions[robot_id], direction))
+            if detail and positions[robot_id] not in treasures_found:
+                treasures_found.add(positions[robot_id])
+                print(f"Treasure found by robot {robot_id}!")
+                if len(treasures_found) == num_treasures:
+                    hunt_complete()
+            print(f"Robot {robot_id} status: OK")
+        elif outcome == 'ko':
+            print(f"Robot {robot_id} cannot move {direction}")
+            print(f"Robot {robot_id} status: KO")
+        else:
+            print(f"Robot {robot_id} is stopped")
+
+
+def report_collision(robot_id, other_robot_id):
+    robot_stats[robot_id].collisions += 1
+    print(f"Collision between robot {robot_id} and {other_robot_id}")
+
+
+# Update the room and the robot position with the replies to a move
+def apply_move(robot_id, direction, new_position, response, treasure_response):
+    global moves
     if "OK" in response:
-        positions[robot_id] = new_position
-        # Check if there is treasure in the new position
-        os.write(child_from_parent, f"tr\n".encode())
-        response = os.read(child_to_parent, 1024).decode().strip()
-        if "Treasure" in response:
+        moves += 1
+        place_robot(robot_id, new_position)
+        if "Treasure" in treasure_response:
             treasures_found.add(positions[robot_id])
             # Treasure was not yet discovered
-            if room_grid[positions[robot_id][0]][positions[robot_id][1]] != 'T':
-                room_grid[positions[robot_id][0]][positions[robot_id][1]] = 'T'
+            if room_grid[positions[robot_id]] != 'T':
+                set_cell(positions[robot_id], 'T')
                 print(f"Treasure found by robot {robot_id}!")
                 if len(treasures_found) == num_treasures:
-                    print("All treasures found!")
-                    shutdown_robots()
+                    hunt_complete()
         else:
-            room_grid[positions[robot_id][0]][positions[robot_id][1]] = '-'
+            set_cell(positions[robot_id], '-')
         print(f"Robot {robot_id} status: OK")
     elif "KO" in response:
         print(f"Robot {robot_id} cannot move {direction}")
         print(f"Robot {robot_id} status: KO")
         if new_position[0] >= 0 and new_position[0] < room_dimensions[0] and new_position[1] >= 0 and new_position[1] < room_dimensions[1]:
-            room_grid[new_position[0]][new_position[1]] = 'X'
+            set_cell(new_position, 'X')
     elif "stopped" in response:
         print(f"Robot {robot_id} is stopped")
 
 
+# Letters used by the robot path command for each direction
+PATH_LETTERS = {'up': 'U', 'down': 'D', 'left': 'L', 'right': 'R'}
+
+
+# Walk a robot along a list of directions in a single round trip. The robot
+# stops by itself before a cell taken by another robot, when its battery is
+# too low, at the first obstacle, or once it has found all the treasures
+# still missing, and reports every cell it entered.
+def move_path(robot_id, directions):
+    apply_path(robot_id, directions, send_command(robot_id, path_command(robot_id, directions)))
+
+
+def path_command(robot_id, directions):
+    command = f"path {','.join(PATH_LETTERS[direction] for direction in directions)}"
+    fence = ";".join(f"{row},{col}" for other_robot_id, (row, col) in positions.items()
+                     if other_robot_id != robot_id)
+    if fence:
+        command += f" fence={fence}"
+    treasures_left = num_treasures - len(treasures_found)
+    if treasures_left > 0:
+        command += f" until={treasures_left}"
+        if treasures_found:
+            command += " known=" + ";".join(f"{row},{col}" for row, col in treasures_found)
+    return command
+
+
+# Update the room and the robot position with the report of a path command
+def apply_path(robot_id, directions, response):
+    global moves
+    if "stopped" in response:
+        print(f"Robot {robot_id} is stopped")
+        return
+    _, status, *cells = response.split()
+    moved = 0
+    for cell in cells:
+        row, col, content = cell.split(',')
+        row, col = int(row), int(col)
+        if content == 'X':
+            if row >= 0 and row < room_dimensions[0] and col >= 0 and col < room_dimensions[1]:
+                set_cell((row, col), 'X')
+            continue
+        moved += 1
+        moves += 1
+        place_robot(robot_id, (row, col))
+        if content == 'T':
+            treasures_found.add((row, col))
+            # Treasure was not yet discovered
+            if room_grid[row, col] != 'T':
+                set_cell((row, col), 'T')
+                print(f"Treasure found by robot {robot_id}!")
+                if len(treasures_found) == num_treasures:
+                    print(f"Robot {robot_id} moved {moved} of {len(directions)} cells")
+                    hunt_complete()
+        else:
+            set_cell((row, col), '-')
+
+    print(f"Robot {robot_id} moved {moved} of {len(directions)} cells")
+    if status in ("done", "found"):
+        print(f"Robot {robot_id} status: OK")
+    elif status == "fence":
+        new_position = calculate_new_position(positions[robot_id], directions[moved])
+        report_collision(robot_id, find_collision(robot_id, new_position))
+    else:  # Obstacle or low battery
+        print(f"Robot {robot_id} cannot move {directions[moved]}")
+        print(f"Robot {robot_id} status: KO")
+
+
+# Explore the room on its own until every treasure is found, nothing
+# reachable is left unknown, or max_waves waves were run. Each wave plans a
+# path for every robot that can move (see explore.py), sends all the paths
+# in one exchange and applies the reports in id order.
+def explore(max_waves=None):
+    global exploration
+    exploration = {'waves': 0, 'steps': 0, 'round_trips': round_trips,
+                   'start': time.perf_counter()}
+    batteries = {robot_id: read_battery(response)
+                 for robot_id, (response,) in exchange({robot_id: ["bat"] for robot_id in channels}).items()}
+    while max_waves is None or exploration['waves'] < max_waves:
+        plans = plan_wave(room_grid, positions, batteries)
+        if not plans:
+            if all(battery < MOVE_COST for battery in batteries.values()):
+                print("No robot has enough battery to move")
+            else:
+                print("Nothing left to explore")
+            break
+        exploration['waves'] += 1
+        # The battery left after the path is what the next wave plans with
+        commands = {robot_id: [path_command(robot_id, [direction for direction, _ in path]), "bat"]
+                    for robot_id, path in plans.items()}
+        replies = exchange(commands)
+        progress = False
+        for robot_id in sorted(plans):
+            response, battery_response = replies[robot_id]
+            batteries[robot_id] = read_battery(battery_response)
+            apply_path(robot_id, [direction for direction, _ in plans[robot_id]], response)
+            exploration['steps'] += response.count(',T') + response.count(',W')
+            # Any cell in the report, even an obstacle, is something learnt
+            progress = progress or "," in response
+        print_room()
+        save_journal()
+        if not progress:
+            print("No robot can make progress")
+            break
+    print_exploration()
+    exploration = None
+
+
+# Battery level in a bat reply, 0 when the robot cannot answer
+def read_battery(response):
+    if response.startswith("Battery: "):
+        return int(response.split()[1])
+    return 0
+
+
+def print_exploration():
+    elapsed = time.perf_counter() - exploration['start']
+    print(f"Exploration: {exploration['waves']} waves, {exploration['steps']} steps, "
+          f"{round_trips - exploration['round_trips']} round trips, {elapsed:.3f} s")
+
+
+# Print the stats of one robot, or a line per robot for "all"
+def print_stats(target):
+    if fleet is not None:  # The robots are not talked to through channels
+        return
+    if target == "all":
+        lines = fleet_report(robot_stats, channels)
+    else:
+        robot_id = int(target)
+        lines = robot_report(robot_id, robot_stats[robot_id], channels[robot_id])
+    print("\n".join(lines))
+
+
 def calculate_new_position(current_position, direction):
     if direction == "up":
         return (current_position[0] - 1, current_position[1])
@@ -153,19 +1001,353 @@ def calculate_new_position(current_position, direction):
         return (current_position[0], current_position[1] + 1)
 
 
-def print_room():
-    grid_with_robots = [row[:] for row in room_grid]
-    # Add 'R' in front of the current square if it is 'T'
-    for robot_id, position in positions.items():
-        row, col = position
-        if room_grid[row][col] == 'T':
-            grid_with_robots[row][col] = 'RT'
-        else:  # Grid currently has '?' or '-'
-            grid_with_robots[row][col] = 'R'
-    print("Our information about the room so far:")
-    for row in grid_with_robots:
-        print(" ".join(row))
-    print()
+# Record what is known about a cell of the room
+def set_cell(position, value):
+    room_grid[position] = value
+    renderer.mark(position[0], position[1])
+    if journal is not None:
+        journal.cell(position, value)
+
+
+# Record where a robot moved to
+def place_robot(robot_id, position):
+    positions[robot_id] = position
+    if journal is not None:
+        journal.move(robot_id, position)
+
+
+# Write the journal out, with a snapshot of the state first when one is due
+# or force is set. The batteries come from the status table, or from the
+# robots that have none.
+def save_journal(force=False):
+    if journal is None:
+        return
+    if force or journal.snapshot_due():
+        states = {}  # K = robot_id, V = (position, battery, suspended)
+        for robot_id, position in positions.items():
+            status = read_status(robot_id)
+            if status is not None:
+                states[robot_id] = (position, status[2], status[3])
+        unknown = {robot_id: ["status"] for robot_id in positions if robot_id not in states}
+        for robot_id, (response,) in (exchange(unknown) if unknown else {}).items():
+            battery = response.rpartition("Bat: ")[2]
+            states[robot_id] = (positions[robot_id], int(battery) if battery.isdigit() else 0,
+                                robot_id in journal.suspended)
+        journal.snapshot(room_grid, states)
+    journal.flush()
+
+
+# Draw the room with the robots. Automatic renders may be throttled or
+# turned off, force draws it in any case.
+def print_room(force=False):
+    if fleet is not None:
+        # The map is kept by the shards, only fetched when it is drawn
+        if force or renderer.mode != 'off':
+            renderer.render(fleet.room(), positions, force)
+        return
+    renderer.render(room_grid, positions, force)
+
+
+# The map of the room, fetched from the shards with -shards
+def known_room():
+    return fleet.room() if fleet is not None else room_grid
+
+
+# Print the counts of known cells, or with corners (first_row, first_col,
+# last_row, last_col) the unknown cells of that region, corners included
+def print_coverage(corners):
+    room = known_room()
+    if corners:
+        first_row, first_col, last_row, last_col = corners
+        print(f"Unknown cells in rows {first_row}-{last_row}, columns {first_col}-{last_col}: "
+              f"{room.unknown_in(first_row, first_col, last_row + 1, last_col + 1)}")
+        return
+    cells = room.rows * room.columns
+    print(f"Explored {cells - room.count(UNKNOWN)} of {cells} cells ({room.coverage():.1%}): "
+          f"{room.count(FREE)} free, {room.count(OBSTACLE)} obstacles, {room.count(TREASURE)} treasures, "
+          f"{room.count(UNKNOWN)} unknown")
+
+
+# Commands that need the whole map or the channels in the master process
+SHARDED_UNSUPPORTED = ('path', 'explore', 'stats')
+
+
+# Run one command of the master CLI, already split into words
+def run_command(action):
+    if not action:
+        return
+    command = action[0]
+    if fleet is not None and (command in SHARDED_UNSUPPORTED or command == "mv" and len(action) > 3):
+        print(f"{' '.join(action)} is not available with -shards")
+        return
+
+    if command == "mv":
+        target, direction = action[1], action[2]
+        # Optional number of cells, walked by the robot in one round trip
+        try:
+            count = int(action[3]) if len(action) > 3 else 1
+        except ValueError:  # Not a number of cells
+            count = None
+        if count is None or count < 1 or direction not in PATH_LETTERS:
+            print("Invalid command")
+        elif target == "all":
+            if count > 1:
+                # Each robot walks its cells in turn, in id order
+                for robot_id in sorted(robots):
+                    move_path(robot_id, [direction] * count)
+            else:
+                move_all(direction)
+            print_room()
+        else:
+            robot_id = int(target)
+            if robot_id in robots:
+                if count > 1:
+                    move_path(robot_id, [direction] * count)
+                else:
+                    move_robot(robot_id, direction)
+                print_room()
+            else:
+                print(f"No robot with id {robot_id}")
+    # Case: walk a robot along a path, path <robot_id> <U|D|L|R,...>
+    elif command == "path" and len(action) > 2:
+        robot_id = int(action[1])
+        steps = action[2].split(',')
+        letters = {letter: direction for direction, letter in PATH_LETTERS.items()}
+        if any(step not in letters for step in steps):
+            print("Invalid command")
+        elif robot_id in robots:
+            move_path(robot_id, [letters[step] for step in steps])
+            print_room()
+        else:
+            print(f"No robot with id {robot_id}")
+    # Case: battery of target(s), from the status table when possible
+    elif command == "bat" and len(action) > 1:
+        target = action[1]
+        if target == "all":
+            for robot_id, response in query_status("bat", list(robots)).items():
+                print(f"Robot {robot_id} battery: {response}")
+        else:
+            robot_id = int(target)
+            if robot_id in robots:
+                response = query_status("bat", [robot_id])[robot_id]
+                print(f"Robot {robot_id} battery: {response}")
+            else:
+                print(f"No robot with id {robot_id}")
+    # Case: position of target(s), from the status table when possible
+    elif command == "pos":
+        target = action[1]
+        if target == "all":
+            for robot_id, response in query_status("pos", list(robots)).items():
+                print(f"Robot {robot_id} position: {response}")
+        else:
+            robot_id = int(target)
+            if robot_id in robots:
+                response = query_status("pos", [robot_id])[robot_id]
+                print(f"Robot {robot_id} position: {response}")
+            else:
+                print(f"No robot with id {robot_id}")
+    # Case: send SIGINT to target(s) to suspend
+    elif command == "suspend":
+        target = action[1]
+        print(target)
+        if target == "all":
+            print("Suspending all robots")
+            signal_robots(list(robots), signal.SIGINT)
+        else:
+            robot_id = int(target)
+            if robot_id in robots:
+                print(f"Suspending robot {robot_id}")
+                signal_robots([robot_id], signal.SIGINT)
+            else:
+                print(f"No robot with id {robot_id}")
+    # Case: send SIGQUIT to target(s) to resume
+    elif command == "resume":
+        target = action[1]
+        if target == "all":
+            print("Resuming all robots")
+            signal_robots(list(robots), signal.SIGQUIT)
+        else:
+            robot_id = int(target)
+            if robot_id in robots:
+                print(f"Resuming robot {robot_id}")
+                signal_robots([robot_id], signal.SIGQUIT)
+            else:
+                print(f"No robot with id {robot_id}")
+    # Case: explore the room automatically, explore [max_waves]
+    elif command == "explore":
+        try:
+            max_waves = int(action[1]) if len(action) > 1 else None
+        except ValueError:  # Not a number of waves
+            max_waves = 0
+        if max_waves is not None and max_waves < 1:
+            print("Invalid command")
+        else:
+            explore(max_waves)
+    # Case: latency, traffic and collision counters, stats [id|all]
+    elif command == "stats":
+        target = action[1] if len(action) > 1 else "all"
+        if target == "all" or int(target) in robot_stats:
+            print_stats(target)
+        else:
+            print(f"No robot with id {target}")
+    # Case: move the virtual clock of in-process robots, tick <seconds>
+    elif command == "tick" and len(action) > 1:
+        if inproc or fleet is not None:
+            clock.advance(float(action[1]))
+            if fleet is not None:
+                fleet.tick(float(action[1]))
+            print(f"Virtual time: {clock():.1f} s")
+        else:
+            print("tick needs -inproc or -shards")
+    # Case: draw the room now, whatever the render settings
+    elif command == "room":
+        print_room(force=True)
+    # Case: how much of the room is known,
+    # coverage [first_row first_col last_row last_col]
+    elif command == "coverage" and len(action) in (1, 5):
+        print_coverage([int(word) for word in action[1:]])
+    # Case: write the map as a PGM image, export <file.pgm>
+    elif command == "export" and len(action) > 1:
+        try:
+            known_room().export_pgm(action[1])
+        except OSError as e:
+            print(f"Cannot write {action[1]}: {e.strerror}")
+        else:
+            print(f"Map written to {action[1]}")
+    elif command == "exit":
+        shutdown_robots()
+    else:
+        print("Invalid command")
+    save_journal()
+
+
+# Run the commands of a script, one per line (blank lines and lines
+# starting with # are skipped), then report the throughput and a latency
+# summary per kind of command on report_file. Command output goes to
+# sys.stdout as usual. The robots are shut down at the end of the script.
+def run_script(script_file, report_file):
+    latencies = {}  # K = command name, V = list of latencies in seconds
+    start = time.perf_counter()
+    try:
+        for line in script_file:
+            action = line.split()
+            if not action or action[0].startswith('#'):
+                continue
+            command_start = time.perf_counter()
+            try:
+                run_command(action)
+            finally:
+                latencies.setdefault(action[0], []).append(time.perf_counter() - command_start)
+        shutdown_robots()
+    finally:
+        sys.stdout.flush()
+        print_latency_summary(latencies, time.perf_counter() - start, report_file)
+
+
+def print_latency_summary(latencies, elapsed, out):
+    total = sum(len(values) for values in latencies.values())
+    rate = total / elapsed if elapsed else 0.0
+    print(f"{total} commands in {elapsed:.3f} s, {rate:.1f} commands/s", file=out)
+    print(f"{'command':<10} {'count':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+          file=out)
+    for command, values in sorted(latencies.items()):
+        values.sort()
+        mean = sum(values) / len(values)
+        p50 = values[(len(values) - 1) // 2]
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        print(f"{command:<10} {len(values):>9} {mean * 1000:>9.3f} {p50 * 1000:>9.3f} "
+              f"{p99 * 1000:>9.3f} {values[-1] * 1000:>9.3f}", file=out)
+    out.flush()
+
+
+# The -loop asyncio console. Commands are read by the event loop and run in
+# the order they were typed on command_executor's single thread, except that
+# a run of pos, bat and stats commands already typed runs at once on the
+# readers' threads. What those print is collected and printed in command
+# order, so the output is the same as with the blocking console.
+async def serve_console():
+    global event_loop, loop_thread, notices_arrived
+    event_loop = asyncio.get_running_loop()
+    loop_thread = threading.get_ident()
+    notices_arrived = asyncio.Event()
+    for robot_id, channel in channels.items():
+        if isinstance(channel, Channel) and not channel.closed:
+            event_loop.add_reader(channel.read_fd, on_robot_readable, robot_id)
+    signal_executor = ThreadPoolExecutor(1)
+    event_loop.add_signal_handler(signal.SIGINT, handle_in_thread, signal_executor, sigint_handler, signal.SIGINT)
+    event_loop.add_signal_handler(signal.SIGQUIT, handle_in_thread, signal_executor, sigquit_handler, signal.SIGQUIT)
+    event_loop.add_signal_handler(signal.SIGTSTP, on_sigtstp, signal_executor)
+    output = sys.stdout = ThreadOutput(sys.stdout)
+    lines = ConsoleLines(event_loop, STDIN_FILENO)
+    command_executor = ThreadPoolExecutor(1)
+    readers = ThreadPoolExecutor(READERS)
+
+    # Commands that change something run on command_executor, one at a
+    # time. The console's print as they run, the clients' are captured.
+    async def run(action, capture):
+        if is_read_only(action):
+            return await run_in_thread(readers, output.capture, run_command, action)
+        if capture:
+            return await run_in_thread(command_executor, output.capture, run_command, action)
+        await run_in_thread(command_executor, run_command, action)
+        return ""
+
+    queue = CommandQueue(run, is_read_only)
+    if control_path is not None:
+        await serve_control(control_path, queue)
+
+    while not shutdown_lock.locked():
+        print("Command: ", end="", flush=True)
+        line = await lines.get()
+        if shutdown_lock.locked():
+            break
+        if line is None:  # End of the input, as if exit was typed
+            await run_in_thread(command_executor, shutdown_robots)
+        batch = [line.strip().split()]
+        while is_read_only(batch[-1]) and lines.peek() is not None and is_read_only(lines.peek().split()):
+            batch.append((await lines.get()).strip().split())
+        outputs = await asyncio.gather(*(queue.submit(action, capture=False) for action in batch))
+        print("Command: ".join(outputs), end="", flush=True)
+    # The shutdown in progress ends the master
+    await event_loop.create_future()
+
+
+def is_read_only(action):
+    return bool(action) and action[0] in READ_ONLY_COMMANDS
+
+
+# Run function on one of executor's threads. The master ends with
+# SystemExit on whichever thread ends the hunt, which ends the process.
+async def run_in_thread(executor, function, *args):
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    except SystemExit as e:
+        sys.stdout.flush()
+        os._exit(e.code if isinstance(e.code, int) else 1)
+
+
+# Signal handlers of the event loop, which run the master's handlers on a
+# thread of their own so they do not wait for the command in progress
+def handle_in_thread(executor, handler, sig):
+    event_loop.create_task(run_in_thread(executor, handler, sig, None))
+
+
+def on_sigtstp(executor):
+    if inproc or status_table is not None or remote or fleet is not None:
+        handle_in_thread(executor, sigtstp_handler, signal.SIGTSTP)
+    else:
+        event_loop.create_task(print_notices())
+
+
+# SIGTSTP for robots that answer it with a notice on their pipe, printed
+# once every robot has sent its own
+async def print_notices():
+    for robot_id in robots:
+        channel = channels[robot_id]
+        while not channel.notices and not channel.closed:
+            notices_arrived.clear()
+            await notices_arrived.wait()
+        print(channel.notices.popleft() if channel.notices else "")
 
 
 if __name__ == "__main__":
@@ -173,135 +1355,135 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-room', '--room_filename')
     parser.add_argument('-robots', '--robots_filename')
+    parser.add_argument('-launcher', '--launcher', choices=['exec', 'zygote'],
+                        default='exec')
+    parser.add_argument('-protocol', '--protocol', choices=['framed', 'text'],
+                        default='framed')
+    parser.add_argument('-render', '--render', choices=MODES, default='full')
+    parser.add_argument('-render-interval', '--render-interval', type=float, default=0.0,
+                        help='minimum seconds between two automatic renders')
+    parser.add_argument('-viewport', '--viewport', nargs=2, type=int, default=[20, 40],
+                        metavar=('ROWS', 'COLUMNS'))
+    parser.add_argument('-script', '--script',
+                        help='run the commands of this file (- for stdin) instead of the prompt')
+    parser.add_argument('-log', '--log',
+                        help='with -script, write the command output here instead of discarding it')
+    parser.add_argument('-inproc', '--inproc', action='store_true',
+                        help='run the robots as objects in this process, on a virtual clock')
+    parser.add_argument('-threads', '--threads', type=int, default=0,
+                        help='with -inproc, run the commands of an exchange on this many threads')
+    parser.add_argument('-shards', '--shards', type=int, default=0,
+                        help='run the robots on this many worker processes, each owning a band of the room')
+    parser.add_argument('-hosts', '--hosts',
+                        help='file with the HOST:PORT of a robot server for each robot, see transport.py')
+    parser.add_argument('-loop', '--loop', choices=['asyncio', 'blocking'], default='blocking',
+                        help='serve the console and the robots from an event loop, or block on each')
+    parser.add_argument('-journal', '--journal',
+                        help='write every change of the room and the robots to this file, see journal.py')
+    parser.add_argument('-resume', '--resume', metavar='JOURNAL',
+                        help='restart from the state saved in JOURNAL, instead of -robots, and keep writing to it')
+    parser.add_argument('-profile', '--profile', metavar='DIR',
+                        help='profile the master and every robot, writing the profiles and their merged report in DIR')
+    parser.add_argument('-profiler', '--profiler', choices=profiling.PROFILERS, default='cprofile',
+                        help='with -profile, profile every call or sample the stacks')
+    parser.add_argument('-control', '--control', metavar='PATH',
+                        help='also take commands from the clients of a Unix socket at PATH, see control.py')
     args = parser.parse_args()
+    if args.control and (args.loop != 'asyncio' or args.script):
+        parser.error("-control needs -loop asyncio and the console, not -script")
+    control_path = args.control
+    if args.profile:
+        # As early as possible, the robots are started with it on too
+        profile_dir, profiler = args.profile, args.profiler
+        profiling.clear(profile_dir)
+        profiling.start(profile_dir, 'master', profiler)
+    if args.shards and (args.inproc or args.hosts or args.journal or args.resume):
+        parser.error("-shards cannot be used with -inproc, -hosts, -journal or -resume")
 
     ROOM_FILENAME = args.room_filename
     ROBOTS_FILENAME = args.robots_filename
+    framed = args.protocol == 'framed'
+    renderer = Renderer(args.render, args.render_interval, tuple(args.viewport))
+
+    # In script mode only the summary goes to the console
+    console = sys.stdout
+    if args.script:
+        sys.stdout = open(args.log or os.devnull, 'w')
+
+    # Compile the room once so every robot maps the same binary file
+    # instead of parsing the text file again, unless the room's directory
+    # cannot be written
+    COMPILED_ROOM_FILENAME = ensure_compiled(ROOM_FILENAME)
 
     # Initialize Sensor and get relevant (allowed) information
-    SENSOR = Sensor(ROOM_FILENAME)
+    SENSOR = Sensor(COMPILED_ROOM_FILENAME)
+    if args.inproc:
+        start_inproc(SENSOR, args.threads)
+    elif args.shards:
+        fleet = ShardedFleet(COMPILED_ROOM_FILENAME, args.shards,
+                             (profile_dir, profiler) if profile_dir is not None else None)
+        clock = VirtualClock()
+    elif args.launcher == 'zygote':
+        start_zygote(COMPILED_ROOM_FILENAME)
     room_dimensions = SENSOR.dimensions()
     num_treasures = SENSOR.n_treasures()
-    room_grid = [['?' for _ in range(room_dimensions[1])]
-                 for _ in range(room_dimensions[0])]
+    room_grid = RoomMap(*room_dimensions)
 
     # Signal handling setup
     signal.signal(signal.SIGINT, sigint_handler)
     signal.signal(signal.SIGQUIT, sigquit_handler)
     signal.signal(signal.SIGTSTP, sigtstp_handler)
 
-    # Read robot positions from file and start each robot as a child process
-    with open(ROBOTS_FILENAME, 'r') as robot_file:
-        for robot_id, line in enumerate(robot_file, start=1):
-            pos = tuple(map(int, line.strip().strip("()").split(',')))
-            if not SENSOR.with_obstacle(pos[0], pos[1]):
-                print(f"Invalid initial position for robot at {pos}")
-                sys.exit(1)
-            start_robot(robot_id, pos, 100, ROOM_FILENAME)
-
-    # Check if there is treasure at starting squares
-    for robot_id, position in positions.items():
-        child_from_parent, child_to_parent = pipes[robot_id]
-        os.write(child_from_parent, f"tr\n".encode())
-        response = os.read(child_to_parent, 1024).decode().strip()
-        if "Treasure" in response:
-            treasures_found.add(positions[robot_id])
-            # Treasure was not yet discovered
-            if room_grid[positions[robot_id][0]][positions[robot_id][1]] != 'T':
-                room_grid[positions[robot_id][0]][positions[robot_id][1]] = 'T'
-                if len(treasures_found) == num_treasures:
-                    print("All treasures found!")
-                    shutdown_robots()
-        else:
-            room_grid[positions[robot_id][0]][positions[robot_id][1]] = '-'
-    print_room()
+    if args.resume:
+        # The robots start where the journal last saw them, with what the
+        # master had learnt of the room
+        resumed = load_journal(args.resume)
+        if (resumed['room'].rows, resumed['room'].columns) != room_dimensions:
+            print(f"{args.resume} is the journal of another room")
+            sys.exit(1)
+        room_grid = resumed['room']
+        treasures_found = set(room_grid.find('T'))
+        robot_positions = [position for _, position in sorted(resumed['positions'].items())]
+        batteries = [battery for _, battery in sorted(resumed['batteries'].items())]
+    else:
+        # Read robot positions from file and start each robot as a child process
+        with open(ROBOTS_FILENAME, 'r') as robot_file:
+            robot_lines = robot_file.readlines()
+        robot_positions = [tuple(map(int, line.strip().strip("()").split(','))) for line in robot_lines]
+        batteries = [100] * len(robot_positions)
+    addresses = [None] * len(robot_positions)
+    if args.hosts:
+        with open(args.hosts) as hosts_file:
+            addresses = [parse_address(line) for line in hosts_file if line.strip()]
+        if len(addresses) < len(robot_positions):
+            print(f"{args.hosts} has {len(addresses)} robot servers for {len(robot_positions)} robots")
+            sys.exit(1)
+    elif not args.inproc and not args.shards:
+        status_table = StatusTable(slots=len(robot_positions))
+    # Check every start cell in one query before starting any robot
+    for pos, valid in zip(robot_positions, SENSOR.with_obstacle_at(robot_positions)):
+        if not valid:
+            print(f"Invalid initial position for robot at {pos}")
+            remove_status_table()
+            sys.exit(1)
+    for robot_id, pos in enumerate(robot_positions, start=1):
+        start_robot(robot_id, pos, batteries[robot_id - 1], COMPILED_ROOM_FILENAME, addresses[robot_id - 1])
 
-    # Begin CLI for user commands
-    while True:
-        action = input("Command: ").strip().split()
-        command = action[0]
+    if args.resume or args.journal:
+        journal = Journal(args.resume or args.journal, truncate=not args.resume)
+    check_start_squares()
+    if args.resume:
+        # Every robot has answered by now, so it handles the signal
+        signal_robots(sorted(resumed['suspended']), signal.SIGINT)
+    # The state to resume from if the master stops before its first snapshot
+    save_journal(force=True)
 
-        if command == "mv":
-            target, direction = action[1], action[2]
-            if target == "all":
-                for robot_id in sorted(robots):  # Move each robot sequentially
-                    move_robot(robot_id, direction)
-                print_room()
-            else:
-                robot_id = int(target)
-                if robot_id in pipes:
-                    move_robot(robot_id, direction)
-                    print_room()
-                else:
-                    print(f"No robot with id {robot_id}")
-        # Case: send bat command to target(s)
-        elif command == "bat" and len(action) > 1:
-            target = action[1]
-            if target == "all":
-                for robot_id, (parent_to_child_w, parent_from_child_r) in pipes.items():
-                    os.write(parent_to_child_w, b"bat\n")
-                    response = os.read(parent_from_child_r,
-                                       1024).decode().strip()
-                    print(f"Robot {robot_id} battery: {response}")
-            else:
-                robot_id = int(target)
-                if robot_id in pipes:
-                    parent_to_child_w, parent_from_child_r = pipes[robot_id]
-                    os.write(parent_to_child_w, b"bat\n")
-                    response = os.read(parent_from_child_r,
-                                       1024).decode().strip()
-                    print(f"Robot {robot_id} battery: {response}")
-                else:
-                    print(f"No robot with id {robot_id}")
-        elif command == "pos":  # Case: send pos command to target(s)
-            target = action[1]
-            if target == "all":
-                for robot_id, (parent_to_child_w, parent_from_child_r) in pipes.items():
-                    os.write(parent_to_child_w, b"pos\n")
-                    response = os.read(parent_from_child_r,
-                                       1024).decode().strip()
-                    print(f"Robot {robot_id} position: {response}")
-            else:
-                robot_id = int(target)
-                if robot_id in pipes:
-                    parent_to_child_w, parent_from_child_r = pipes[robot_id]
-                    os.write(parent_to_child_w, b"pos\n")
-                    response = os.read(parent_from_child_r,
-                                       1024).decode().strip()
-                    print(f"Robot {robot_id} position: {response}")
-                else:
-                    print(f"No robot with id {robot_id}")
-        # Case: send SIGINT to target(s) to suspend
-        elif command == "suspend":
-            target = action[1]
-            print(target)
-            if target == "all":
-                print("Suspending all robots")
-                for pid in robots.values():
-                    os.kill(pid, signal.SIGINT)
-            else:
-                robot_id = int(target)
-                if robot_id in robots:
-                    print(f"Suspending robot {robot_id}")
-                    os.kill(robots[robot_id], signal.SIGINT)
-                else:
-                    print(f"No robot with id {robot_id}")
-        # Case: send SIGQUIT to target(s) to resume
-        elif command == "resume":
-            target = action[1]
-            if target == "all":
-                print("Resuming all robots")
-                for pid in robots.values():
-                    os.kill(pid, signal.SIGQUIT)
-            else:
-                robot_id = int(target)
-                if robot_id in robots:
-                    print(f"Resuming robot {robot_id}")
-                    os.kill(robots[robot_id], signal.SIGQUIT)
-                else:
-                    print(f"No robot with id {robot_id}")
-        elif command == "exit":
-            shutdown_robots()
-            break
-        else:
-            print("Invalid command")
+    if args.script:
+        script_file = sys.stdin if args.script == '-' else open(args.script)
+        run_script(script_file, console)
+    elif args.loop == 'asyncio':
+        asyncio.run(serve_console())
+    else:
+        # Begin CLI for user commands
+        while True:
+            run_command(input("Command: ").strip().split())
@@ -0,0 +1,242 @@
+# Profiling of the master and of its robots, for master.py -profile.
+#
+# Every process profiles itself and writes DIR/<tag>.profile.json when it
+# stops, the tag being master, robot-<id> or shard-<band>. Two profilers:
+#   cprofile  cProfile on every thread of the process: exact call counts
+#             and times, at the cost of slowing the calls down
+#   sample    the stacks of the threads running Python code, sampled every
+#             SAMPLE_INTERVAL seconds of CPU time: little overhead, and the
+#             times are estimates
+# A file holds, for every function, the number of calls (None when
+# sampled), its own time and its time including callees, the stacks with
+# the time spent in them, and the CPU time the process had used before
+# profiling started, which is mostly interpreter startup and imports.
+#
+# merge reads all the files of a directory and writes there report.txt, the
+# hottest functions of all the processes and of each of them, and
+# stacks.collapsed, one "tag;outermost;...;innermost microseconds" line per
+# stack as flamegraph.pl and speedscope read them. cProfile only records
+# the callers of a function, not whole stacks, so its stacks are two
+# functions deep: the caller and the callee, with the callee's own time.
+
+import atexit
+import cProfile
+import glob
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILERS = ('cprofile', 'sample')
+SAMPLE_INTERVAL = 0.002  # Seconds of CPU time between two samples
+TOP = 20  # Functions in each table of the report
+SUFFIX = '.profile.json'
+# Functions the threads of the master wait in. A sample whose innermost
+# frame is one of them is of a thread that was not using the CPU.
+IDLE_FUNCTIONS = ('select', 'wait', '_worker', '_wait_for_tstate_lock')
+
+_state = None  # The profile of this process, while it runs
+
+
+# Remove the profile files a previous run left in directory, creating it
+# when needed
+def clear(directory):
+    os.makedirs(directory, exist_ok=True)
+    for filename in glob.glob(os.path.join(directory, '*' + SUFFIX)):
+        os.remove(filename)
+
+
+# Profile this process until stop, or until it exits. A profile inherited
+# from the parent of a forked process is dropped.
+def start(directory, tag, profiler='cprofile'):
+    global _state
+    if _state is not None:
+        _drop()
+    _state = {'directory': directory, 'tag': tag, 'profiler': profiler,
+              'startup_cpu': time.process_time(), 'started': time.perf_counter()}
+    if profiler == 'sample':
+        _state['samples'] = Counter()  # K = stack, V = number of samples
+        signal.signal(signal.SIGPROF, _on_sample)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+    else:
+        _state['profiles'] = [cProfile.Profile()]
+        threading.setprofile(_profile_thread)
+        _state['profiles'][0].enable()
+    atexit.register(stop)
+
+
+# Stop profiling and write the profile file of this process. Returns its
+# name, None when the process was not being profiled.
+def stop():
+    global _state
+    if _state is None:
+        return None
+    state, _state = _state, None
+    cpu = time.process_time()
+    wall = time.perf_counter() - state['started']
+    if state['profiler'] == 'sample':
+        # The handler stays, it ignores the samples still on their way
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        functions, stacks = _from_samples(state['samples'])
+    else:
+        threading.setprofile(None)
+        for profile in state['profiles']:
+            profile.create_stats()
+        # pstats refuses a profile that saw no calls
+        profiles = [profile for profile in state['profiles'] if profile.stats]
+        functions, stacks = _from_cprofile(pstats.Stats(*profiles).stats if profiles else {})
+    filename = os.path.join(state['directory'], state['tag'] + SUFFIX)
+    with open(filename, 'w') as file:
+        json.dump({'tag': state['tag'], 'profiler': state['profiler'], 'pid': os.getpid(),
+                   'startup_cpu': state['startup_cpu'], 'cpu': cpu, 'wall': wall,
+                   'functions': functions, 'stacks': stacks}, file)
+    return filename
+
+
+def _drop():
+    global _state
+    if _state['profiler'] == 'sample':
+        signal.setitimer(signal.ITIMER_PROF, 0)
+    else:
+        threading.setprofile(None)
+        sys.setprofile(None)
+    _state = None
+
+
+# Profile hook of the threads started while profiling with cProfile: give
+# the thread a profile of its own
+def _profile_thread(frame, event, arg):
+    profile = cProfile.Profile()
+    _state['profiles'].append(profile)
+    profile.enable()
+
+
+def _on_sample(signum, frame):
+    if _state is None:
+        return
+    # frame is where the main thread was interrupted, the handler runs there
+    frames = [frame] + [thread_frame for ident, thread_frame in sys._current_frames().items()
+                        if ident != threading.main_thread().ident]
+    for thread_frame in frames:
+        if thread_frame is not None and thread_frame.f_code.co_name not in IDLE_FUNCTIONS:
+            _state['samples'][_stack(thread_frame)] += 1
+
+
+# Names of the functions of frame's stack, outermost first
+def _stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+# Name of a function as pstats keys it, (filename, line, name)
+def _function_name(function):
+    filename, line, name = function
+    if filename == '~':  # Built-in
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+# Functions, K = name, V = [calls, own seconds, seconds with callees], and
+# stacks, K = names joined by ';', V = microseconds
+def _from_cprofile(stats):
+    functions = {}
+    stacks = Counter()
+    for function, (_, calls, own, total, callers) in stats.items():
+        name = _function_name(function)
+        functions[name] = [calls, own, total]
+        if not callers:
+            stacks[_clean(name)] += round(own * 1e6)
+        for caller, caller_stats in callers.items():
+            stacks[_clean(_function_name(caller)) + ';' + _clean(name)] += round(caller_stats[2] * 1e6)
+    return functions, {stack: time for stack, time in stacks.items() if time}
+
+
+def _from_samples(samples):
+    functions = {}
+    stacks = Counter()
+    for stack, count in samples.items():
+        seconds = count * SAMPLE_INTERVAL
+        if not stack:
+            continue
+        for name in set(stack):
+            functions.setdefault(name, [None, 0.0, 0.0])[2] += seconds
+        functions[stack[-1]][1] += seconds
+        stacks[';'.join(_clean(name) for name in stack)] += round(seconds * 1e6)
+    return functions, dict(stacks)
+
+
+# ';' separates the frames of a collapsed stack, and a space its count
+def _clean(name):
+    return name.replace(';', ',').replace(' ', '_')
+
+
+# Merge the profile files of directory into report.txt and stacks.collapsed
+# there. Returns the name of the report.
+def merge(directory):
+    profiles = []
+    for filename in glob.glob(os.path.join(directory, '*' + SUFFIX)):
+        with open(filename) as file:
+            profiles.append(json.load(file))
+    profiles.sort(key=_process_order)
+
+    lines = [f"{'process':<14}{'profiler':>10}{'pid':>9}{'startup cpu s':>15}{'cpu s':>10}{'wall s':>10}"]
+    for profile in profiles:
+        lines.append(f"{profile['tag']:<14}{profile['profiler']:>10}{profile['pid']:>9}"
+                     f"{profile['startup_cpu']:>15.3f}{profile['cpu']:>10.3f}{profile['wall']:>10.3f}")
+    lines.append(f"{'all':<14}{'':>10}{'':>9}{sum(profile['startup_cpu'] for profile in profiles):>15.3f}"
+                 f"{sum(profile['cpu'] for profile in profiles):>10.3f}")
+
+    merged = {}  # K = function name, V = [calls, own seconds, total seconds, processes]
+    for profile in profiles:
+        for name, (calls, own, total) in profile['functions'].items():
+            entry = merged.setdefault(name, [None, 0.0, 0.0, 0])
+            if calls is not None:
+                entry[0] = (entry[0] or 0) + calls
+            entry[1] += own
+            entry[2] += total
+            entry[3] += 1
+    lines.append("")
+    lines.append("All processes")
+    lines.extend(_function_table(merged, processes=True))
+    for profile in profiles:
+        lines.append("")
+        lines.append(profile['tag'])
+        lines.extend(_function_table(profile['functions']))
+
+    report = os.path.join(directory, 'report.txt')
+    with open(report, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    with open(os.path.join(directory, 'stacks.collapsed'), 'w') as file:
+        for profile in profiles:
+            for stack, microseconds in profile['stacks'].items():
+                file.write(f"{profile['tag']};{stack} {microseconds}\n")
+    return report
+
+
+# The master first, then the robots and the shards by number
+def _process_order(profile):
+    kind, _, number = profile['tag'].partition('-')
+    return (kind != 'master', kind, int(number) if number.isdigit() else 0)
+
+
+# Rows of the functions with the most own time, V = [calls, own, total, ...]
+def _function_table(functions, processes=False):
+    header = f"{'own s':>10}{'total s':>10}{'calls':>10}"
+    if processes:
+        header += f"{'processes':>11}"
+    rows = [header + "  function"]
+    for name, entry in sorted(functions.items(), key=lambda item: -item[1][1])[:TOP]:
+        calls, own, total = entry[:3]
+        row = f"{own:>10.4f}{total:>10.4f}{'-' if calls is None else calls:>10}"
+        if processes:
+            row += f"{entry[3]:>11}"
+        rows.append(row + "  " + name)
+    return rows
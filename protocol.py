@@ -0,0 +1,142 @@
+# Wire protocol between the master and the robots.
+#
+# Text mode is what robot.py speaks by default and what a person typing at a
+# robot sees: one command per line, and the robot prints its reply. Most
+# replies are one line, a failed move prints "Robot <id> cannot move <dir>"
+# followed by KO and exit prints the position and the battery.
+#
+# Framed mode (robot.py -framed, used by the master by default) wraps every
+# message in a frame: an 8 byte header with the payload length and a request
+# id, followed by the UTF-8 payload. The master can write many request frames
+# at once and the robot answers all the requests of one read with a single
+# write, each reply carrying the id of its request. Messages a robot sends on
+# its own, such as its status on SIGTSTP, use id NOTICE_ID.
+
+import os
+import struct
+from collections import deque
+
+HEADER = struct.Struct('>II')  # payload length, request id
+NOTICE_ID = 0
+
+
+def encode(request_id, text):
+    payload = text.encode()
+    return HEADER.pack(len(payload), request_id) + payload
+
+
+# Write all of data, a signal may interrupt a large write half way
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+# Splits a byte stream into (request_id, text) frames
+class FrameReader:
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        start = 0
+        while len(self._buffer) - start >= HEADER.size:
+            length, request_id = HEADER.unpack_from(self._buffer, start)
+            end = start + HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            frames.append((request_id, self._buffer[start + HEADER.size:end].decode()))
+            start = end
+        del self._buffer[:start]
+        return frames
+
+
+# The master's end of the connection with one robot. Keeps track of the
+# requests sent and stores the replies as they are read, in either mode.
+class Channel:
+    def __init__(self, write_fd, read_fd, framed=True):
+        self.write_fd = write_fd
+        self.read_fd = read_fd
+        self.framed = framed
+        self.replies = {}  # K = request id, V = reply text
+        self.notices = deque()  # Messages the robot sent on its own
+        self.closed = False  # The robot closed its end
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._next_id = NOTICE_ID + 1
+        self._frames = FrameReader()
+        self._text = b""  # Text mode: bytes read but not yet a full reply
+        self._waiting = deque()  # Text mode: (request id, command) in order
+
+    # Send commands in a single write and return their request ids
+    def send(self, commands):
+        request_ids = []
+        data = []
+        for command in commands:
+            request_id = self._next_id
+            self._next_id += 1
+            request_ids.append(request_id)
+            if self.framed:
+                data.append(encode(request_id, command))
+            else:
+                data.append(f"{command}\n".encode())
+                self._waiting.append((request_id, command))
+        data = b"".join(data)
+        write_all(self.write_fd, data)
+        self.bytes_sent += len(data)
+        return request_ids
+
+    # Read whatever the robot sent and store the complete messages
+    def receive(self):
+        data = os.read(self.read_fd, 65536)
+        self.bytes_received += len(data)
+        if not data:
+            self.closed = True
+            # Nothing else will come, pending requests get an empty reply
+            for request_id, _ in self._waiting:
+                self.replies[request_id] = ""
+            self._waiting.clear()
+            return
+        if self.framed:
+            for request_id, text in self._frames.feed(data):
+                if request_id == NOTICE_ID:
+                    self.notices.append(text)
+                else:
+                    self.replies[request_id] = text
+        else:
+            self._text += data
+            self._split_text()
+
+    # Text mode: cut complete lines into replies, matching them in order
+    # with the requests that were sent
+    def _split_text(self):
+        *lines, self._text = self._text.split(b"\n")
+        lines = [line.decode() for line in lines]
+        while lines:
+            if lines[0].startswith("id: ") or not self._waiting:
+                # SIGTSTP status line
+                self.notices.append(lines.pop(0))
+                continue
+            request_id, command = self._waiting[0]
+            size = 1
+            if command == "exit" or "cannot move" in lines[0]:
+                size = 2
+            if len(lines) < size:
+                break
+            self._waiting.popleft()
+            self.replies[request_id] = "\n".join(lines[:size])
+            del lines[:size]
+        # Keep the lines of a reply that is not complete yet
+        if lines:
+            self._text = "\n".join(lines).encode() + b"\n" + self._text
+
+    def has_replies(self, request_ids):
+        return all(request_id in self.replies for request_id in request_ids)
+
+    # Block until the robot sends a message on its own and return it
+    def wait_notice(self):
+        while not self.notices and not self.closed:
+            self.receive()
+        return self.notices.popleft() if self.notices else ""
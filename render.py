@@ -0,0 +1,141 @@
+# Rendering of the master's knowledge of the room.
+#
+# The Renderer draws room_grid, a RoomMap (see roommap.py), with the robots
+# on top of it in one of these modes:
+# full - the whole grid after every change, as the master always did
+# viewport - only a window of the grid around the robots
+# ansi - the grid is drawn once at the top of the terminal and afterwards
+#        only the cells that changed are redrawn, with ANSI cursor moves.
+#        Command output scrolls in the lines below the grid.
+# off - nothing is drawn unless asked for with render(force=True)
+# Automatic renders closer than `interval` seconds to the previous one are
+# skipped; the changes are drawn by the next render.
+
+import shutil
+import sys
+import time
+
+MODES = ('full', 'viewport', 'ansi', 'off')
+HEADER = "Our information about the room so far:"
+
+
+class Renderer:
+    def __init__(self, mode='full', interval=0.0, viewport=(20, 40), out=None):
+        self.mode = mode
+        self.interval = interval
+        self.viewport = viewport  # (rows, columns) drawn in viewport mode
+        self._out = out
+        self._last_render = None  # time.monotonic() of the last render
+        self._dirty = set()  # Cells changed since the last ansi render
+        self._drawn_robots = {}  # K = position, V = symbol drawn there
+        self._screen = None  # (rows, columns) of the grid on screen, ansi mode
+
+    @property
+    def out(self):
+        return self._out or sys.stdout
+
+    # Record that a cell of room_grid changed
+    def mark(self, row, col):
+        if self.mode == 'ansi':
+            self._dirty.add((row, col))
+
+    def render(self, room_grid, positions, force=False):
+        if self.mode == 'off' and not force:
+            return
+        now = time.monotonic()
+        if (not force and self.interval and self._last_render is not None
+                and now - self._last_render < self.interval):
+            return
+        self._last_render = now
+        if self.mode == 'ansi':
+            self._render_ansi(room_grid, positions, force)
+        elif self.mode == 'viewport':
+            self._render_viewport(room_grid, positions)
+        else:
+            self._render_rows(room_grid, positions, 0, len(room_grid), 0, None, HEADER)
+
+    # Leave the terminal as it was found
+    def close(self):
+        if self._screen is not None:
+            self.out.write("\x1b[r")  # Reset the scrolling region
+            self.out.flush()
+            self._screen = None
+
+    # Print rows [first_row, last_row) and columns [first_col, last_col) of
+    # the grid. Only the rows holding a robot are turned into lists.
+    def _render_rows(self, room_grid, positions, first_row, last_row, first_col, last_col, header):
+        robots_by_row = {}
+        for position in positions.values():
+            robots_by_row.setdefault(position[0], []).append(position[1])
+        lines = [header]
+        for i in range(first_row, last_row):
+            row = room_grid[i]
+            if i in robots_by_row:
+                row = list(row)
+                # Add 'R' in front of the current square if it is 'T'
+                for col in robots_by_row[i]:
+                    row[col] = 'RT' if row[col] == 'T' else 'R'
+            lines.append(" ".join(row[first_col:last_col]))
+        lines.append("\n")
+        self.out.write("\n".join(lines))
+
+    def _render_viewport(self, room_grid, positions):
+        rows, columns = room_grid.rows, room_grid.columns
+        height = min(self.viewport[0], rows)
+        width = min(self.viewport[1], columns)
+        if positions:
+            # Centre the window on the box around all the robots
+            center_row = (min(p[0] for p in positions.values()) + max(p[0] for p in positions.values())) // 2
+            center_col = (min(p[1] for p in positions.values()) + max(p[1] for p in positions.values())) // 2
+        else:
+            center_row, center_col = rows // 2, columns // 2
+        first_row = max(0, min(center_row - height // 2, rows - height))
+        first_col = max(0, min(center_col - width // 2, columns - width))
+        header = (f"{HEADER[:-1]} (rows {first_row}-{first_row + height - 1}, "
+                  f"columns {first_col}-{first_col + width - 1}):")
+        self._render_rows(room_grid, positions, first_row, first_row + height,
+                          first_col, first_col + width, header)
+
+    # Every cell takes three columns on screen so it can be redrawn in place
+    def _render_ansi(self, room_grid, positions, redraw):
+        robots = {}
+        for position in positions.values():
+            robots[tuple(position)] = 'RT' if room_grid[position[0], position[1]] == 'T' else 'R'
+        if self._screen is None or redraw:
+            self._draw_screen(room_grid, robots)
+            return
+        # Cells that changed and cells a robot entered or left
+        dirty = self._dirty
+        dirty.update(position for position, symbol in robots.items()
+                     if self._drawn_robots.get(position) != symbol)
+        dirty.update(position for position in self._drawn_robots if position not in robots)
+        rows, columns = self._screen
+        data = ["\x1b7"]  # Save the cursor, it sits in the scrolling region
+        for row, col in sorted(dirty):
+            if row < rows and col < columns:
+                symbol = robots.get((row, col), room_grid[row, col])
+                data.append(f"\x1b[{row + 2};{col * 3 + 1}H{symbol:<2}")
+        data.append("\x1b8")
+        self.out.write("".join(data))
+        self.out.flush()
+        self._dirty = set()
+        self._drawn_robots = robots
+
+    def _draw_screen(self, room_grid, robots):
+        terminal = shutil.get_terminal_size()
+        # Keep at least a few lines below the grid for command output
+        rows = max(0, min(room_grid.rows, terminal.lines - 6))
+        columns = min(room_grid.columns, terminal.columns // 3)
+        data = ["\x1b[r\x1b[2J\x1b[H", HEADER, "\n"]
+        for i in range(rows):
+            cells = room_grid[i]
+            line = [f"{robots.get((i, j), cells[j]):<2}" for j in range(columns)]
+            data.append(" ".join(line))
+            data.append("\n")
+        # Scroll only the lines under the grid and put the cursor there
+        data.append(f"\x1b[{rows + 3};{terminal.lines}r\x1b[{terminal.lines};1H")
+        self.out.write("".join(data))
+        self.out.flush()
+        self._screen = (rows, columns)
+        self._dirty = set()
+        self._drawn_robots = robots
@@ -2,115 +2,414 @@ import argparse
 import os
 import sys
 import signal
+import socket
+import time
+from collections import deque
+import profiling
+from protocol import NOTICE_ID, FrameReader, encode, write_all
 from sensor import Sensor
+from status import StatusTable
+from transport import listen, parse_address
 
 # Global variables
 FILENAME = None
 SENSOR = None
+robot = None  # The Robot run by this process
+FRAMED = False  # Talk to the master with the framed protocol, see protocol.py
+_writing = False  # A batch of replies is being written
+_pending_notices = deque()  # Notices raised while _writing
+# Descriptors commands are read from and replies written to, the master's
+# connection when the robot runs as a server
+INPUT_FD = 0
+OUTPUT_FD = 1
+DRAIN_INTERVAL = 1.0  # Seconds between two one-point battery drains
+CLOCK = time.monotonic  # Clock of the battery drain, virtual in the master's -inproc mode
+STATUS = None  # StatusTable shared with the master, see status.py
+STATUS_SLOT = None  # Slot of this robot in STATUS
 
 
 class Robot:
+    # Fixed attributes keep the robots small when a master runs many of
+    # them in its own process
+    __slots__ = ('id', 'position', '_battery', '_drained_at', 'is_suspended', '_publications')
+
     # Position = (row, col)
     def __init__(self, id, position=[0, 0], battery=100):
         self.id = id
-        self.battery = battery
+        # The battery loses a point every DRAIN_INTERVAL while the robot is
+        # not suspended. Instead of a timer, the points lost since _drained_at
+        # are taken from _battery whenever the battery is read.
+        self._battery = battery
+        self._drained_at = CLOCK()
         self.is_suspended = False  # Used to mark the robot as suspended
+        self._publications = 0  # Number of _publish calls, see _publish
         # Check if initial position is valid
         if SENSOR.with_obstacle(position[0], position[1]):
             self.position = position
         else:
             print("Invalid initial position")
             sys.exit(1)
+        self._publish()
+
+    @property
+    def battery(self):
+        if not self.is_suspended:
+            ticks = int((CLOCK() - self._drained_at) / DRAIN_INTERVAL)
+            if ticks:
+                self._battery = max(0, self._battery - ticks)
+                self._drained_at += ticks * DRAIN_INTERVAL
+        return self._battery
+
+    # Moves set the battery after the position, so this publishes both
+    @battery.setter
+    def battery(self, value):
+        self.battery  # Take the drain up to now first
+        self._battery = value
+        self._publish()
+
+    # Stop the drain, the part of a second already run is lost
+    def suspend(self):
+        self.battery
+        self.is_suspended = True
+        self._publish()
+
+    # Restart the drain, the next point goes a full interval from now. A
+    # robot that was not suspended restarts its drain too, as the one-second
+    # alarm did when it was set again on every resume.
+    def resume(self):
+        self.battery  # Take the drain up to now first
+        self._drained_at = CLOCK()
+        self.is_suspended = False
+        self._publish()
+
+    # Write the state of the robot into its slot of the status table. A
+    # signal handler may publish in the middle of a publication, in which
+    # case the interrupted one writes again with the newest state.
+    def _publish(self):
+        if STATUS is None:
+            return
+        self._publications += 1
+        while True:
+            publications = self._publications
+            STATUS.write(STATUS_SLOT, int(self.id), self.position, self._battery,
+                         self._drained_at, DRAIN_INTERVAL, self.is_suspended)
+            if publications == self._publications:
+                break
+
+    # Position next to the robot in the given direction
+    def _next_position(self, direction):
+        if direction == "up":
+            return (self.position[0] - 1, self.position[1])
+        elif direction == "left":
+            return (self.position[0], self.position[1] - 1)
+        elif direction == "right":
+            return (self.position[0], self.position[1] + 1)
+        else:
+            return (self.position[0] + 1, self.position[1])
 
     # Attempt to move the robot in the given direction
     def move(self, direction):
         if self.is_suspended:  # Do not perform command if suspended
-            print(f"Robot {self.id} is stopped")
-            return
+            return f"Robot {self.id} is stopped"
         success = False  # Record whether move was successful, from sensor
         if self.battery >= 5:
-            if direction == "up":
-                if SENSOR.with_obstacle(self.position[0] - 1, self.position[1]):
-                    self.position[0] -= 1
-                    success = True
-            elif direction == "left":
-                if SENSOR.with_obstacle(self.position[0], self.position[1] - 1):
-                    self.position[1] -= 1
-                    success = True
-            elif direction == "right":
-                if SENSOR.with_obstacle(self.position[0], self.position[1] + 1):
-                    self.position[1] += 1
-                    success = True
-            else:
-                if SENSOR.with_obstacle(self.position[0] + 1, self.position[1]):
-                    self.position[0] += 1
-                    success = True
+            row, column = self._next_position(direction)
+            if SENSOR.with_obstacle(row, column):
+                self.position[0], self.position[1] = row, column
+                success = True
 
         if success:
-            print("OK")
             self.battery -= 5
+            return "OK"
         else:  # Insufficient battery to move
-            print(f"Robot {self.id} cannot move {direction}\nKO")
+            return f"Robot {self.id} cannot move {direction}\nKO"
+
+    # Follow a sequence of directions with the same rules as move(). Stops
+    # before a cell in fence (occupied by another robot), when the battery
+    # is too low, at the first obstacle, or once `until` treasures that are
+    # not in known have been found. Returns one line:
+    # Path <done|fence|battery|obstacle|found> [row,col,<T|W|X> ...]
+    # listing every cell entered (T treasure, W water) and the obstacle hit.
+    def follow_path(self, directions, fence=(), known=(), until=None):
+        if self.is_suspended:  # Do not perform command if suspended
+            return f"Robot {self.id} is stopped"
+        status = "done"
+        cells = []
+        found = 0
+        for direction in directions:
+            if until is not None and found >= until:
+                status = "found"
+                break
+            row, column = self._next_position(direction)
+            if (row, column) in fence:
+                status = "fence"
+                break
+            if self.battery < 5:
+                status = "battery"
+                break
+            if not SENSOR.with_obstacle(row, column):
+                status = "obstacle"
+                cells.append(f"{row},{column},X")
+                break
+            self.position[0], self.position[1] = row, column
+            self.battery -= 5
+            if SENSOR.with_treasure(row, column):
+                cells.append(f"{row},{column},T")
+                if (row, column) not in known:
+                    found += 1
+            else:
+                cells.append(f"{row},{column},W")
+        else:
+            if until is not None and found >= until:
+                status = "found"
+        return " ".join(["Path", status] + cells)
 
     def has_treasure(self):
         if self.is_suspended:  # Do not perform command if suspended
-            print(f"Robot {self.id} is stopped")
-            return
+            return f"Robot {self.id} is stopped"
         if SENSOR.with_treasure(self.position[0], self.position[1]):
-            print(f"Treasure at {self.position[0]} {self.position[1]}")
+            return f"Treasure at {self.position[0]} {self.position[1]}"
         else:
-            print(f"Water at {self.position[0]} {self.position[1]}")
+            return f"Water at {self.position[0]} {self.position[1]}"
 
-    def print_battery(self):
+    def report_battery(self):
         if self.is_suspended:  # Do not perform command if suspended
-            print(f"Robot {self.id} is stopped")
-            return
-        print(f'Battery: {robot.battery}')
+            return f"Robot {self.id} is stopped"
+        return f'Battery: {self.battery}'
 
-    def print_position(self):
+    def report_position(self):
         if self.is_suspended:  # Do not perform command if suspended
-            print(f"Robot {self.id} is stopped")
-            return
-        print(f'Position: {robot.position[0]} {robot.position[1]}')
+            return f"Robot {self.id} is stopped"
+        return f'Position: {self.position[0]} {self.position[1]}'
 
+    # Robot information to report before exiting
     def shutdown(self):
-        # Print robot information before exiting
-        self.print_position()
-        self.print_battery()
-        sys.exit(0)
+        return f"{self.report_position()}\n{self.report_battery()}"
 
+    # Run one command line and return the reply
+    def execute(self, line):
+        action = line.split(' ')
+        # Analyze second argument in case command is mv
+        direction = action[1] if len(action) > 1 else None
+        # Call appropriate function based on case
+        match action[0]:
+            case 'mv':
+                return self.move(direction)
+            case 'bat':
+                return self.report_battery()
+            case 'pos':
+                return self.report_position()
+            case 'tr':
+                return self.has_treasure()
+            case 'path':
+                # path <steps> [fence=<cells>] [known=<cells>] [until=<n>]
+                # steps are U, D, L or R separated by commas
+                if direction is None or any(step not in PATH_STEPS for step in direction.split(',')):
+                    return "Invalid command"
+                try:
+                    options = dict(option.split('=', 1) for option in action[2:])
+                    until = int(options['until']) if 'until' in options else None
+                    fence, known = parse_cells(options.get('fence')), parse_cells(options.get('known'))
+                except ValueError:  # An option without '=', or not a number where one is
+                    return "Invalid command"
+                return self.follow_path([PATH_STEPS[step] for step in direction.split(',')],
+                                         fence, known, until)
+            case 'exit':
+                return self.shutdown()
+            # In-band versions of the signals, for robots run as servers
+            case 'suspend':
+                self.suspend()
+                return "OK"
+            case 'resume':
+                self.resume()
+                return "OK"
+            case 'refill':
+                self.battery = 100
+                return "OK"
+            case 'status':
+                return f"id: {self.id} P: {self.position} Bat: {self.battery}"
+            case _:
+                return "Invalid command"
 
-if __name__ == "__main__":
-    def sigint_handler(sig, frame):
-        robot.is_suspended = True
-        # Ignore sigalrm handler to pause battery
-        signal.signal(signal.SIGALRM, signal.SIG_IGN)
 
-    def sigquit_handler(sig, frame):
-        robot.is_suspended = False
-        signal.signal(signal.SIGALRM, sigalrm_handler)
-        signal.alarm(1)  # Restart alarm
+# Signal handlers for the robot process
 
-    def sigtstp_handler(sig, frame):
+
+def sigint_handler(sig, frame):
+    robot.suspend()  # Pauses the battery drain too
+
+
+def sigquit_handler(sig, frame):
+    robot.resume()
+
+
+def sigtstp_handler(sig, frame):
+    if STATUS is not None:  # The master reads the status table instead
+        return
+    status = f"id: {robot.id} P: {robot.position} Bat: {robot.battery}"
+    if FRAMED:
+        send_notice(status)
+    else:
         # Flush so that output can be read by master
-        print(
-            f"id: {robot.id} P: {robot.position} Bat: {robot.battery}", flush=True)
+        print(status, flush=True)
+
 
-    def sigusr1_handler(sig, frame):
-        robot.battery = 100
+def sigusr1_handler(sig, frame):
+    robot.battery = 100
 
-    def sigalrm_handler(sig, frame):
-        if robot.battery > 0:
-            robot.battery -= 1
-        # Restart alarm to decrease battery every second
-        signal.alarm(1)
 
+def install_signal_handlers():
     signal.signal(signal.SIGINT, sigint_handler)
     signal.signal(signal.SIGQUIT, sigquit_handler)
     signal.signal(signal.SIGTSTP, sigtstp_handler)
     signal.signal(signal.SIGUSR1, sigusr1_handler)
-    signal.signal(signal.SIGALRM, sigalrm_handler)
-    signal.alarm(1)
+
+
+# Load the room once so that robots forked from this process (see the
+# zygote launcher in master.py) start without opening it again
+def preload(filename):
+    global FILENAME, SENSOR
+    FILENAME = filename
+    SENSOR = Sensor(filename)
+
+
+# Directions accepted by the path command
+PATH_STEPS = {'U': 'up', 'D': 'down', 'L': 'left', 'R': 'right'}
+
+
+# Parse a list of cells written as row,col;row,col. Raises ValueError when
+# one is not two numbers.
+def parse_cells(text):
+    if not text:
+        return set()
+    cells = {tuple(map(int, cell.split(','))) for cell in text.split(';')}
+    if any(len(cell) != 2 for cell in cells):
+        raise ValueError(f"Invalid cells: {text}")
+    return cells
+
+
+# Run one command line and return the reply
+def execute(line):
+    if line.split()[:1] == ['init']:
+        return init_robot(line)
+    if robot is None:
+        return "Not initialized"
+    return robot.execute(line)
+
+
+# Server mode: create the robot from init <id> <row> <col> <battery>
+def init_robot(line):
+    global robot
+    try:
+        robot_id, row, column, battery = line.split()[1:]
+        row, column, battery = int(row), int(column), int(battery)
+    except ValueError:  # Missing fields, or not numbers where they are
+        return "Invalid command"
+    if not SENSOR.with_obstacle(row, column):
+        return "Invalid initial position"
+    robot = Robot(robot_id, [row, column], battery)
+    return f"Ready {os.getpid()}"
+
+
+# Send a message the master did not ask for. Written at once unless a batch
+# of replies is being written, in which case it follows that batch.
+def send_notice(text):
+    if _writing:
+        _pending_notices.append(text)
+    else:
+        write_frames([encode(NOTICE_ID, text)])
+
+
+def write_frames(frames):
+    global _writing
+    _writing = True
+    try:
+        write_all(OUTPUT_FD, b"".join(frames))
+    finally:
+        _writing = False
+    if _pending_notices:
+        notices = [encode(NOTICE_ID, _pending_notices.popleft())
+                   for _ in range(len(_pending_notices))]
+        write_frames(notices)
+
+
+def command_loop():
+    if FRAMED:
+        framed_command_loop()
+        sys.exit(0)  # The master closed the pipe
+    # Begin CLI
+    '''
+    print("""\n\nWhat would you like to do next?
+                            mv <direction>: tries to move the robot one cell in the specified direction. (up, down, left, right). If it is possible, the robots changes its position and prints OK. If it is not possible to move in the specified direction, its position does not change and prints KO.
+                            bat: prints the current battery level.
+                            pos: prints the current position of the robot as a 2-dimension vector.
+                            tr: checks if there is a treasure in the current position. If there is a treasure, it prints Treasure. If not, prints Water.
+                            exit: the program prints the current position of the robot and its battery level and exits.\n""")
+    '''
+    while True:
+        action = input("")
+        print(execute(action))
+        if action.split(' ')[0] == 'exit':
+            sys.exit(0)
+
+
+# Framed mode: answer every request of a read with a single write. Returns
+# when the master closes its end.
+def framed_command_loop():
+    reader = FrameReader()
+    while True:
+        data = os.read(INPUT_FD, 65536)
+        if not data:
+            return
+        replies = []
+        exiting = False
+        for request_id, command in reader.feed(data):
+            replies.append(encode(request_id, execute(command)))
+            if command.split(' ')[0] == 'exit':
+                exiting = True
+                break
+        write_frames(replies)
+        if exiting:
+            sys.exit(0)
+
+
+# Entry point of a robot forked from an already initialized process.
+# stdin and stdout must already be connected to the master.
+# status is a StatusTable already mapped by the parent, written at slot.
+def run_forked(robot_id, position, battery, filename, framed=False, status=None, slot=None):
+    global robot, FRAMED, STATUS, STATUS_SLOT
+    FRAMED = framed
+    STATUS, STATUS_SLOT = status, slot
+    if SENSOR is None or FILENAME != filename:
+        preload(filename)
+    install_signal_handlers()
+    sys.stderr.write(f'PID: {os.getpid()}\n')
+    robot = Robot(str(robot_id), list(position), battery)
+    command_loop()
+
+
+# Serve the master's connections on address, one at a time, until exit.
+# A master that goes away without exit leaves the robot as it is for the
+# next one.
+def serve(address):
+    global FRAMED, INPUT_FD, OUTPUT_FD
+    FRAMED = True
+    server = listen(address)
+    while True:
+        connection, _ = server.accept()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        INPUT_FD = OUTPUT_FD = connection.fileno()
+        try:
+            framed_command_loop()
+        except ConnectionError:
+            pass
+        finally:
+            connection.close()
+
+
+def main():
+    global FILENAME, SENSOR, robot, FRAMED, STATUS, STATUS_SLOT
+    install_signal_handlers()
 
     sys.stderr.write(f'PID: {os.getpid()}\n')
 
@@ -118,46 +417,35 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     # Adding mandatory and optional arguments
-    parser.add_argument('robot_id')
+    parser.add_argument('robot_id', nargs='?', help='not needed with -listen')
     parser.add_argument('-f', '--filename')
     parser.add_argument('-pos', '--position', nargs=2,
                         type=int, default=[0, 0])
     parser.add_argument('-b', '--battery', type=int, default=100)
+    parser.add_argument('-framed', '--framed', action='store_true')
+    parser.add_argument('-status', '--status', help='status table to publish the robot state in')
+    parser.add_argument('-slot', '--slot', type=int, default=0)
+    parser.add_argument('-listen', '--listen', metavar='HOST:PORT',
+                        help='run as a server, the master sends the id, position and battery')
+    parser.add_argument('-profile', '--profile', metavar='DIR',
+                        help='write the profile of this robot in DIR when it exits, see profiling.py')
+    parser.add_argument('-profiler', '--profiler', choices=profiling.PROFILERS, default='cprofile')
 
     # Read arguments from command line
     args = parser.parse_args()
+    if args.profile:
+        profiling.start(args.profile, f"robot-{args.robot_id}", args.profiler)
     FILENAME = args.filename
+    FRAMED = args.framed
     SENSOR = Sensor(FILENAME)
+    if args.listen:
+        serve(parse_address(args.listen))
+    if args.status:
+        STATUS, STATUS_SLOT = StatusTable(args.status), args.slot
     robot = Robot(args.robot_id, args.position, args.battery)
 
-    # Begin CLI
-    '''
-    print("""\n\nWhat would you like to do next?
-                            mv <direction>: tries to move the robot one cell in the specified direction. (up, down, left, right). If it is possible, the robots changes its position and prints OK. If it is not possible to move in the specified direction, its position does not change and prints KO.
-                            bat: prints the current battery level.
-                            pos: prints the current position of the robot as a 2-dimension vector.
-                            tr: checks if there is a treasure in the current position. If there is a treasure, it prints Treasure. If not, prints Water.
-                            exit: the program prints the current position of the robot and its battery level and exits.\n""")
-    '''
-    while True:
-        action = input("")
-        action = action.split(' ')
-        # Analyze second argument in case command is mv
-        if len(action) > 1:
-            direction = action[1]
-        action = action[0]
-        # Call appropriate function based on case
-        match action:
-            case 'mv':
-                robot.move(direction)
-            case 'bat':
-                robot.print_battery()
-            case 'pos':
-                robot.print_position()
-            case 'tr':
-                robot.has_treasure()
-            case 'exit':
-                robot.shutdown()
-                break
-            case _:
-                print("Invalid command")
+    command_loop()
+
+
+if __name__ == "__main__":
+    main()
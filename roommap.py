@@ -0,0 +1,97 @@
+# The master's knowledge of the room, one byte per cell.
+#
+# A cell holds the character of what is known about it: '?' unknown, '-'
+# free, 'X' obstacle, 'T' treasure. The map is indexed like the grid of
+# lists it replaces, room_map[row, col] being the character of a cell and
+# room_map[row] a row as a string, and it counts the cells of every kind as
+# they are set, so the coverage of the room is known without scanning it.
+# Counting the unknown cells of a region scans that region only, a row at a
+# time.
+#
+# export_pgm writes the map as a binary PGM image, one byte per cell, with
+# the levels of PGM_LEVELS: unknown cells grey, free cells white, obstacles
+# black and treasures dark grey.
+
+UNKNOWN = '?'
+FREE = '-'
+OBSTACLE = 'X'
+TREASURE = 'T'
+PGM_LEVELS = {UNKNOWN: 128, FREE: 255, OBSTACLE: 0, TREASURE: 64}
+EXPORT_CHUNK = 1 << 20
+_TO_PGM = bytes.maketrans(''.join(PGM_LEVELS).encode('ascii'), bytes(PGM_LEVELS.values()))
+
+
+class RoomMap:
+    # cells is the content of the map, rows * columns characters row by row
+    # as tobytes returns them, all unknown when None
+    def __init__(self, rows, columns, cells=None):
+        self.rows = rows
+        self.columns = columns
+        if cells is None:
+            self._cells = bytearray(UNKNOWN.encode('ascii') * (rows * columns))
+        else:
+            self._cells = bytearray(cells)
+            if len(self._cells) != rows * columns:
+                raise ValueError(f"{len(self._cells)} cells for a map of {rows} x {columns}")
+        self._counts = [0] * 256  # K = character code, V = number of cells
+        for value in (UNKNOWN, FREE, OBSTACLE, TREASURE):
+            self._counts[ord(value)] = self._cells.count(value.encode('ascii'))
+
+    def __len__(self):
+        return self.rows
+
+    # room_map[row, col] is the cell, room_map[row] the row as a string
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return chr(self._cells[index[0] * self.columns + index[1]])
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        start = index * self.columns
+        return self._cells[start:start + self.columns].decode('ascii')
+
+    def __setitem__(self, position, value):
+        offset = position[0] * self.columns + position[1]
+        self._counts[self._cells[offset]] -= 1
+        self._cells[offset] = ord(value)
+        self._counts[ord(value)] += 1
+
+    def __iter__(self):
+        return (self[row] for row in range(self.rows))
+
+    # Number of cells holding value
+    def count(self, value):
+        return self._counts[ord(value)]
+
+    # Fraction of the cells that are no longer unknown
+    def coverage(self):
+        cells = self.rows * self.columns
+        return (cells - self.count(UNKNOWN)) / cells if cells else 1.0
+
+    # Number of unknown cells in rows [first_row, last_row) and columns
+    # [first_col, last_col), clipped to the map
+    def unknown_in(self, first_row, first_col, last_row, last_col):
+        first_col, last_col = max(0, first_col), min(self.columns, last_col)
+        if first_col >= last_col:
+            return 0
+        unknown = UNKNOWN.encode('ascii')
+        return sum(self._cells.count(unknown, row * self.columns + first_col, row * self.columns + last_col)
+                   for row in range(max(0, first_row), min(self.rows, last_row)))
+
+    # Positions of the cells holding value, row by row
+    def find(self, value):
+        code = value.encode('ascii')
+        offset = self._cells.find(code)
+        while offset != -1:
+            yield divmod(offset, self.columns)
+            offset = self._cells.find(code, offset + 1)
+
+    def tobytes(self):
+        return bytes(self._cells)
+
+    # Write the map as a PGM image, translating EXPORT_CHUNK cells at a time
+    def export_pgm(self, filename):
+        cells = memoryview(self._cells)
+        with open(filename, 'wb') as file:
+            file.write(f"P5\n{self.columns} {self.rows}\n255\n".encode('ascii'))
+            for start in range(0, len(cells), EXPORT_CHUNK):
+                file.write(bytes(cells[start:start + EXPORT_CHUNK]).translate(_TO_PGM))
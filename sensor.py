@@ -18,56 +18,130 @@
 # with_treasure(row, column) - returns True if the cell contains a treasure, False otherwise
 # n_treasures() - returns the number of treasures in the room
 # dimensions() - returns the dimensions of the room
+#
+# Many cells can be queried in one call, with the same answers as the
+# single-cell methods (out of the room is False):
+# with_obstacle_at(positions), with_treasure_at(positions) - one flag per
+#     (row, column) of positions
+# with_obstacle_window(top, left, height, width), with_treasure_window(...) -
+#     one flag per cell of a rectangle, row by row
+# with_obstacle_around(positions) - four flags per position, for the cells
+#     up, down, left and right of it, position after position
+# The flags come in one flat sequence in that order: a boolean NumPy array
+# with NumPy installed, a bytearray of 0 and 1 otherwise.
+#
+# A room file can be compiled into a binary file with compile_room() or
+# python sensor.py compile room.txt [-o room.bin]
+# The binary file holds a fixed header (magic, version, rows, columns,
+# number of obstacles, number of treasures, number of treasure entries),
+# the row-major cell array (one byte per cell) and the treasure positions.
+# Sensor accepts either format and maps binary files with mmap, so every
+# process opening the same compiled room shares one page-cache copy.
+
+import argparse
+import mmap
+import os
+import re
+import struct
+
+try:
+    import numpy
+except ImportError:  # The bulk queries answer with bytearrays instead
+    numpy = None
+
+# Cell states stored in the compact grid, one byte per cell.
+FREE = 0
+OBSTACLE = 1
+TREASURE = 2
+
+_SYMBOLS = ('-', 'X', 'T')
+
+# Answer of with_obstacle and with_treasure for each cell state, used as
+# bytes.translate tables by the bulk queries
+_WITH_OBSTACLE = bytes(int(state != OBSTACLE) for state in range(256))
+_WITH_TREASURE = bytes(int(state == TREASURE) for state in range(256))
+# Offsets of the cells up, down, left and right of a position
+_AROUND = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+# Header of a compiled room file
+_MAGIC = b'ROOM'
+_VERSION = 1
+_HEADER = struct.Struct('<4sI5Q')
+_TREASURE_ENTRY = struct.Struct('<QQ')
+
+# Matches one "(row,col)" entry, allowing blanks inside the parentheses
+_POSITION = re.compile(rb'\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)')
 
 
 class Sensor:
     def __init__(self, filename):
         self._filename = filename
-        self._room = []
+        self._cells = bytearray()  # Row-major grid of FREE/OBSTACLE/TREASURE
         self._rows = -1
         self._columns = -1
         self._num_obstacles = -1
-        self._obstacles = []
         self._num_treasures = -1
-        self._treasures = []
+        self._treasures = set()  # Index of (row, col) treasure positions
+        self._map = None  # Shared mapping of a compiled room file
+        self._grid = None  # NumPy view of the cells, made on first use
         self._read_room()
 
     # This method is internal of the class and called by the constructor
     # It should not be called within your code.
     def _read_room(self):
-        with open(self._filename, 'r') as file:
-            lines = file.readlines()
-            dimensions = lines[0].split()
+        with open(self._filename, 'rb') as file:
+            if file.read(len(_MAGIC)) == _MAGIC:
+                self._map_room(file)
+                return
+            file.seek(0)
+            dimensions = file.readline().split()
             self._rows = int(dimensions[0])
             self._columns = int(dimensions[1])
-            self._room = []
-            for i in range(self._rows):
-                self._room.append([])
-                for j in range(self._columns):
-                    self._room[i].append('-')
-                    obstacles = lines[1].split()
-                    self._num_obstacles = int(obstacles[0])
-            for i in range(1, len(obstacles)):
-                obstacle = obstacles[i].replace('(', '').replace(')', '').split(',')
-                row = int(obstacle[0])
-                column = int(obstacle[1])
-                self._room[row][column] = 'X'
-                self._obstacles.append((row, column))
-                treasures = lines[2].split()
-                self._num_treasures = int(treasures[0])
-            for i in range(1, len(treasures)):
-                treasure = treasures[i].replace('(', '').replace(')', '').split(',')
-                row = int(treasure[0])
-                column = int(treasure[1])
-                self._room[row][column] = 'T'
-                self._treasures.append((row, column))
+            self._cells = bytearray(self._rows * self._columns)
+            # Each line is scanned once, so loading is linear in file size
+            self._num_obstacles = self._read_positions(file.readline(), OBSTACLE)
+            self._num_treasures = self._read_positions(file.readline(), TREASURE)
+
+    # Mark every position of a line with the given state and return the
+    # count at the start of the line
+    def _read_positions(self, line, state):
+        count, _, positions = line.strip().partition(b' ')
+        if not count:
+            return 0
+        cells = self._cells
+        rows = self._rows
+        columns = self._columns
+        for match in _POSITION.finditer(positions):
+            row = int(match[1])
+            column = int(match[2])
+            if row < 0 or row >= rows or column < 0 or column >= columns:
+                raise ValueError(f"Position ({row},{column}) is outside the room")
+            cells[row * columns + column] = state
+            if state == TREASURE:
+                self._treasures.add((row, column))
+        return int(count)
+
+    # Map a compiled room file. No parsing happens here: the cell array is
+    # read straight from the shared mapping.
+    def _map_room(self, file):
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (_, version, self._rows, self._columns, self._num_obstacles,
+         self._num_treasures, num_entries) = _HEADER.unpack_from(self._map)
+        if version != _VERSION:
+            raise ValueError(f"Unsupported room file version {version}")
+        start = _HEADER.size
+        end = start + self._rows * self._columns
+        self._cells = memoryview(self._map)[start:end]
+        for i in range(num_entries):
+            self._treasures.add(
+                _TREASURE_ENTRY.unpack_from(self._map, end + i * _TREASURE_ENTRY.size))
 
     def print_room(self):
-        for row in self._room:
-            for cell in row:
-                print(cell, end=' ')
-            print()
-                
+        for i in range(self._rows):
+            start = i * self._columns
+            row = self._cells[start:start + self._columns]
+            print(' '.join(_SYMBOLS[cell] for cell in row), end=' \n')
+
     # Only to be used by the master
     def n_treasures(self):
         return self._num_treasures
@@ -85,7 +159,7 @@ class Sensor:
             return False
         if column < 0 or column >= self._columns:
             return False
-        if self._room[row][column] == 'X':
+        if self._cells[row * self._columns + column] == OBSTACLE:
             return False
         return True
 
@@ -99,7 +173,130 @@ class Sensor:
             return False
         if column < 0 or column >= self._columns:
             return False
-        if self._room[row][column] == 'T':
+        if (row, column) in self._treasures:
             return True
         return False
 
+    # Bulk versions of with_obstacle and with_treasure, see the top of the file
+    def with_obstacle_at(self, positions):
+        return self._cells_at(positions, _WITH_OBSTACLE)
+
+    def with_treasure_at(self, positions):
+        return self._cells_at(positions, _WITH_TREASURE)
+
+    def with_obstacle_window(self, top, left, height, width):
+        return self._window(top, left, height, width, _WITH_OBSTACLE)
+
+    def with_treasure_window(self, top, left, height, width):
+        return self._window(top, left, height, width, _WITH_TREASURE)
+
+    def with_obstacle_around(self, positions):
+        if numpy is not None:
+            positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, 1, 2)
+            around = (positions + numpy.array(_AROUND)).reshape(-1, 2)
+            return self._cells_at(around, _WITH_OBSTACLE)
+        return self._cells_at([(row + d_row, column + d_column) for row, column in positions
+                               for d_row, d_column in _AROUND], _WITH_OBSTACLE)
+
+    # The cells as a (rows, columns) NumPy array sharing their memory
+    def _array(self):
+        if self._grid is None:
+            cells = numpy.frombuffer(self._cells, dtype=numpy.uint8)
+            self._grid = cells.reshape(self._rows, self._columns)
+        return self._grid
+
+    # Look up the cells at positions in table, out of the room is 0
+    def _cells_at(self, positions, table):
+        rows = self._rows
+        columns = self._columns
+        if numpy is not None:
+            positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, 2)
+            row, column = positions[:, 0], positions[:, 1]
+            inside = (row >= 0) & (row < rows) & (column >= 0) & (column < columns)
+            flags = numpy.zeros(len(positions), dtype=bool)
+            cells = self._array()[row[inside], column[inside]]
+            flags[inside] = numpy.frombuffer(table, dtype=bool)[cells]
+            return flags
+        cells = self._cells
+        flags = bytearray(len(positions))
+        for i, (row, column) in enumerate(positions):
+            if 0 <= row < rows and 0 <= column < columns:
+                flags[i] = table[cells[row * columns + column]]
+        return flags
+
+    # Look up a rectangle of cells in table, one row at a time, the part out
+    # of the room is 0
+    def _window(self, top, left, height, width, table):
+        first_row, last_row = max(top, 0), min(top + height, self._rows)
+        first_column, last_column = max(left, 0), min(left + width, self._columns)
+        if numpy is not None:
+            flags = numpy.zeros((max(height, 0), max(width, 0)), dtype=bool)
+            if first_row < last_row and first_column < last_column:
+                cells = self._array()[first_row:last_row, first_column:last_column]
+                inside = (slice(first_row - top, last_row - top),
+                          slice(first_column - left, last_column - left))
+                flags[inside] = numpy.frombuffer(table, dtype=bool)[cells]
+            return flags.reshape(-1)
+        flags = bytearray(max(height, 0) * max(width, 0))
+        if first_row < last_row and first_column < last_column:
+            for row in range(first_row, last_row):
+                start = row * self._columns
+                offset = (row - top) * width + first_column - left
+                cells = bytes(self._cells[start + first_column:start + last_column])
+                flags[offset:offset + last_column - first_column] = cells.translate(table)
+        return flags
+
+
+
+# Compile a text room file into the binary format and return its path.
+# The file is written next to its final name and renamed, so processes
+# that already mapped an older version are not affected.
+def compile_room(filename, compiled_filename=None):
+    if compiled_filename is None:
+        compiled_filename = os.path.splitext(filename)[0] + '.bin'
+    sensor = Sensor(filename)
+    tmp_filename = f'{compiled_filename}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_filename, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, sensor._rows, sensor._columns,
+                                    sensor._num_obstacles, sensor._num_treasures,
+                                    len(sensor._treasures)))
+            file.write(sensor._cells)
+            for treasure in sorted(sensor._treasures):
+                file.write(_TREASURE_ENTRY.pack(*treasure))
+        os.replace(tmp_filename, compiled_filename)
+    except OSError:
+        # A full disk leaves a partial file behind
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return compiled_filename
+
+
+# Return the path of a compiled version of a room file, compiling it only
+# when there is no compiled file or it is older than the text file. When
+# the compiled file cannot be written, in a read-only directory for one,
+# the text file is returned: it answers the same, parsed by every process.
+def ensure_compiled(filename):
+    with open(filename, 'rb') as file:
+        if file.read(len(_MAGIC)) == _MAGIC:
+            return filename
+    compiled_filename = os.path.splitext(filename)[0] + '.bin'
+    if (not os.path.exists(compiled_filename)
+            or os.path.getmtime(compiled_filename) < os.path.getmtime(filename)):
+        try:
+            compile_room(filename, compiled_filename)
+        except OSError:
+            return filename
+    return compiled_filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compile_parser = subparsers.add_parser('compile')
+    compile_parser.add_argument('filename')
+    compile_parser.add_argument('-o', '--output')
+    args = parser.parse_args()
+
+    print(compile_room(args.filename, args.output))
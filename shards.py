@@ -0,0 +1,401 @@
+# Spatially sharded robots for the master's -shards mode.
+#
+# The room is split into bands of rows, each owned by a worker process.
+# A worker holds the robots standing in its band as robot.Robot objects
+# sharing its Sensor, like the master's -inproc mode, and what the master
+# knows of the band's cells. It runs the moves of its robots: collision
+# checks, the moves themselves, the treasure checks and the map updates.
+# The master process keeps the command line, the positions and the
+# treasures found, and prints the results in id order. It reaches the
+# workers through a ShardedFleet, which runs them all at once and keeps a
+# copy of the map, updated with the cells the workers changed since it was
+# last fetched.
+#
+# A move gives the same results as moving the robots one after the other in
+# id order: a robot collides with the one standing on its target unless
+# that one moved away before it. A worker resolves its robots in id order.
+# A robot whose target lies in the next band depends on the robot standing
+# there, which the fleet keeps track of with the robots on the first and
+# last row of every band. When that robot has a lower id, its move is
+# resolved by the other worker first. The workers then go round again with
+# the outcomes of the robots on their edges until every robot is resolved,
+# which takes one round unless a chain of robots crosses a border. A robot
+# that moves into another band is handed over to that band's worker, with
+# its battery and suspended state. The master's move_all moves the robots
+# in batches ending with the robot that may find the last treasure, so no
+# robot moves once the hunt is over, as without shards.
+#
+# Batteries drain on a virtual clock in every worker, moved together by the
+# tick command.
+
+import bisect
+import multiprocessing
+import signal
+import threading
+
+import profiling
+from inproc import VirtualClock
+from roommap import RoomMap
+from sensor import Sensor
+
+DIRECTIONS = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+# Signals the master handles by talking to the workers
+MASTER_SIGNALS = {signal.SIGINT, signal.SIGQUIT, signal.SIGTSTP}
+
+
+# Lock of a conversation with the workers. The master's signal handlers
+# talk to the workers too, and with -loop blocking they run on the thread
+# that may be in a conversation already, which would wait for itself. The
+# signals are blocked on that thread while it holds the lock, so their
+# handlers run once it is released. Handlers of signals that came before
+# run in pthread_sigmask, before the lock is taken.
+class ConversationLock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mask = None  # Signal mask of the holder before it took the lock
+
+    def __enter__(self):
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+        self._lock.acquire()
+        self._mask = mask
+
+    def __exit__(self, *exc_info):
+        mask = self._mask
+        self._lock.release()
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+
+
+class ShardedFleet:
+    # profile is the directory and profiler of master.py -profile, or None
+    def __init__(self, room_filename, count, profile=None):
+        rows, self.columns = Sensor(room_filename).dimensions()
+        count = max(1, min(count, rows))
+        self.bounds = [rows * i // count for i in range(count + 1)]  # First row of each band
+        self._owners = {}  # K = robot_id, V = band
+        self._edges = [{} for _ in range(count)]  # Robots on the first and last row of each band
+        # What each worker gets with its next request: new robots, robots
+        # handed over and cells learnt by the robots of other bands
+        self._inboxes = [([], [], []) for _ in range(count)]
+        self._lock = ConversationLock()  # One conversation with the workers at a time
+        self._connections = []
+        self._processes = []
+        for band in range(count):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, daemon=True,
+                                              args=(worker_connection, room_filename,
+                                                    self.bounds[band], self.bounds[band + 1],
+                                                    profile and (profile[0], f"shard-{band}", profile[1])))
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self.pids = [process.pid for process in self._processes]
+        self._room = RoomMap(rows, self.columns)  # The cells of the bands as last fetched
+        self._ended = False  # Whether the workers have ended
+
+    def band_of(self, row):
+        return min(max(bisect.bisect_right(self.bounds, row) - 1, 0), len(self._processes) - 1)
+
+    def _on_edge(self, band, row):
+        return row == self.bounds[band] or row == self.bounds[band + 1] - 1
+
+    # Add a robot, started by its worker with the next request. Returns the
+    # pid of the worker.
+    def add_robot(self, robot_id, position, battery):
+        band = self.band_of(position[0])
+        self._owners[robot_id] = band
+        self._inboxes[band][0].append((robot_id, tuple(position), battery))
+        if self._on_edge(band, position[0]):
+            self._edges[band][tuple(position)] = robot_id
+        return self.pids[band]
+
+    # Send a request (method name, arguments) to each band of requests at
+    # once, then return the replies, K = band
+    def _request(self, requests):
+        for band, (method, *args) in requests.items():
+            new, arrivals, cells = self._inboxes[band]
+            self._connections[band].send((new, arrivals, cells, method, args))
+            self._inboxes[band] = ([], [], [])
+        return {band: self._connections[band].recv() for band in requests}
+
+    def _request_all(self, method, *args):
+        return self._request({band: (method, *args) for band in range(len(self._processes))})
+
+    # Bands of robot_ids, K = band, V = ids
+    def _by_band(self, robot_ids):
+        bands = {}
+        for robot_id in robot_ids:
+            bands.setdefault(self._owners[robot_id], []).append(robot_id)
+        return bands
+
+    # Move robot_ids one cell in direction, or every robot when robot_ids is
+    # None. Returns (robot_id, outcome, detail) in id order, the outcome
+    # being 'ok' (detail: a treasure was found), 'ko', 'stopped' or
+    # 'collision' (detail: id of the robot in the way).
+    def move(self, robot_ids, direction):
+        d_row, _ = DIRECTIONS[direction]
+        moving = None if robot_ids is None else set(robot_ids)
+        with self._lock:
+            requests = {}
+            for band in range(len(self._processes)):
+                # The robots of the next band a robot may run into
+                neighbour = band + d_row
+                foreign = self._edges[neighbour] if d_row and 0 <= neighbour < len(self._processes) else {}
+                requests[band] = ('move', direction, moving, foreign)
+            results = []
+            known = {}  # K = robot_id on the edge of a band, V = whether it moved
+            done = {}  # K = band, V = what the band's last reply ended the move with
+            while requests:
+                replies = self._request(requests)
+                requests = {}
+                for band, (band_results, outcomes, band_done) in replies.items():
+                    results.extend(band_results)
+                    known.update(outcomes)
+                    if band_done is None:
+                        requests[band] = ('move_more', known)
+                    else:
+                        done[band] = band_done
+            # The edges of every band first, the robots handed over are added
+            for band, (edges, _, _) in done.items():
+                self._edges[band] = edges
+            for edges, leaving, cells in done.values():
+                self._hand_over(leaving, cells)
+        results.sort()
+        return results
+
+    # Give the robots that left a band, and the cells they learnt outside
+    # of it, to the bands they are in now
+    def _hand_over(self, leaving, cells):
+        for robot in leaving:
+            robot_id = int(robot.id)
+            row = robot.position[0]
+            to_band = self.band_of(row)
+            self._owners[robot_id] = to_band
+            self._inboxes[to_band][1].append(robot)
+            if self._on_edge(to_band, row):
+                self._edges[to_band][tuple(robot.position)] = robot_id
+        for row, col, value in cells:
+            self._inboxes[self.band_of(row)][2].append((row, col, value))
+
+    # Whether each robot starts on a treasure, K = robot_id
+    def check_start(self):
+        with self._lock:
+            treasures = {}
+            for reply in self._request_all('check_start').values():
+                treasures.update(reply)
+            return treasures
+
+    # (id, position, battery, suspended) of each robot, K = robot_id, in the
+    # order of robot_ids
+    def states(self, robot_ids):
+        with self._lock:
+            states = {}
+            replies = self._request({band: ('states', ids) for band, ids in self._by_band(robot_ids).items()})
+            for reply in replies.values():
+                states.update(reply)
+            return {robot_id: states[robot_id] for robot_id in robot_ids}
+
+    # What the robots' signal handlers do on sig, for robot_ids
+    def control(self, robot_ids, sig):
+        with self._lock:
+            self._request({band: ('control', ids, sig) for band, ids in self._by_band(robot_ids).items()})
+
+    def tick(self, seconds):
+        with self._lock:
+            self._request_all('tick', seconds)
+
+    # The cells of every band put together in a RoomMap, as the master's
+    # room_grid. Only the cells changed since the last call are fetched.
+    # Once the workers have ended, the room as they left it.
+    def room(self):
+        with self._lock:
+            if not self._ended:
+                for changes in self._request_all('changes').values():
+                    for position, value in changes.items():
+                        self._room[position] = value
+            return self._room
+
+    # Run exit on every robot and end the workers. Returns the replies,
+    # K = robot_id
+    def shutdown(self):
+        self.room()
+        with self._lock:
+            self._ended = True
+            replies = {}
+            for reply in self._request_all('shutdown').values():
+                replies.update(reply)
+            for process in self._processes:
+                process.join()
+            return dict(sorted(replies.items()))
+
+
+# A worker's band of the room, rows first_row to last_row - 1
+class Band:
+    def __init__(self, sensor, first_row, last_row):
+        self.sensor = sensor
+        self.first_row = first_row
+        self.last_row = last_row
+        self.rows, self.columns = sensor.dimensions()
+        self.cells = RoomMap(last_row - first_row, self.columns)
+        self.changed = {}  # K = (row, col), V = value set since the last changes
+        self.robots = {}  # K = robot_id, V = robot.Robot
+        self.occupants = {}  # K = (row, col), V = robot_id
+        self._move = None  # State of the move in progress
+
+    def inside(self, position):
+        return self.first_row <= position[0] < self.last_row
+
+    def add(self, robot_id, robot):
+        self.robots[robot_id] = robot
+        self.occupants[tuple(robot.position)] = robot_id
+
+    def set_cell(self, row, col, value, foreign_cells):
+        if self.first_row <= row < self.last_row:
+            self.cells[row - self.first_row, col] = value
+            self.changed[row, col] = value
+        else:
+            foreign_cells.append((row, col, value))
+
+    def check_start(self):
+        treasures = {}
+        for robot_id, robot in self.robots.items():
+            treasures[robot_id] = "Treasure" in robot.has_treasure()
+            self.set_cell(robot.position[0], robot.position[1], 'T' if treasures[robot_id] else '-', [])
+        return treasures
+
+    def move(self, direction, moving, foreign):
+        d_row, d_col = DIRECTIONS[direction]
+        robot_ids = sorted(self.robots if moving is None else moving & self.robots.keys())
+        origins = {robot_id: tuple(self.robots[robot_id].position) for robot_id in robot_ids}
+        self._move = {'direction': direction, 'moving': moving, 'foreign': foreign, 'origins': origins,
+                      'targets': {robot_id: (row + d_row, col + d_col) for robot_id, (row, col) in origins.items()},
+                      'pending': robot_ids, 'moved': {}, 'known': {}, 'cells': []}
+        return self._resolve()
+
+    def move_more(self, known):
+        self._move['known'] = known
+        return self._resolve()
+
+    # One pass over the robots still waiting, in id order. Returns the
+    # results of the robots resolved, the outcomes of those on the edges
+    # and, once no robot is left waiting, what move_done returns.
+    def _resolve(self):
+        move = self._move
+        moved = move['moved']
+        results = []
+        waiting = []
+        for robot_id in move['pending']:
+            target = move['targets'][robot_id]
+            if self.inside(target):
+                other = self.occupants.get(target)
+                other_moved = moved.get(other)
+            else:
+                other = move['foreign'].get(target)
+                other_moved = move['known'].get(other)
+            if other is not None and (move['moving'] is not None and other not in move['moving'] or other > robot_id):
+                # The other robot is still there, it moves later or not at all
+                results.append((robot_id, 'collision', other))
+                moved[robot_id] = False
+            elif other is not None and other_moved is None:
+                waiting.append(robot_id)  # Its move is not known yet
+            elif other is not None and not other_moved:
+                results.append((robot_id, 'collision', other))
+                moved[robot_id] = False
+            else:
+                results.append(self._step(robot_id, move['direction'], target))
+                moved[robot_id] = results[-1][1] == 'ok'
+        move['pending'] = waiting
+        outcomes = {robot_id: has_moved for robot_id, has_moved in moved.items()
+                    if move['origins'][robot_id][0] in (self.first_row, self.last_row - 1)}
+        return results, outcomes, None if waiting else self._move_done()
+
+    # Run a move on a robot, as the master's apply_move does with the replies
+    def _step(self, robot_id, direction, target):
+        robot = self.robots[robot_id]
+        response = robot.move(direction)
+        if "OK" in response:
+            treasure = "Treasure" in robot.has_treasure()
+            self.set_cell(target[0], target[1], 'T' if treasure else '-', self._move['cells'])
+            return robot_id, 'ok', treasure
+        if "KO" in response:
+            if 0 <= target[0] < self.rows and 0 <= target[1] < self.columns:
+                self.set_cell(target[0], target[1], 'X', self._move['cells'])
+            return robot_id, 'ko', None
+        return robot_id, 'stopped', None
+
+    # Move the robots that moved to their new cells. Returns the robots on
+    # the edges of the band, the robots that left it and the cells they
+    # learnt outside of it.
+    def _move_done(self):
+        move = self._move
+        self._move = None
+        moved = [robot_id for robot_id, has_moved in move['moved'].items() if has_moved]
+        for robot_id in moved:
+            del self.occupants[move['origins'][robot_id]]
+        leaving = []
+        for robot_id in moved:
+            target = move['targets'][robot_id]
+            if self.inside(target):
+                self.occupants[target] = robot_id
+            else:
+                leaving.append(self.robots.pop(robot_id))
+        edges = {position: robot_id for position, robot_id in self.occupants.items()
+                 if position[0] in (self.first_row, self.last_row - 1)}
+        return edges, leaving, move['cells']
+
+    def states(self, robot_ids):
+        states = {}
+        for robot_id in robot_ids:
+            robot = self.robots[robot_id]
+            states[robot_id] = (robot_id, tuple(robot.position), robot.battery, robot.is_suspended)
+        return states
+
+    def control(self, robot_ids, sig):
+        for robot_id in robot_ids:
+            robot = self.robots[robot_id]
+            if sig == signal.SIGINT:
+                robot.suspend()
+            elif sig == signal.SIGQUIT:
+                robot.resume()
+            elif sig == signal.SIGUSR1:
+                robot.battery = 100
+
+    def changes(self):
+        changed, self.changed = self.changed, {}
+        return changed
+
+    def shutdown(self):
+        return {robot_id: robot.shutdown() for robot_id, robot in self.robots.items()}
+
+
+# Main loop of a worker: apply what the fleet sent along with a request,
+# run the request on the band and send back the reply. profile is the
+# directory, tag and profiler to profile the worker with, or None.
+def run_worker(connection, room_filename, first_row, last_row, profile=None):
+    # The terminal's signals are for the master
+    for sig in (signal.SIGINT, signal.SIGQUIT, signal.SIGTSTP):
+        signal.signal(sig, signal.SIG_IGN)
+    if profile is not None:
+        profiling.start(*profile)
+    import robot
+    clock = VirtualClock()
+    robot.CLOCK = clock
+    robot.SENSOR = Sensor(room_filename)
+    band = Band(robot.SENSOR, first_row, last_row)
+    while True:
+        new, arrivals, cells, method, args = connection.recv()
+        for robot_id, position, battery in new:
+            band.add(robot_id, robot.Robot(str(robot_id), list(position), battery))
+        for arrival in arrivals:
+            band.add(int(arrival.id), arrival)
+        for row, col, value in cells:
+            band.set_cell(row, col, value, None)
+        if method == 'tick':
+            clock.advance(*args)
+            reply = None
+        else:
+            reply = getattr(band, method)(*args)
+        connection.send(reply)
+        if method == 'shutdown':
+            break
+    # Worker processes end without running atexit
+    profiling.stop()
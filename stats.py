@@ -0,0 +1,101 @@
+# Instrumentation of the master's conversations with the robots.
+#
+# For every robot the master keeps a RobotStats with one Histogram of reply
+# latencies per kind of command (the first word of the command: mv, tr, bat,
+# pos, path, exit), the number of replies that took longer than the timeout
+# of an exchange and the number of collisions. The bytes written and read
+# are counted by the robot's Channel.
+#
+# A Histogram has a fixed number of buckets whatever the number of samples:
+# bucket i holds the latencies in [2^(i-1), 2^i) microseconds, the last one
+# everything above. Percentiles are given as the upper bound of the bucket
+# they fall in, capped at the largest latency seen.
+
+BUCKETS = 28  # Up to 2^26 us, about a minute
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0  # Seconds
+
+    def record(self, seconds):
+        microseconds = int(seconds * 1e6)
+        self.counts[min(microseconds.bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Latency in seconds below which a fraction p of the samples fall
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts[:-1]):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max  # In the last bucket, which has no upper bound
+
+
+class RobotStats:
+    def __init__(self):
+        self.latencies = {}  # K = command name, V = Histogram
+        self.timeouts = 0
+        self.collisions = 0
+
+    def record(self, command, seconds):
+        name = command.split(maxsplit=1)[0] if command else ""
+        if name not in self.latencies:
+            self.latencies[name] = Histogram()
+        self.latencies[name].record(seconds)
+
+    # All the commands in one Histogram
+    def total(self):
+        histogram = Histogram()
+        for command_histogram in self.latencies.values():
+            histogram.merge(command_histogram)
+        return histogram
+
+
+def format_latency(histogram):
+    return (f"{histogram.count:>7} {histogram.mean() * 1000:>9.3f} "
+            f"{histogram.percentile(0.5) * 1000:>9.3f} {histogram.percentile(0.99) * 1000:>9.3f} "
+            f"{histogram.max * 1000:>9.3f}")
+
+
+# Lines describing one robot, one per kind of command
+def robot_report(robot_id, robot_stats, channel):
+    lines = [f"Robot {robot_id}: {channel.bytes_sent} bytes sent, {channel.bytes_received} bytes received, "
+             f"{robot_stats.timeouts} timeouts, {robot_stats.collisions} collisions",
+             f"{'command':<8} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for command, histogram in sorted(robot_stats.latencies.items()):
+        lines.append(f"{command:<8} {format_latency(histogram)}")
+    return lines
+
+
+# Lines describing the whole fleet, one per robot, so the slow one stands out
+def fleet_report(all_stats, channels):
+    lines = [f"{'robot':<8} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+             f"{'sent':>9} {'received':>9} {'timeouts':>8} {'collisions':>10}"]
+    fleet = Histogram()
+    for robot_id in sorted(all_stats):
+        robot_stats, channel = all_stats[robot_id], channels[robot_id]
+        histogram = robot_stats.total()
+        fleet.merge(histogram)
+        lines.append(f"{robot_id:<8} {format_latency(histogram)} {channel.bytes_sent:>9} "
+                     f"{channel.bytes_received:>9} {robot_stats.timeouts:>8} {robot_stats.collisions:>10}")
+    lines.append(f"{'all':<8} {format_latency(fleet)}")
+    return lines
@@ -0,0 +1,142 @@
+# Shared status table of the robots.
+#
+# The master creates a file with one fixed-size slot per robot and every
+# robot maps it with mmap, like the compiled room of sensor.py. A robot
+# writes its id, position, battery and suspended flag into its slot whenever
+# they change, and the master reads any slot at any time without talking to
+# the robot.
+#
+# The battery is not rewritten as it drains: a slot holds the battery level
+# at drained_at (a time.monotonic() value, the same clock in every process)
+# and the drain interval, and the reader works out the level at the time it
+# reads, with the robot's own rule.
+#
+# Every slot starts with a sequence number that is odd while the robot is
+# writing it. A reader retries until it sees the same even number before
+# and after reading the rest, so it never returns half a write. A slot that
+# was never written has sequence number 0, and a reader gives up on a slot
+# left odd for READ_TIMEOUT, as by a robot killed in the middle of a write.
+# A write made by a signal handler while another write of the slot is under
+# way does not touch the slot: the interrupted write makes it once done
+# with its own, under a new sequence number, so the number stays odd while
+# any of the rest changes. The master waits for the sequence number of a
+# slot to move on after signalling its robot, whose handler writes the
+# slot, so that it reads the state the signal made.
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+_MAGIC = b'STAT'
+_HEADER = struct.Struct('<4sI56x')  # magic, number of slots
+# sequence, id, row, col, battery, drained_at, drain interval, suspended
+_SLOT = struct.Struct('<QqqqqddB7x')
+_SEQUENCE = struct.Struct('<Q')
+# The slot after its sequence number. pack_into clears the bytes of a struct
+# before packing it, so the sequence number is never packed in place: for
+# a moment it would be 0, which a reader takes for a slot never written.
+_FIELDS = struct.Struct('<qqqqddB7x')
+WAIT_INTERVAL = 0.001  # Seconds between two looks at a slot in wait_write
+READ_TIMEOUT = 0.05  # Seconds read waits for a write to end
+
+
+class StatusTable:
+    # Open the table in filename, or create it with the given number of
+    # slots. Without a filename a new file is made in shared memory.
+    def __init__(self, filename=None, slots=None):
+        if slots is not None:
+            if filename is None:
+                directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+                fd, filename = tempfile.mkstemp(prefix='robots-', suffix='.status', dir=directory)
+                os.close(fd)
+            with open(filename, 'wb') as file:
+                file.write(_HEADER.pack(_MAGIC, slots))
+                file.truncate(_HEADER.size + slots * _SLOT.size)
+        self.filename = filename
+        with open(filename, 'r+b') as file:
+            self._map = mmap.mmap(file.fileno(), 0)
+        # K = slot being written, V = values of the last write that
+        # interrupted it, None when none did
+        self._interrupted = {}
+        magic, self.slots = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            raise ValueError(f"{filename} is not a status table")
+
+    def _offset(self, slot):
+        if slot < 0 or slot >= self.slots:
+            raise IndexError(f"No slot {slot} in the status table")
+        return _HEADER.size + slot * _SLOT.size
+
+    # Only to be used by the robot that owns the slot
+    def write(self, slot, robot_id, position, battery, drained_at, interval, suspended):
+        offset = self._offset(slot)
+        values = (robot_id, position[0], position[1], battery, drained_at, interval, suspended)
+        if slot in self._interrupted:  # Made by a signal handler, see above
+            self._interrupted[slot] = values
+            return
+        self._interrupted[slot] = None
+        try:
+            while True:
+                # One past the last number, odd, whoever wrote it
+                sequence = _SEQUENCE.unpack_from(self._map, offset)[0] + 1 | 1
+                self._map[offset:offset + _SEQUENCE.size] = _SEQUENCE.pack(sequence)
+                _FIELDS.pack_into(self._map, offset + _SEQUENCE.size, *values)
+                self._map[offset:offset + _SEQUENCE.size] = _SEQUENCE.pack(sequence + 1)
+                # Nothing is called between reading the values of an
+                # interrupting write and dropping the guard, so no handler
+                # runs in between
+                values = self._interrupted[slot]
+                if values is None:
+                    del self._interrupted[slot]
+                    return
+                self._interrupted[slot] = None
+        except BaseException:
+            self._interrupted.pop(slot, None)
+            raise
+
+    # Return (robot_id, (row, col), battery, suspended) with the battery as
+    # it is now, or None if the robot has not written its slot yet or a write
+    # has not ended in READ_TIMEOUT
+    def read(self, slot, now=None):
+        offset = self._offset(slot)
+        deadline = None
+        while True:
+            values = _SLOT.unpack_from(self._map, offset)
+            sequence = values[0]
+            if sequence % 2 == 0 and _SEQUENCE.unpack_from(self._map, offset)[0] == sequence:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() >= deadline:
+                return None
+            time.sleep(0)  # Let the writer go on
+        if sequence == 0:
+            return None
+        _, robot_id, row, col, battery, drained_at, interval, suspended = values
+        if not suspended:
+            if now is None:
+                now = time.monotonic()
+            battery = max(0, battery - int((now - drained_at) / interval))
+        return robot_id, (row, col), battery, bool(suspended)
+
+    # Sequence number of a slot, to wait for its next write with wait_write
+    def sequence(self, slot):
+        return _SEQUENCE.unpack_from(self._map, self._offset(slot))[0]
+
+    # Wait until a write of slot started after its sequence number was
+    # sequence has ended, or until the time.monotonic() deadline. Returns
+    # whether it has.
+    def wait_write(self, slot, sequence, deadline):
+        offset = self._offset(slot)
+        while True:
+            current = _SEQUENCE.unpack_from(self._map, offset)[0]
+            if current % 2 == 0 and current > sequence + 1:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(WAIT_INTERVAL)
+
+    def close(self):
+        self._map.close()
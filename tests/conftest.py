@@ -0,0 +1,47 @@
+# Helpers shared by the tests. The tests run from the repository root, like
+# the programs they run.
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Copy room and robots files of the repository to directory, so the
+# compiled room is written there
+def copy_files(directory, *filenames):
+    copies = []
+    for filename in filenames:
+        copy = os.path.join(directory, os.path.basename(filename))
+        shutil.copy(os.path.join(ROOT, filename), copy)
+        copies.append(copy)
+    return copies
+
+
+# Run master.py on the commands, one per line, and return its exit status
+# and its output with the PIDs replaced by N
+def run_master(room_filename, robots_filename, commands, *args, timeout=60):
+    process = subprocess.run([sys.executable, 'master.py', '-room', room_filename,
+                              '-robots', robots_filename, *args],
+                             input=''.join(command + '\n' for command in commands),
+                             capture_output=True, text=True, cwd=ROOT, timeout=timeout)
+    output = re.sub(r'(PID|pid):? \d+', r'\1 N', process.stdout)
+    output = re.sub(r'Robot \d+ finished', 'Robot N finished', output)
+    return process.returncode, output
+
+
+# The output without the latency table, which differs between runs
+def without_stats(output):
+    return '\n'.join(line for line in output.splitlines()
+                     if not line.startswith(('robot ', 'all ')) and not line[:1].isdigit())
+
+
+@pytest.fixture
+def room_files(tmp_path):
+    return copy_files(tmp_path, 'room.txt', 'robots.txt')
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from control import CommandQueue, serve_control
+
+
+# A queue whose commands log when they start and end, and answer with
+# their words. Commands starting with 'pos' or 'bat' are read-only, and
+# 'fail' raises.
+def make_queue(log, window=0.005):
+    async def run(action, capture):
+        log.append(('start', ' '.join(action)))
+        await asyncio.sleep(0.01)
+        if action[0] == 'fail':
+            raise ValueError(action)
+        log.append(('end', ' '.join(action)))
+        return f"{' '.join(action)}\n" if capture else None
+
+    return CommandQueue(run, lambda action: action[0] in ('pos', 'bat', 'fail'), window)
+
+
+def test_identical_read_only_commands_run_once():
+    log = []
+
+    async def clients():
+        queue = make_queue(log)
+        return await asyncio.gather(*(queue.submit(command.split())
+                                      for command in ['bat all', 'pos 1', 'bat all', 'bat all', 'pos 1']))
+
+    assert asyncio.run(clients()) == ["bat all\n", "pos 1\n", "bat all\n", "bat all\n", "pos 1\n"]
+    assert sorted(log) == [('end', 'bat all'), ('end', 'pos 1'), ('start', 'bat all'), ('start', 'pos 1')]
+    # Both ran at the same time
+    assert [event for event, _ in log] == ['start', 'start', 'end', 'end']
+
+
+def test_commands_that_change_something_run_alone_in_order():
+    log = []
+
+    async def clients():
+        queue = make_queue(log)
+        return await asyncio.gather(*(queue.submit(command.split(), capture=False)
+                                      for command in ['pos 1', 'mv 1 up', 'pos 1', 'bat 1', 'mv all left',
+                                                      'mv 2 down', 'pos 1']))
+
+    assert asyncio.run(clients()) == ["pos 1\n", None, "pos 1\n", "bat 1\n", None, None, "pos 1\n"]
+    # The reads on either side of a move are not coalesced across it
+    assert log[:4] == [('start', 'pos 1'), ('end', 'pos 1'), ('start', 'mv 1 up'), ('end', 'mv 1 up')]
+    assert sorted(log[4:8]) == [('end', 'bat 1'), ('end', 'pos 1'), ('start', 'bat 1'), ('start', 'pos 1')]
+    assert log[8:] == [('start', 'mv all left'), ('end', 'mv all left'), ('start', 'mv 2 down'),
+                       ('end', 'mv 2 down'), ('start', 'pos 1'), ('end', 'pos 1')]
+
+
+def test_an_error_reaches_every_client_of_the_command():
+    log = []
+
+    async def clients():
+        queue = make_queue(log, window=0)
+        return await asyncio.gather(queue.submit(['fail']), queue.submit(['fail']), queue.submit(['pos', '1']),
+                                    return_exceptions=True)
+
+    first, second, other = asyncio.run(clients())
+    assert isinstance(first, ValueError) and isinstance(second, ValueError)
+    assert other == "pos 1\n"
+    assert log.count(('start', 'fail')) == 1
+
+
+def test_clients_get_their_answers_by_id(tmp_path):
+    path = str(tmp_path / 'control')
+    (tmp_path / 'control').write_text('')  # Left by an earlier master
+
+    async def session():
+        server = await serve_control(path, make_queue([]))
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b"a bat all\nb fail\n\nc mv 1 up\n")
+        writer.write_eof()
+        answers = {}
+        while header := await reader.readline():
+            request_id, length = header.decode().split()
+            answers[request_id] = (await reader.readexactly(int(length))).decode()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    assert asyncio.run(session()) == {'a': "bat all\n", 'b': "Invalid command\n", 'c': "mv 1 up\n"}
+
+
+@pytest.mark.parametrize('window', [0, 0.005])
+def test_batch_gathered_while_the_previous_one_runs(window):
+    log = []
+
+    async def clients():
+        queue = make_queue(log, window)
+        first = asyncio.ensure_future(queue.submit(['bat', 'all']))
+        await asyncio.sleep(window + 0.002)  # The first batch is running
+        later = [asyncio.ensure_future(queue.submit(['bat', 'all'])) for _ in range(3)]
+        return await asyncio.gather(first, *later)
+
+    assert asyncio.run(clients()) == ["bat all\n"] * 4
+    assert log.count(('start', 'bat all')) == 2
@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+
+import episodes
+from conftest import ROOT
+
+
+def generated_episode(seed):
+    return {'name': f'seed-{seed}', 'seed': seed, 'size': 20, 'obstacles': 0.1, 'treasures': 5,
+            'num_robots': 5, 'commands': ['explore']}
+
+
+# The report without the times, which differ between runs
+def without_times(results):
+    return [{field: value for field, value in result.items() if field != 'elapsed_s'} for result in results]
+
+
+def test_generated_episodes_need_moves():
+    results = [episodes.run_episode(generated_episode(seed)) for seed in range(4)]
+    assert [tuple(result) for result in results] == [episodes.FIELDS] * 4
+    assert not any(result['error'] for result in results)
+    # Robots starting on the treasures would end every hunt before a move
+    assert all(result['moves'] > 0 for result in results)
+    for result in results:
+        assert result['robots'] == 5 and result['treasures'] == 5
+        assert 0 <= result['found'] <= result['treasures']
+        assert result['complete'] == (result['found'] == result['treasures'])
+        assert result['round_trips'] > 0 and result['elapsed_s'] > 0
+
+
+def test_parallel_report_matches_serial_runs(tmp_path):
+    report = tmp_path / 'report.json'
+    process = subprocess.run([sys.executable, 'episodes.py', '-seeds', '4', '-size', '20', '-robots', '5',
+                              '-jobs', '2', '-o', str(report)],
+                             capture_output=True, text=True, cwd=ROOT, timeout=120)
+    assert process.returncode == 0
+    assert process.stderr.startswith("4 episodes, ")
+    parallel = json.loads(report.read_text())
+    serial = [episodes.run_episode(generated_episode(seed)) for seed in range(4)]
+    assert without_times(parallel) == without_times(serial)
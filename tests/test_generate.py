@@ -0,0 +1,15 @@
+from benchmarks.generate import generate_robots, generate_room
+from sensor import Sensor
+
+
+def test_robots_start_on_free_cells(tmp_path):
+    room, robots = str(tmp_path / 'room.txt'), str(tmp_path / 'robots.txt')
+    for seed in range(5):
+        generate_room(room, 20, 20, 0.1, 10, seed=seed)
+        positions = generate_robots(robots, room, 10, seed=seed)
+        sensor = Sensor(room)
+        assert len(set(positions)) == 10
+        # with_obstacle is True on the cells free of obstacles
+        assert all(sensor.with_obstacle(row, column) for row, column in positions)
+        # The room's stream would put every robot on a treasure
+        assert not all(sensor.with_treasure(row, column) for row, column in positions)
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from conftest import copy_files, run_master
+from explore import MOVE_COST
+from journal import REFILL, RESUME, SUSPEND, Journal, load
+from roommap import RoomMap
+
+
+def saved_journal(filename):
+    journal = Journal(filename, truncate=True)
+    room = RoomMap(3, 4)
+    room[0, 0] = '-'
+    room[1, 2] = 'X'
+    journal.snapshot(room, {1: ((0, 0), 90, False), 2: ((2, 3), 50, True)})
+    journal.cell((0, 1), 'T')
+    journal.move(1, (0, 1))
+    journal.control(2, RESUME)
+    journal.control(1, SUSPEND)
+    journal.control(2, REFILL)
+    journal.flush()
+    return journal
+
+
+def test_load_replays_the_records_after_the_snapshot(tmp_path):
+    filename = str(tmp_path / 'journal.bin')
+    saved_journal(filename)
+    state = load(filename)
+    assert list(state['room']) == ['-T??', '??X?', '????']
+    assert state['positions'] == {1: (0, 1), 2: (2, 3)}
+    assert state['batteries'] == {1: 90 - MOVE_COST, 2: 100}
+    assert state['suspended'] == {1}
+
+
+def test_later_snapshot_wins(tmp_path):
+    filename = str(tmp_path / 'journal.bin')
+    journal = saved_journal(filename)
+    journal.snapshot(RoomMap(3, 4, b'-' * 12), {1: ((1, 1), 70, False)})
+    journal.move(1, (1, 0))
+    journal.flush()
+    state = load(filename)
+    assert list(state['room']) == ['----'] * 3
+    assert state['positions'] == {1: (1, 0)}
+    assert state['batteries'] == {1: 70 - MOVE_COST}
+
+
+def test_record_cut_short_ends_the_replay(tmp_path):
+    filename = str(tmp_path / 'journal.bin')
+    saved_journal(filename)
+    os.truncate(filename, os.path.getsize(filename) - 3)  # Into the refill record
+    state = load(filename)
+    assert state['batteries'][2] == 50
+    assert state['suspended'] == {1}
+
+
+def test_journal_without_snapshot_is_refused(tmp_path):
+    filename = str(tmp_path / 'journal.bin')
+    Journal(filename, truncate=True).flush()
+    with pytest.raises(ValueError):
+        load(filename)
+
+
+def test_resume_restarts_where_the_master_stopped(tmp_path):
+    room, robots = copy_files(tmp_path, 'room_2.txt', 'robots_2.txt')
+    journal = str(tmp_path / 'journal.bin')
+    status, first = run_master(room, robots, ['mv all left', 'mv 1 down 3', 'suspend 2', 'mv all up',
+                                              'pos all', 'exit'], '-render', 'off', '-journal', journal)
+    assert status == 0
+    status, resumed = run_master(room, robots, ['pos all', 'exit'], '-render', 'off', '-resume', journal)
+    assert status == 0
+    positions = [line for line in first.splitlines() if 'position: Position' in line]
+    assert len(positions) == 2
+    assert positions == [line for line in resumed.splitlines() if 'position: Position' in line]
+    assert first.split("Our information about the room so far:")[-1] \
+        == resumed.split("Our information about the room so far:")[-1]
+
+
+def test_append_drops_a_record_cut_short(tmp_path):
+    filename = str(tmp_path / 'journal.bin')
+    saved_journal(filename)
+    os.truncate(filename, os.path.getsize(filename) - 3)  # Into the refill record
+    journal = Journal(filename)
+    journal.control(2, REFILL)
+    journal.move(2, (2, 2))
+    journal.flush()
+    state = load(filename)
+    assert state['positions'] == {1: (0, 1), 2: (2, 2)}
+    assert state['batteries'][2] == 100 - MOVE_COST
+
+
+def test_resume_from_a_journal_cut_short(tmp_path):
+    room, robots = copy_files(tmp_path, 'room_2.txt', 'robots_2.txt')
+    journal = str(tmp_path / 'journal.bin')
+    status, _ = run_master(room, robots, ['mv all left', 'mv 1 down 3', 'exit'], '-render', 'off',
+                           '-journal', journal)
+    assert status == 0
+    os.truncate(journal, os.path.getsize(journal) - 5)
+    status, resumed = run_master(room, robots, ['mv all up', 'mv 2 right', 'pos all', 'exit'], '-render', 'off',
+                                 '-resume', journal)
+    assert status == 0
+    status, again = run_master(room, robots, ['pos all', 'exit'], '-render', 'off', '-resume', journal)
+    assert status == 0
+    positions = [line for line in resumed.splitlines() if 'position: Position' in line]
+    assert len(positions) == 2
+    assert positions == [line for line in again.splitlines() if 'position: Position' in line]
@@ -0,0 +1,281 @@
+import os
+import signal
+import sys
+
+import pytest
+
+import master
+from benchmarks.generate import generate_robots, generate_room
+from conftest import copy_files, run_master, without_stats
+from sensor import Sensor
+
+
+@pytest.mark.parametrize('args', [(), ('-inproc',)])
+def test_exit_draws_the_final_map_without_rendering(room_files, args):
+    status, output = run_master(*room_files, ['mv all up', 'exit'], '-render', 'off', *args)
+    assert status == 0
+    assert output.count("Our information about the room so far:") == 1
+    assert output.rstrip().endswith('? ? ? ? ? ? ? ? ? ?')
+
+
+def test_mv_rejects_counts_below_one(room_files):
+    status, output = run_master(*room_files, ['mv 1 up 0', 'mv all down -2', 'pos 1', 'exit'], '-render', 'off')
+    assert status == 0
+    assert output.count("Invalid command") == 2
+    assert "Robot 1 position: Position: 2 3" in output
+
+
+def test_mv_rejects_bad_counts_and_directions(room_files):
+    status, output = run_master(*room_files, ['mv 1 R x', 'mv 1 R', 'mv all sideways', 'mv 1 up 1.5', 'pos 1',
+                                              'exit'], '-render', 'off')
+    assert status == 0
+    assert 'Traceback' not in output
+    assert output.count("Invalid command") == 4
+    assert "Robot 1 position: Position: 2 3" in output
+
+
+def test_explore_rejects_bad_wave_counts(room_files):
+    status, output = run_master(*room_files, ['explore x', 'explore 0', 'explore 1', 'exit'], '-render', 'off')
+    assert status == 0
+    assert 'Traceback' not in output
+    assert output.count("Invalid command") == 2
+    assert "Exploration: 1 waves" in output
+
+
+def test_coverage_counts_the_known_cells(room_files):
+    status, output = run_master(*room_files, ['coverage', 'mv 1 left', 'coverage', 'coverage 0 0 5 9',
+                                              'coverage 1 2 2 3', 'coverage 1 2', 'exit'], '-render', 'off')
+    assert status == 0
+    lines = [line.removeprefix("Command: ") for line in output.splitlines() if "cells" in line or "Invalid" in line]
+    assert lines == ["Explored 3 of 60 cells (5.0%): 2 free, 0 obstacles, 1 treasures, 57 unknown",
+                     "Explored 4 of 60 cells (6.7%): 3 free, 0 obstacles, 1 treasures, 56 unknown",
+                     "Unknown cells in rows 0-5, columns 0-9: 56",
+                     "Unknown cells in rows 1-2, columns 2-3: 2",
+                     "Invalid command"]
+
+
+def test_export(room_files, tmp_path):
+    image = tmp_path / 'room.pgm'
+    missing = tmp_path / 'missing' / 'room.pgm'
+    status, output = run_master(*room_files, ['mv all up', f'export {image}', f'export {missing}', 'exit'],
+                                '-render', 'off')
+    assert status == 0
+    assert f"Map written to {image}" in output
+    assert f"Cannot write {missing}: No such file or directory" in output
+    data = image.read_bytes()
+    header = b"P5\n10 6\n255\n"
+    assert data.startswith(header) and len(data) == len(header) + 60
+    assert set(data[len(header):]) <= {0, 64, 128, 255}
+
+
+def test_sigtstp_during_an_exchange_waits_for_its_replies(monkeypatch, capsys):
+    sent = []
+
+    # A remote robot that is sent SIGTSTP while it is asked for its position
+    def exchange_blocking(commands, timeout=None):
+        sent.append(commands)
+        if len(sent) == 1:
+            master.sigtstp_handler(signal.SIGTSTP, None)
+        return {robot_id: [f"{command} of {robot_id}" for command in robot_commands]
+                for robot_id, robot_commands in commands.items()}
+
+    monkeypatch.setattr(master, 'exchange_blocking', exchange_blocking)
+    for name in ('status_table', 'fleet', 'event_loop'):
+        monkeypatch.setattr(master, name, None)
+    monkeypatch.setattr(master, 'inproc', False)
+    monkeypatch.setattr(master, 'robots', {1: None})
+    monkeypatch.setattr(master, 'remote', {1: ('127.0.0.1', 7300)})
+    assert master.exchange({1: ['pos']}) == {1: ['pos of 1']}
+    assert sent == [{1: ['pos']}, {1: ['status']}]
+    assert capsys.readouterr().out == "status of 1\n"
+    assert not master.status_requested
+
+
+# The output without the latency table and the batteries, which drain as
+# time goes by
+def without_batteries(output):
+    return [line for line in without_stats(output).splitlines() if not line.startswith('Battery: ')]
+
+
+@pytest.mark.parametrize('protocol', ['framed', 'text'])
+def test_zygote_robots_answer_as_executed_ones(room_files, protocol):
+    commands = ['mv all left', 'mv 1 down 2', 'suspend 2', 'mv all up', 'resume 2', 'mv 2 right', 'pos all',
+                'exit']
+    executed = run_master(*room_files, commands, '-render', 'off', '-protocol', protocol)
+    forked = run_master(*room_files, commands, '-render', 'off', '-protocol', protocol, '-launcher', 'zygote')
+    assert executed[0] == forked[0] == 0
+    assert "Robot 2 is stopped" in forked[1]
+    assert without_batteries(forked[1]) == without_batteries(executed[1])
+
+
+@pytest.mark.parametrize('protocol', ['framed', 'text'])
+def test_asyncio_loop_answers_as_the_blocking_one(tmp_path, protocol):
+    room, robots = copy_files(tmp_path, 'room_2.txt', 'robots_2.txt')
+    commands = ['mv all left', 'suspend 2', 'mv all up', 'bogus', 'resume 2', 'mv 2 right 3', 'pos all', 'explore']
+    outputs = [run_master(room, robots, commands, '-render', 'off', '-protocol', protocol, '-loop', loop)
+               for loop in ('blocking', 'asyncio')]
+    assert outputs[0][0] == outputs[1][0] == 0
+    assert "All treasures found!" in outputs[1][1]
+    # The time the exploration took differs between runs
+    lines = [[line.rpartition(', ')[0] if line.startswith("Exploration: ") else line
+              for line in without_batteries(output)] for _, output in outputs]
+    assert lines[1] == lines[0]
+
+
+def test_console_blocks_unless_asked_for_the_event_loop(room_files, tmp_path):
+    control = str(tmp_path / 'control')
+    status, _ = run_master(*room_files, ['exit'], '-control', control)
+    assert status == 2  # -control is refused without -loop asyncio
+    status, output = run_master(*room_files, ['pos 1', 'exit'], '-render', 'off', '-control', control,
+                                '-loop', 'asyncio')
+    assert status == 0
+    assert "Robot 1 position: Position: 2 3" in output
+
+
+# mv all reports what moving the robots one after the other in id order
+# does, in id order, however their replies arrive
+@pytest.mark.parametrize('args', [('-launcher', 'zygote'), ('-launcher', 'zygote', '-loop', 'asyncio'),
+                                  ('-inproc',)])
+def test_mv_all_is_the_same_as_moving_each_robot_in_turn(tmp_path, args):
+    room, robots = str(tmp_path / 'room.txt'), str(tmp_path / 'robots.txt')
+    generate_room(room, 6, 6, 0.15, 0, seed=5)
+    generate_robots(robots, room, 12, seed=5)
+    directions = ['up', 'left', 'down', 'down', 'right', 'up', 'right', 'left']
+    together = [f'mv all {direction}' for direction in directions] + ['pos all', 'exit']
+    in_turn = [f'mv {robot_id} {direction}' for direction in directions for robot_id in range(1, 13)]
+    in_turn += ['pos all', 'exit']
+    results = [run_master(room, robots, commands, '-render', 'off', *args) for commands in (together, in_turn)]
+    assert results[0][0] == results[1][0] == 0
+    outputs = [[line.replace("Command: ", "") for line in without_batteries(output)] for _, output in results]
+    assert any(line.startswith("Collision between") for line in outputs[0])
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize('position', ['(0,2)', '(1,7)', '(-1,0)'])
+def test_start_on_an_obstacle_or_outside_the_room_is_refused(tmp_path, position):
+    room, robots = tmp_path / 'room.txt', tmp_path / 'robots.txt'
+    room.write_text("3 5\n3 (0,2) (1,2) (2,2)\n1 (1,4)\n")
+    robots.write_text(f"(1,0)\n{position}\n")
+    status, output = run_master(str(room), str(robots), ['exit'], '-render', 'off')
+    assert status == 1
+    assert output == f"Invalid initial position for robot at {tuple(map(int, position[1:-1].split(',')))}\n"
+
+
+# The cells of the last map drawn, K = (row, col), those of which only the
+# robot standing there is drawn left out
+def last_map(output):
+    rows = output.split("Our information about the room so far:")[-1].strip().splitlines()
+    return {(row, col): cell.lstrip('R') for row, line in enumerate(rows) for col, cell in enumerate(line.split())
+            if cell != 'R'}
+
+
+def test_explore_finds_every_treasure(tmp_path):
+    room, robots = copy_files(tmp_path, 'room_2.txt', 'robots_2.txt')
+    status, output = run_master(room, robots, ['explore'], '-render', 'off')
+    assert status == 0
+    assert "All treasures found!" in output
+    assert output.count("Exploration: ") == 1
+    sensor = Sensor(room)
+    for (row, col), cell in last_map(output).items():
+        assert (cell == 'T') == sensor.with_treasure(row, col)
+        if cell != '?':
+            assert (cell == 'X') == (not sensor.with_obstacle(row, col))
+
+
+def test_explore_stops_when_the_treasures_cannot_be_reached(tmp_path):
+    room, robots = tmp_path / 'room.txt', tmp_path / 'robots.txt'
+    room.write_text("3 5\n3 (0,2) (1,2) (2,2)\n1 (1,4)\n")
+    robots.write_text("(1,0)\n")
+    status, output = run_master(str(room), str(robots), ['explore', 'exit'], '-render', 'off')
+    assert status == 0
+    assert "Nothing left to explore" in output
+    assert "Exploration: " in output
+    assert "All treasures found!" not in output
+    assert set(last_map(output).values()) == {'-', 'X', '?'}
+
+
+def test_script_logs_the_output_and_reports_the_commands(room_files, tmp_path):
+    script, log = tmp_path / 'script.txt', tmp_path / 'output.txt'
+    script.write_text("# Moves\nmv all left\n\nmv 1 down\npos all\nbat 1\n")
+    status, output = run_master(*room_files, [], '-script', str(script), '-log', str(log))
+    assert status == 0
+    lines = output.splitlines()
+    assert lines[0].startswith("4 commands in ")
+    assert [line.split()[:2] for line in lines[2:]] == [['bat', '1'], ['mv', '2'], ['pos', '1']]
+    logged = log.read_text()
+    assert "Robot 1 position: Position: 3 2" in logged
+    assert "Battery: " in logged
+    assert "Our information about the room so far:" in logged
+
+
+def test_script_from_stdin_prints_only_the_report(room_files):
+    status, output = run_master(*room_files, ['mv all up', 'pos 1', 'exit'], '-script', '-')
+    assert status == 0
+    assert output.startswith("3 commands in ")
+    assert "position" not in output
+
+
+def test_stats_count_the_commands_and_collisions(room_files):
+    status, output = run_master(*room_files, ['mv 1 left', 'mv 1 right', 'mv 3 left', 'stats 3', 'stats 1',
+                                              'stats all', 'exit'], '-render', 'off')
+    assert status == 0
+    assert "Collision between robot 3 and 2" in output
+    assert output.split("Robot 3: ")[1].splitlines()[0].endswith("0 timeouts, 1 collisions")
+    report = output.split("Robot 1: ")[1].splitlines()
+    assert report[0].endswith("0 timeouts, 0 collisions")
+    assert [line.split()[:2] for line in report[2:4]] == [['mv', '2'], ['tr', '3']]
+    fleet = output.split("collisions\n")[-1].splitlines()
+    assert [line.split()[0] for line in fleet[:4]] == ['1', '2', '3', 'all']
+    assert fleet[2].split()[-1] == '1'
+
+
+# Start a child process that sets its SIGTERM handler, prints ready and
+# waits to be ended, or exits at once. Returns its pid once it is ready.
+def start_child(sigterm='signal.SIG_DFL', wait=60):
+    code = (f'import signal, time; signal.signal(signal.SIGTERM, {sigterm}); '
+            f'print("ready", flush=True); time.sleep({wait})')
+    read_fd, write_fd = os.pipe()
+    pid = os.posix_spawn(sys.executable, [sys.executable, '-c', code], os.environ,
+                         file_actions=[(os.POSIX_SPAWN_DUP2, write_fd, 1)])
+    os.close(write_fd)
+    with open(read_fd) as out:
+        assert out.readline() == "ready\n"
+    return pid
+
+
+@pytest.mark.parametrize('pidfd', [True, False])
+def test_shutdown_terminates_then_kills_the_robots_that_stay(monkeypatch, capsys, pidfd):
+    if not pidfd:
+        monkeypatch.delattr(os, 'pidfd_open', raising=False)
+    robots = {1: start_child(wait=0), 2: start_child(), 3: start_child('signal.SIG_IGN')}
+    monkeypatch.setattr(master, 'robots', robots)
+    monkeypatch.setattr(master, 'remote', {})
+    monkeypatch.setattr(master, 'inproc', False)
+    monkeypatch.setattr(master, 'KILL_GRACE', 0.2)
+    exit_statuses = master.reap_robots(0.5)
+    assert exit_statuses[1] == 0
+    assert os.WIFSIGNALED(exit_statuses[2]) and os.WTERMSIG(exit_statuses[2]) == signal.SIGTERM
+    assert os.WIFSIGNALED(exit_statuses[3]) and os.WTERMSIG(exit_statuses[3]) == signal.SIGKILL
+    assert capsys.readouterr().err.splitlines() == ["Robot 2 did not exit, sending SIGTERM",
+                                                    "Robot 3 did not exit, sending SIGTERM",
+                                                    "Robot 3 did not exit, sending SIGKILL"]
+
+
+@pytest.mark.parametrize('threads', ['0', '4'])
+def test_inproc_robots_answer_as_processes(room_files, threads):
+    commands = ['mv all left', 'mv 1 down 2', 'suspend 2', 'mv all up', 'mv 3 left', 'resume 2', 'mv all right',
+                'pos all', 'coverage', 'exit']
+    processes = run_master(*room_files, commands, '-render', 'off')
+    inproc = run_master(*room_files, commands, '-render', 'off', '-inproc', '-threads', threads)
+    assert processes[0] == inproc[0] == 0
+    assert without_batteries(inproc[1]) == without_batteries(processes[1])
+
+
+def test_inproc_batteries_drain_on_the_virtual_clock(room_files):
+    status, output = run_master(*room_files, ['bat 1', 'tick 10', 'bat 1', 'suspend 1', 'tick 5', 'bat 1',
+                                              'resume 1', 'tick 2.5', 'bat 1', 'mv 1 left', 'bat 1', 'exit'],
+                                '-render', 'off', '-inproc')
+    assert status == 0
+    assert "Virtual time: 17.5 s" in output
+    batteries = [line.split("Battery: ")[1] for line in output.splitlines() if "battery: Battery" in line]
+    assert batteries == ['100', '90', '90 (stopped)', '88', '83']
@@ -0,0 +1,54 @@
+import json
+import os
+
+import pytest
+
+import profiling
+from conftest import run_master
+
+
+@pytest.mark.parametrize('profiler', profiling.PROFILERS)
+def test_master_and_robots_write_their_profiles(room_files, tmp_path, profiler):
+    directory = tmp_path / 'profile'
+    directory.mkdir()
+    (directory / ('robot-9' + profiling.SUFFIX)).write_text('{}')  # Left by an earlier run
+    status, output = run_master(*room_files, ['mv all up', 'explore 2', 'exit'], '-render', 'off',
+                                '-profile', str(directory), '-profiler', profiler)
+    assert status == 0
+    report = directory / 'report.txt'
+    assert f"Profile report: {report}" in output
+    tags = ['master', 'robot-1', 'robot-2', 'robot-3']
+    assert sorted(os.listdir(directory)) == sorted([tag + profiling.SUFFIX for tag in tags]
+                                                   + ['report.txt', 'stacks.collapsed'])
+    for tag in tags:
+        profile = json.loads((directory / (tag + profiling.SUFFIX)).read_text())
+        assert profile['tag'] == tag and profile['profiler'] == profiler
+        assert profile['cpu'] >= profile['startup_cpu'] > 0
+    processes = [line.split()[0] for line in report.read_text().split("\n\n")[0].splitlines()[1:]]
+    assert processes == tags + ['all']
+    for line in (directory / 'stacks.collapsed').read_text().splitlines():
+        stack, microseconds = line.rsplit(' ', 1)
+        assert stack.split(';')[0] in tags and int(microseconds) > 0
+
+
+def write_profile(directory, tag, functions, stacks):
+    profile = {'tag': tag, 'profiler': 'cprofile', 'pid': 1, 'startup_cpu': 0.1, 'cpu': 0.5, 'wall': 1.0,
+               'functions': functions, 'stacks': stacks}
+    (directory / (tag + profiling.SUFFIX)).write_text(json.dumps(profile))
+
+
+def test_merge_adds_up_the_processes(tmp_path):
+    write_profile(tmp_path, 'robot-10', {'a.py:1(f)': [3, 0.25, 0.5]}, {'a.py:1(f)': 250000})
+    write_profile(tmp_path, 'robot-2', {'a.py:1(f)': [1, 0.5, 0.5], 'select': [2, 1.0, 1.0]},
+                  {'a.py:1(f);select': 1000000})
+    write_profile(tmp_path, 'master', {'b.py:7(g)': [5, 0.125, 0.125]}, {})
+    report = profiling.merge(str(tmp_path))
+    assert report == str(tmp_path / 'report.txt')
+    text = (tmp_path / 'report.txt').read_text()
+    assert [line.split()[0] for line in text.splitlines()[1:5]] == ['master', 'robot-2', 'robot-10', 'all']
+    everything = text.split("All processes\n")[1].split("\n\n")[0].splitlines()
+    assert everything[1:] == ["    1.0000    1.0000         2          1  select",
+                              "    0.7500    1.0000         4          2  a.py:1(f)",
+                              "    0.1250    0.1250         5          1  b.py:7(g)"]
+    assert (tmp_path / 'stacks.collapsed').read_text().splitlines() \
+        == ["robot-2;a.py:1(f);select 1000000", "robot-10;a.py:1(f) 250000"]
@@ -0,0 +1,43 @@
+import os
+
+from protocol import HEADER, NOTICE_ID, Channel, FrameReader, encode
+
+MESSAGES = [(1, 'mv up'), (2, ''), (NOTICE_ID, 'id: 1 P: (2, 3) Bat: 99'), (70000, 'Position: 2 3\nBattery: 100'),
+            (3, 'café ' * 1000)]
+
+
+def test_frames_round_trip_in_one_read():
+    data = b''.join(encode(request_id, text) for request_id, text in MESSAGES)
+    assert FrameReader().feed(data) == MESSAGES
+
+
+def test_frames_round_trip_a_byte_at_a_time():
+    data = b''.join(encode(request_id, text) for request_id, text in MESSAGES)
+    reader = FrameReader()
+    frames = []
+    for i in range(len(data)):
+        frames += reader.feed(data[i:i + 1])
+    assert frames == MESSAGES
+
+
+def test_partial_frame_waits_for_the_rest():
+    data = encode(5, 'Battery: 100')
+    reader = FrameReader()
+    assert reader.feed(data[:HEADER.size + 3]) == []
+    assert reader.feed(data[HEADER.size + 3:]) == [(5, 'Battery: 100')]
+
+
+def test_channel_matches_replies_and_notices():
+    to_robot, from_master = os.pipe()
+    from_robot, to_master = os.pipe()
+    channel = Channel(from_master, from_robot)
+    request_ids = channel.send(['pos', 'bat'])
+    assert FrameReader().feed(os.read(to_robot, 65536)) == [(request_ids[0], 'pos'), (request_ids[1], 'bat')]
+    os.write(to_master, encode(request_ids[1], 'Battery: 100') + encode(NOTICE_ID, 'id: 1')
+             + encode(request_ids[0], 'Position: 2 3'))
+    channel.receive()
+    assert channel.has_replies(request_ids)
+    assert channel.replies == {request_ids[0]: 'Position: 2 3', request_ids[1]: 'Battery: 100'}
+    assert list(channel.notices) == ['id: 1']
+    for fd in (to_robot, from_master, from_robot, to_master):
+        os.close(fd)
@@ -0,0 +1,44 @@
+import pytest
+
+import robot
+from conftest import copy_files
+
+
+@pytest.fixture
+def hunter(tmp_path):
+    room, = copy_files(tmp_path, 'room.txt')
+    robot.preload(room)
+    return robot.Robot('1', [2, 3], 100)
+
+
+@pytest.mark.parametrize('line', ['path R foo', 'path R until=x', 'path R fence=1', 'path R known=a,b',
+                                  'path X', 'path'])
+def test_malformed_path_is_invalid(hunter, line):
+    assert hunter.execute(line) == "Invalid command"
+    assert hunter.position == [2, 3]
+
+
+def test_path(hunter):
+    assert hunter.execute('path R,R until=1').startswith("Path done")
+    assert hunter.position == [2, 5]
+
+
+def test_resume_restarts_the_drain(hunter, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(robot, 'CLOCK', lambda: now[0])
+    running = robot.Robot('2', [2, 3], 100)
+    now[0] = 2.5
+    running.resume()  # Not suspended: the half interval run is lost
+    now[0] = 3.4
+    assert running.battery == 98
+    now[0] = 3.5
+    assert running.battery == 97
+
+
+@pytest.mark.parametrize('line', ['init', 'init 1 2', 'init 1 2 3 100 7', 'init 1 a 3 100', 'init 1 2 3 full'])
+def test_malformed_init_is_invalid(hunter, monkeypatch, line):
+    monkeypatch.setattr(robot, 'robot', None)
+    assert robot.execute(line) == "Invalid command"
+    assert robot.execute('pos') == "Not initialized"
+    assert robot.execute('init 1 2 3 100').startswith("Ready ")
+    assert robot.robot.position == [2, 3]
@@ -0,0 +1,44 @@
+import pytest
+
+from roommap import FREE, OBSTACLE, TREASURE, UNKNOWN, RoomMap
+
+
+def test_counts_follow_the_cells_set():
+    room = RoomMap(3, 4)
+    assert (room.count(UNKNOWN), room.coverage()) == (12, 0.0)
+    room[0, 1] = FREE
+    room[2, 3] = OBSTACLE
+    room[1, 1] = TREASURE
+    room[0, 1] = OBSTACLE  # Set again
+    assert [room.count(value) for value in (UNKNOWN, FREE, OBSTACLE, TREASURE)] == [9, 0, 2, 1]
+    assert room.coverage() == 0.25
+    assert list(room) == ['?X??', '?T??', '???X']
+    assert (room[1, 1], room[2]) == ('T', '???X')
+    assert list(room.find(OBSTACLE)) == [(0, 1), (2, 3)]
+
+
+def test_unknown_cells_of_a_region_are_clipped_to_the_map():
+    room = RoomMap(4, 5)
+    for col in range(5):
+        room[1, col] = FREE
+    assert room.unknown_in(0, 0, 4, 5) == 15
+    assert room.unknown_in(1, 1, 3, 4) == 3
+    assert room.unknown_in(-2, -2, 9, 2) == 6
+    assert room.unknown_in(0, 4, 4, 4) == 0
+
+
+def test_bytes_round_trip():
+    room = RoomMap(2, 3)
+    room[1, 2] = TREASURE
+    copy = RoomMap(2, 3, room.tobytes())
+    assert list(copy) == list(room) and copy.count(TREASURE) == 1
+    with pytest.raises(ValueError):
+        RoomMap(2, 2, room.tobytes())
+
+
+def test_export_translates_cells_to_grey_levels(tmp_path, monkeypatch):
+    monkeypatch.setattr('roommap.EXPORT_CHUNK', 4)
+    room = RoomMap(2, 3)
+    room[0, 0], room[0, 1], room[1, 2] = FREE, OBSTACLE, TREASURE
+    room.export_pgm(tmp_path / 'room.pgm')
+    assert (tmp_path / 'room.pgm').read_bytes() == b"P5\n3 2\n255\n" + bytes([255, 0, 128, 128, 128, 64])
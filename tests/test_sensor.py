@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import sensor
+from conftest import copy_files
+from sensor import Sensor, compile_room, ensure_compiled
+
+ROWS, COLUMNS = 3, 4
+
+
+# A room with NumPy answering the bulk queries, or without it
+@pytest.fixture(params=['numpy', 'bytearray'])
+def room(request, tmp_path, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(sensor, 'numpy', None)
+    filename = tmp_path / 'room.txt'
+    filename.write_text(f"{ROWS} {COLUMNS}\n2 (1,1) (2,2)\n2 (0,1) (2,3)\n")
+    return Sensor(str(filename))
+
+
+# Every cell of the room and the cells around it
+CELLS = [(row, column) for row in range(-1, ROWS + 1) for column in range(-1, COLUMNS + 1)]
+
+
+def test_at_matches_single_cells(room):
+    for flags, single in ((room.with_obstacle_at(CELLS), room.with_obstacle),
+                          (room.with_treasure_at(CELLS), room.with_treasure)):
+        assert len(flags) == len(CELLS)
+        assert [bool(flag) for flag in flags] == [single(*cell) for cell in CELLS]
+
+
+@pytest.mark.parametrize('top, left, height, width', [(0, 0, ROWS, COLUMNS), (-1, -2, 3, 4), (1, 2, 4, 5),
+                                                      (5, 0, 2, 2), (0, 0, 0, 3)])
+def test_window_is_flat_row_by_row(room, top, left, height, width):
+    cells = [(row, column) for row in range(top, top + height) for column in range(left, left + width)]
+    for flags, single in ((room.with_obstacle_window(top, left, height, width), room.with_obstacle),
+                          (room.with_treasure_window(top, left, height, width), room.with_treasure)):
+        assert len(flags) == len(cells)
+        assert [bool(flag) for flag in flags] == [single(*cell) for cell in cells]
+
+
+def test_around_is_flat_position_by_position(room):
+    positions = [(0, 0), (1, 2), (2, 3), (-1, 5)]
+    flags = room.with_obstacle_around(positions)
+    assert len(flags) == 4 * len(positions)
+    assert [bool(flag) for flag in flags] == [room.with_obstacle(row + d_row, column + d_column)
+                                              for row, column in positions
+                                              for d_row, d_column in ((-1, 0), (1, 0), (0, -1), (0, 1))]
+
+
+def test_text_room_is_read_cell_by_cell(tmp_path, capsys):
+    filename = tmp_path / 'room.txt'
+    filename.write_text("2 3\n2 (0,2) ( 1 , 0 )\n1 (1,1)\n")
+    room = Sensor(str(filename))
+    assert room.dimensions() == (2, 3)
+    assert room.n_treasures() == 1
+    assert [[room.with_obstacle(row, column) for column in range(3)] for row in range(2)] \
+        == [[True, True, False], [False, True, True]]
+    assert [(row, column) for row in range(2) for column in range(3) if room.with_treasure(row, column)] \
+        == [(1, 1)]
+    room.print_room()
+    assert capsys.readouterr().out == "- - X \nX T - \n"
+
+
+def test_position_outside_the_room_is_refused(tmp_path):
+    filename = tmp_path / 'room.txt'
+    filename.write_text("2 3\n1 (2,0)\n0\n")
+    with pytest.raises(ValueError):
+        Sensor(str(filename))
+
+
+def test_compiled_room_answers_as_the_text_one(tmp_path):
+    room, = copy_files(tmp_path, 'room_2.txt')
+    compiled = compile_room(room)
+    assert compiled == str(tmp_path / 'room_2.bin')
+    text, binary = Sensor(room), Sensor(compiled)
+    assert binary.dimensions() == text.dimensions()
+    assert binary.n_treasures() == text.n_treasures()
+    rows, columns = text.dimensions()
+    cells = [(row, column) for row in range(-1, rows + 1) for column in range(-1, columns + 1)]
+    for cell in cells:
+        assert binary.with_obstacle(*cell) == text.with_obstacle(*cell)
+        assert binary.with_treasure(*cell) == text.with_treasure(*cell)
+    assert list(binary.with_obstacle_at(cells)) == list(text.with_obstacle_at(cells))
+
+
+def test_ensure_compiled_compiles_only_when_needed(tmp_path):
+    room, = copy_files(tmp_path, 'room.txt')
+    compiled = ensure_compiled(room)
+    assert compiled == str(tmp_path / 'room.bin')
+    assert ensure_compiled(compiled) == compiled
+    os.utime(compiled, (0, 0))  # Older than the text file
+    assert ensure_compiled(room) == compiled
+    assert os.path.getmtime(compiled) >= os.path.getmtime(room)
+    mtime = os.path.getmtime(compiled)
+    assert ensure_compiled(room) == compiled
+    assert os.path.getmtime(compiled) == mtime
+
+
+def test_room_that_cannot_be_compiled_is_read_as_text(tmp_path, monkeypatch):
+    room, = copy_files(tmp_path, 'room.txt')
+
+    def replace(source, destination):
+        raise PermissionError(13, 'Permission denied', destination)
+
+    monkeypatch.setattr(sensor.os, 'replace', replace)
+    with pytest.raises(PermissionError):
+        compile_room(room)
+    assert os.listdir(tmp_path) == ['room.txt']  # The partial file is removed
+    assert ensure_compiled(room) == room
+    assert Sensor(room).dimensions() == (6, 10)
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason='root writes to read-only directories')
+def test_room_in_a_read_only_directory_is_read_as_text(tmp_path):
+    room, = copy_files(tmp_path, 'room.txt')
+    os.chmod(tmp_path, 0o555)
+    try:
+        assert ensure_compiled(room) == room
+        assert os.listdir(tmp_path) == ['room.txt']
+    finally:
+        os.chmod(tmp_path, 0o755)
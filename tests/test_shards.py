@@ -0,0 +1,51 @@
+import pytest
+
+from benchmarks.generate import generate_robots, generate_room
+from conftest import run_master, without_stats
+
+
+def test_exit_draws_the_final_map(room_files):
+    status, output = run_master(*room_files, ['mv all up', 'exit'], '-shards', '2')
+    assert status == 0
+    assert 'Traceback' not in output
+    assert output.rstrip().endswith('? ? ? ? ? ? ? ? ? ?')
+    assert output.count("Our information about the room so far:") == 3
+
+
+def test_script_exit(room_files):
+    status, output = run_master(*room_files, ['mv all down'], '-shards', '2', '-script', '-')
+    assert status == 0
+
+
+def test_same_as_inproc_across_bands(tmp_path):
+    room, robots = str(tmp_path / 'room.txt'), str(tmp_path / 'robots.txt')
+    generate_room(room, 12, 9, 0.15, 0, seed=3)
+    generate_robots(robots, room, 30, seed=3)
+    commands = []
+    for step, direction in enumerate(['down', 'up', 'left', 'down', 'right', 'down', 'up', 'up'] * 3):
+        commands.append(f'mv all {direction}')
+        if step == 2:
+            commands.append('suspend 7')
+        if step == 10:
+            commands.append('resume 7')
+        commands.append(f'mv {step + 1} {direction}')
+    commands += ['pos all', 'bat all', 'coverage', 'room', 'exit']
+    inproc = run_master(room, robots, commands, '-inproc', '-render', 'off')
+    sharded = run_master(room, robots, commands, '-shards', '4', '-render', 'off')
+    assert inproc[0] == sharded[0] == 0
+    assert without_stats(sharded[1]) == without_stats(inproc[1])
+
+
+# The robots after the one finding the last treasure do not move
+@pytest.mark.parametrize('seed', range(4))
+def test_hunt_ends_as_with_inproc(tmp_path, seed):
+    room, robots = str(tmp_path / 'room.txt'), str(tmp_path / 'robots.txt')
+    generate_room(room, 12, 9, 0.1, 3, seed=seed)
+    generate_robots(robots, room, 40, seed=seed)
+    commands = [f'mv all {direction}' for direction in ['down', 'left', 'down', 'right', 'up', 'right', 'up', 'left'] * 6]
+    commands += ['room', 'exit']
+    inproc = run_master(room, robots, commands, '-inproc', '-render', 'off')
+    sharded = run_master(room, robots, commands, '-shards', '3', '-render', 'off')
+    assert "All treasures found!" in inproc[1]
+    assert inproc[0] == sharded[0] == 0
+    assert without_stats(sharded[1]) == without_stats(inproc[1])
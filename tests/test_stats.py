@@ -0,0 +1,34 @@
+from stats import BUCKETS, Histogram, RobotStats
+
+
+def test_histogram_buckets_by_powers_of_two():
+    histogram = Histogram()
+    for seconds in (0.0000005, 0.000003, 0.000003, 0.001, 1000.0):
+        histogram.record(seconds)
+    assert histogram.count == 5
+    assert histogram.counts[0] == 1  # Below a microsecond
+    assert histogram.counts[2] == 2  # [2, 4) us
+    assert histogram.counts[10] == 1  # [512, 1024) us
+    assert histogram.counts[BUCKETS - 1] == 1  # Everything above
+    assert histogram.max == 1000.0
+    assert histogram.percentile(0.5) == 4 / 1e6
+    assert histogram.percentile(1.0) == 1000.0
+
+
+def test_percentile_is_capped_at_the_largest_latency():
+    histogram = Histogram()
+    histogram.record(0.0003)
+    assert histogram.percentile(0.99) == 0.0003
+    assert Histogram().percentile(0.5) == 0.0
+
+
+def test_robot_stats_count_each_command_and_merge_them():
+    stats = RobotStats()
+    stats.record("mv up", 0.001)
+    stats.record("mv left", 0.003)
+    stats.record("tr", 0.002)
+    assert {command: histogram.count for command, histogram in stats.latencies.items()} == {'mv': 2, 'tr': 1}
+    total = stats.total()
+    assert total.count == 3
+    assert abs(total.mean() - 0.002) < 1e-12
+    assert total.max == 0.003
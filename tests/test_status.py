@@ -0,0 +1,117 @@
+import multiprocessing
+import threading
+import time
+
+import status
+from status import StatusTable
+
+
+def make_table(tmp_path, slots=2):
+    return StatusTable(str(tmp_path / 'robots.status'), slots=slots)
+
+
+def test_unwritten_slot_reads_none(tmp_path):
+    table = make_table(tmp_path)
+    assert table.read(0) is None
+    assert table.sequence(0) == 0
+
+
+def test_battery_drains_while_running(tmp_path):
+    table = make_table(tmp_path)
+    table.write(0, 1, (2, 3), 100, 10.0, 1.0, False)
+    assert table.read(0, now=12.5) == (1, (2, 3), 98, False)
+    table.write(0, 1, (2, 3), 100, 10.0, 1.0, True)
+    assert table.read(0, now=12.5) == (1, (2, 3), 100, True)
+    assert table.sequence(0) % 2 == 0
+
+
+# Write slot 0 as fast as possible for seconds, every write with the same
+# number as id, row and col
+def write_for(filename, seconds):
+    table = StatusTable(filename)
+    deadline = time.monotonic() + seconds
+    value = 0
+    while time.monotonic() < deadline:
+        value += 1
+        table.write(0, value, (value, value), 100, time.monotonic(), 1.0, False)
+
+
+def test_reader_never_sees_half_a_write(tmp_path):
+    table = make_table(tmp_path)
+    table.write(0, 0, (0, 0), 100, time.monotonic(), 1.0, False)
+    writer = multiprocessing.get_context('fork').Process(target=write_for, args=(table.filename, 0.5))
+    writer.start()
+    reads = 0
+    last = 0
+    while writer.is_alive():
+        robot_id, (row, col), _, _ = table.read(0)
+        assert robot_id == row == col
+        assert robot_id >= last
+        last = robot_id
+        reads += 1
+    writer.join()
+    assert writer.exitcode == 0
+    assert reads and last > 0
+
+
+def test_wait_write_sees_the_next_write(tmp_path):
+    table = make_table(tmp_path)
+    table.write(0, 1, (2, 3), 100, time.monotonic(), 1.0, False)
+    sequence = table.sequence(0)
+    writer = threading.Timer(0.05, table.write, (0, 1, (2, 3), 100, time.monotonic(), 1.0, True))
+    writer.start()
+    assert table.wait_write(0, sequence, time.monotonic() + 5)
+    assert table.read(0)[3]
+    writer.join()
+
+
+def test_wait_write_gives_up_at_the_deadline(tmp_path):
+    table = make_table(tmp_path)
+    table.write(0, 1, (2, 3), 100, time.monotonic(), 1.0, False)
+    assert not table.wait_write(0, table.sequence(0), time.monotonic() + 0.05)
+    assert not table.wait_write(1, table.sequence(1), time.monotonic() + 0.05)
+
+
+# _FIELDS whose first pack_into runs a write of the slot first, as a signal
+# handler of the robot would between the two
+class InterruptedFields:
+    def __init__(self, table, nested_values):
+        self._slot = status._FIELDS
+        self._table = table
+        self._nested_values = nested_values
+        self.sequences = []  # Sequence number of the slot after the nested write
+        self.size = status._FIELDS.size
+
+    def pack_into(self, *args):
+        if self._nested_values is not None:
+            values, self._nested_values = self._nested_values, None
+            self._table.write(*values)
+            self.sequences.append(self._table.sequence(0))
+        self._slot.pack_into(*args)
+
+
+def test_interrupting_write_is_made_after_the_interrupted_one(tmp_path, monkeypatch):
+    table = make_table(tmp_path)
+    table.write(0, 1, (2, 3), 100, time.monotonic(), 1.0, False)
+    before = table.sequence(0)
+    fields = InterruptedFields(table, (0, 1, (5, 5), 50, time.monotonic(), 1.0, True))
+    monkeypatch.setattr(status, '_FIELDS', fields)
+    table.write(0, 1, (2, 4), 100, time.monotonic(), 1.0, False)
+    monkeypatch.undo()
+    # The slot stayed odd, under the interrupted write's number, and the
+    # interrupting write came last with a number of its own
+    assert fields.sequences == [before + 1]
+    assert table.sequence(0) == before + 4
+    assert table.read(0) == (1, (5, 5), 50, True)
+    table.write(0, 1, (2, 4), 100, time.monotonic(), 1.0, False)
+    assert table.read(0)[1] == (2, 4)
+
+
+def test_read_gives_up_on_a_write_that_never_ends(tmp_path):
+    table = make_table(tmp_path)
+    table.write(0, 1, (2, 3), 100, time.monotonic(), 1.0, False)
+    # The robot was killed between the two stores of its sequence number
+    table._map[status._HEADER.size:status._HEADER.size + 8] = status._SEQUENCE.pack(table.sequence(0) + 1)
+    start = time.monotonic()
+    assert table.read(0) is None
+    assert time.monotonic() - start < 1
@@ -0,0 +1,58 @@
+import socket
+import subprocess
+import sys
+
+from conftest import ROOT, run_master
+from test_master import without_batteries
+from transport import ConnectionPool, listen, parse_address
+
+
+def test_address_host_defaults_to_the_loopback():
+    assert parse_address('10.0.0.2:7001\n') == ('10.0.0.2', 7001)
+    assert parse_address(':7002') == ('127.0.0.1', 7002)
+
+
+def test_pool_keeps_one_connection_per_address():
+    server = listen(('127.0.0.1', 0))
+    address = server.getsockname()
+    pool = ConnectionPool(timeout=1.0)
+    try:
+        connection = pool.get(address)
+        assert pool.get(address) is connection
+        assert connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    finally:
+        pool.close_all()
+        server.close()
+
+
+# Ports nothing listens on for the robot servers
+def free_ports(count):
+    sockets = [listen(('127.0.0.1', 0)) for _ in range(count)]
+    ports = [server.getsockname()[1] for server in sockets]
+    for server in sockets:
+        server.close()
+    return ports
+
+
+def test_robot_servers_answer_as_local_robots(room_files, tmp_path):
+    room, robots = room_files
+    addresses = [f'127.0.0.1:{port}' for port in free_ports(3)]
+    hosts = tmp_path / 'hosts.txt'
+    hosts.write_text(''.join(address + '\n' for address in addresses))
+    servers = [subprocess.Popen([sys.executable, 'robot.py', '-f', room, '-listen', address],
+                                stderr=subprocess.DEVNULL, cwd=ROOT)
+               for address in addresses]
+    commands = ['mv all left', 'mv 1 down 2', 'suspend 2', 'mv all up', 'mv 2 right', 'resume 2', 'mv all right',
+                'refill 3', 'pos all', 'exit']
+    try:
+        remote = run_master(room, robots, commands, '-render', 'off', '-hosts', str(hosts))
+        for server in servers:
+            server.wait(timeout=10)  # exit ends the servers too
+    finally:
+        for server in servers:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+    local = run_master(room, robots, commands, '-render', 'off')
+    assert remote[0] == local[0] == 0
+    assert without_batteries(remote[1]) == without_batteries(local[1])
@@ -0,0 +1,107 @@
+# TCP transport between the master and robots running as servers.
+#
+# python robot.py -f room.bin -listen HOST:PORT runs a robot as a server,
+# on this machine or another one with the same room file. The master is
+# given a hosts file (master.py -hosts) with one HOST:PORT per line, the
+# n-th robot of the robots file running on the n-th server. It opens one
+# persistent connection per server, kept in a ConnectionPool for the whole
+# run, and talks the framed protocol of protocol.py over it. The robot's
+# id, position and battery come from the master in an init message.
+#
+# Servers cannot be sent signals by the master, so suspend, resume, refill
+# and status are in-band commands instead.
+#
+# Many servers can be started on one machine for testing with
+# python transport.py room.bin [-host 127.0.0.1] [-port 7000] [-count 10] [-o hosts.txt]
+# which runs them until it is interrupted.
+
+import argparse
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+CONNECT_TIMEOUT = 10.0  # Seconds to wait for a server that is still starting
+# In-band commands that replace the signals the master sends to local robots
+CONTROL_COMMANDS = {signal.SIGINT: 'suspend', signal.SIGQUIT: 'resume', signal.SIGUSR1: 'refill'}
+
+
+# Return (host, port) from HOST:PORT, the host defaults to the loopback
+def parse_address(text):
+    host, _, port = text.strip().rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+class ConnectionPool:
+    def __init__(self, timeout=CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self._connections = {}  # K = (host, port), V = socket
+
+    # Return the connection to address, opening it on first use
+    def get(self, address):
+        connection = self._connections.get(address)
+        if connection is None:
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    connection = socket.create_connection(address, timeout=self.timeout)
+                    break
+                except ConnectionRefusedError:
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.05)
+            connection.settimeout(None)
+            # Commands and replies are small, send them at once
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections[address] = connection
+        return connection
+
+    def close_all(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+
+# Server socket a robot accepts the master's connections on
+def listen(address):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen(1)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('room_filename')
+    parser.add_argument('-host', '--host', default='127.0.0.1')
+    parser.add_argument('-port', '--port', type=int, default=7000)
+    parser.add_argument('-count', '--count', type=int, default=10)
+    parser.add_argument('-o', '--output', help='write the hosts file for master.py -hosts here')
+    args = parser.parse_args()
+
+    addresses = [f'{args.host}:{args.port + i}' for i in range(args.count)]
+    servers = [subprocess.Popen([sys.executable, 'robot.py', '-f', args.room_filename,
+                                 '-listen', address], stderr=subprocess.DEVNULL,
+                                start_new_session=True)  # Ctrl-C is for this script only
+               for address in addresses]
+    hosts = '\n'.join(addresses) + '\n'
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(hosts)
+    else:
+        sys.stdout.write(hosts)
+    sys.stdout.flush()
+    try:
+        for server in servers:
+            server.wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()